@@ -1,10 +1,111 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     """Manages application settings."""
     PROJECT_NAME: str = "Image Fetcher Project"
     CLIP_FILTER_THRESHOLD: float = 0.28
+    CLIP_MODEL_NAME: str = "openai/clip-vit-base-patch32"  # Hub id or local directory
+    CLIP_BACKEND: str = "torch"         # "torch" (fp32), "int8" (dynamic quantization), "onnx", or "stub" (no model, for benchmarks)
+    CLIP_BATCH_SIZE: int = 16           # Images a job hands to the inference service at a time
+    CLIP_BATCH_MAX_WAIT: float = 0.25   # Seconds the micro-batcher waits to fill a batch
+    CLIP_CACHE_ENABLED: bool = True     # Reuse image embeddings across jobs (stored under DATA_ROOT/cache)
+    CLIP_CACHE_MAX_MB: int = 1024       # Total size of cached embeddings on disk (LRU eviction)
+    CLIP_TEXT_CACHE_SIZE: int = 256     # Query embeddings kept in memory per worker
+
+    # Inference service: batches CLIP work across all running jobs
+    INFERENCE_MAX_BATCH_SIZE: int = 32
+    INFERENCE_MAX_WAIT: float = 0.05    # Seconds to wait for a batch to fill
+    PIPELINE_CLIP_INFLIGHT: int = 4     # Chunks a single job may have queued for inference
+    TORCH_NUM_THREADS: int = 0          # 0 = cores divided by WORKER_PROCESSES
+
+    # Deduplication: phashes within this many bits (of 64) count as the same image. 0 = exact only.
+    DEDUP_MAX_DISTANCE: int = 4
+    PHASH_BATCH_SIZE: int = 16
+    PHASH_DECODE_THREADS: int = 4
+    # Decode JPEGs at reduced scale for hashing (never below PHASH_DRAFT_SIZE px).
+    # Off = hashes identical to imagehash.phash on the full-resolution decode.
+    PHASH_DRAFT: bool = True
+    PHASH_DRAFT_SIZE: int = 256
+
+    # Shared image loader: each file is decoded once per worker and reused by hashing, CLIP and renditions
+    IMAGE_CACHE_MAX_MB: int = 256       # Decoded pixels kept in memory per worker process
+
+    # Streaming pipeline
+    PIPELINE_QUEUE_SIZE: int = 32       # Bound on each inter-stage queue
+    PIPELINE_HASH_WORKERS: int = 4
+
+    # Job scheduler
+    SCHEDULER_POLL_SECONDS: int = 30
+    SCHEDULER_SLOTS: int = 2                 # Jobs run concurrently per app process
+    SCHEDULER_PAID_RESERVED_SLOTS: int = 1   # Slots FREE jobs may never take; must be below SCHEDULER_SLOTS
+    JOB_LEASE_SECONDS: int = 120             # A claim expires unless heartbeated within this
+
+    # Worker pools (keep pipeline work off the web server's event loop)
+    WORKER_POOL_MODE: str = "process"   # "process" or "thread"
+    WORKER_PROCESSES: int = 2
+    WORKER_START_METHOD: str = "spawn"  # gunicorn.conf.py defaults this to "fork" under preload_app, to share the CLIP preloaded in the master; only safe while the parent never runs torch
+    WORKER_IO_THREADS: int = 8
+    WORKER_PRELOAD_CLIP: bool = True
+    WORKER_WARMUP: bool = True          # Start the CPU pool and load CLIP in the background at startup; gunicorn.conf.py defaults it to false when spawned workers would each load a private copy
+    PRELOAD_CLIP_BEFORE_FORK: bool = True  # gunicorn preload_app: load torch + CLIP once in the master (see gunicorn.conf.py)
     PEXELS_API_KEY: str = "YOUR_DEFAULT_KEY_IF_NOT_IN_ENV"
+    PEXELS_API_URL: str = "https://api.pexels.com/v1"
+    PEXELS_MAX_PAGES: int = 50
+    PEXELS_SEARCH_CONCURRENCY: int = 4
+    # Which Pexels rendition to download per JobType: original / large2x / large / medium.
+    # Originals are often 5-20 MB; CLIP and the results page need far less.
+    PEXELS_RENDITION_FREE: str = "large"
+    PEXELS_RENDITION_PAID: str = "large2x"
+
+    # Image Download Configuration
+    FETCH_CONCURRENCY: int = 8          # Max downloads in flight per job
+    FETCH_RATE_LIMIT: float = 10.0      # Requests per second (adapts down on 429s)
+    FETCH_MAX_RETRIES: int = 3
+    FETCH_BACKOFF_BASE: float = 0.5     # Seconds; doubled per attempt, with full jitter
+    FETCH_BACKOFF_MAX: float = 30.0
+    FETCH_TIMEOUT: float = 20.0
+
+    # Rendition (thumbnail) Configuration
+    RENDITION_WIDTHS: list[int] = [320, 640, 1280]
+    RENDITION_FORMATS: list[str] = ["webp", "jpeg"]
+    RENDITION_QUALITY: int = 80
+    RENDITION_BATCH_SIZE: int = 8       # Images per worker task
+
+    # Ranking: relevant candidates are scored on CLIP + quality, then picked for diversity (MMR)
+    RANK_CANDIDATE_FACTOR: float = 1.5  # Relevant candidates to find per requested image before stopping early
+    RANK_POOL_FACTOR: float = 1.25      # Best candidates kept (bounded heap) for the diversity pass
+    RANK_QUALITY_WEIGHT: float = 2.0    # CLIP logit points a perfect quality score is worth
+    RANK_MMR_LAMBDA: float = 0.7        # 1 = relevance only, lower = more diversity
+    RANK_TARGET_MEGAPIXELS: float = 2.0 # Resolution that earns the full resolution score
+
+    # Query Result Cache: new jobs are filled from earlier jobs' results for the same query first
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL_HOURS: float = 72
+    RESULT_CACHE_MAX_MB: int = 2048
+    RESULT_CACHE_MAX_IMAGES: int = 500  # Per query
+
+    # Blob Storage: downloaded photos are stored once and hard-linked into each job's folder
+    STORAGE_MAX_MB: int = 10240         # Unreferenced blobs are deleted (oldest first) beyond this
+
+    # Retention: finished jobs (their files and DB rows) are deleted after this many days
+    RETENTION_FREE_DAYS: float = 7
+    RETENTION_PAID_DAYS: float = 30
+    RETENTION_FAILED_DAYS: float = 1
+    RETENTION_INTERVAL_MINUTES: int = 10
+    RETENTION_BATCH_SIZE: int = 20      # Jobs expired per run, so a run never holds SQLite for long
+
+    # Profiling: jobs listed here are profiled while they run (cProfile + sampled stacks, under DATA_ROOT/profiles)
+    PROFILE_JOB_IDS: list[int] = []
+    PROFILE_SAMPLE_INTERVAL: float = 0.005  # Seconds between stack samples
+
+    # Download Archive Configuration
+    ARCHIVE_CACHE_MAX_MB: int = 2048    # Total size of pre-built job ZIPs kept on disk (LRU eviction)
+
+    # Live progress, streamed to the results page at /api/jobs/{id}/events
+    PROGRESS_QUEUE_SIZE: int = 64       # Events buffered per watcher; a slow watcher loses the oldest
+    PROGRESS_POLL_SECONDS: float = 2.0  # Jobs running in another process: one status read per job per interval
+    PROGRESS_HEARTBEAT_SECONDS: float = 15.0  # Keep-alive comment on idle streams
 
     # Email Configuration
     MAIL_USERNAME: str
@@ -22,6 +123,27 @@ class Settings(BaseSettings):
 
     MAIL_BACKEND: str = "smtp"
 
+    # Notification dispatch (runs on its own schedule, separate from job processing)
+    BASE_URL: str = "http://127.0.0.1:8000"  # Public address used in the links we email
+    NOTIFY_POLL_SECONDS: int = 15
+    NOTIFY_CONCURRENCY: int = 4         # Pooled SMTP connections, and so emails in flight
+    NOTIFY_BATCH_SIZE: int = 50         # Jobs claimed (and status updates committed) per batch
+    NOTIFY_MAX_ATTEMPTS: int = 5        # Per job, then we stop trying
+    NOTIFY_BACKOFF_BASE: float = 60.0   # Seconds before the first retry; doubled per attempt
+    NOTIFY_BACKOFF_MAX: float = 3600.0
+    NOTIFY_CLAIM_SECONDS: int = 300     # How long a claimed notification is hidden from other workers
+    NOTIFY_SMTP_TIMEOUT: float = 30.0
+    NOTIFY_SMTP_IDLE_SECONDS: float = 60.0  # Close pooled connections idle longer than this
+
+    @model_validator(mode="after")
+    def _check_scheduler_slots(self):
+        if self.SCHEDULER_PAID_RESERVED_SLOTS >= self.SCHEDULER_SLOTS:
+            raise ValueError(
+                "SCHEDULER_PAID_RESERVED_SLOTS must be less than SCHEDULER_SLOTS, "
+                "or FREE jobs would never run (set it to 0 to reserve none)."
+            )
+        return self
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -18,4 +18,21 @@ STATIC_DIR = APP_DIR / "static"
 # This makes it compatible with both free and paid Render plans.
 DATA_ROOT = Path(os.environ.get("RENDER_DISK_PATH", PROJECT_ROOT))
 DOWNLOADS_DIR = DATA_ROOT / "downloads"
-DATABASE_FILE = DATA_ROOT / "jobs.db"
\ No newline at end of file
+CACHE_DIR = DATA_ROOT / "cache"
+BLOBS_DIR = DATA_ROOT / "blobs"  # Content store; job folders hold hard links into it
+PROFILES_DIR = DATA_ROOT / "profiles"  # Per-job profiles, see services/profiling.py
+DATABASE_FILE = DATA_ROOT / "jobs.db"
+
+# SQLite tuning (app/models/job.py). Read from the environment here rather than from
+# Settings, so the models import without the mail credentials Settings requires.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))  # How long a writer waits for the lock before "database is locked"
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable across app crashes in WAL mode; FULL also across power loss
+SQLITE_CACHE_MB = int(os.environ.get("SQLITE_CACHE_MB", 16))  # Page cache per connection
+
+def download_url(path) -> str | None:
+    """Public URL of a file under DOWNLOADS_DIR, as served by the /downloads mount."""
+    try:
+        relative = Path(path).resolve().relative_to(DOWNLOADS_DIR.resolve())
+    except ValueError:
+        return None
+    return "/downloads/" + relative.as_posix()
@@ -0,0 +1,198 @@
+"""
+Interchangeable CLIP inference backends, selected with settings.CLIP_BACKEND:
+
+  torch  PyTorch fp32 (CUDA when available). The reference implementation.
+  int8   PyTorch with nn.Linear layers dynamically quantized to int8. CPU only.
+  onnx   The image and text towers exported to ONNX and run with ONNX Runtime.
+         The export happens once and is stored under DATA_ROOT/cache/onnx.
+  stub   No model: cheap, deterministic features from a tiny thumbnail. For
+         offline benchmarks on machines without the model; scores are meaningless.
+
+Every backend takes preprocessed numpy inputs from CLIPProcessor and returns
+the projected (not yet normalized) feature vectors as float32 numpy arrays.
+torch, transformers and onnxruntime are imported lazily.
+"""
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from app.core.paths import CACHE_DIR
+
+BACKENDS = ("torch", "int8", "onnx", "stub")
+
+
+def _projected(features):
+    """get_*_features returns a tensor in transformers 4.x and a model output (pooler_output) in 5.x."""
+    return getattr(features, "pooler_output", features)
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str, num_threads: int):
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+
+        torch.set_num_threads(num_threads)
+        self._torch = torch
+        self.device = "cuda" if torch.cuda.is_available() and self.name == "torch" else "cpu"
+        self.model = self._prepare(CLIPModel.from_pretrained(model_name).eval()).to(self.device)
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        self.logit_scale = self.model.logit_scale.exp().item()
+
+    def _prepare(self, model):
+        return model
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        with self._torch.no_grad():
+            features = self.model.get_image_features(pixel_values=self._torch.from_numpy(pixel_values).to(self.device))
+        return _projected(features).float().cpu().numpy()
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        with self._torch.no_grad():
+            features = self.model.get_text_features(
+                input_ids=self._torch.from_numpy(input_ids).to(self.device),
+                attention_mask=self._torch.from_numpy(attention_mask).to(self.device),
+            )
+        return _projected(features).float().cpu().numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    name = "int8"
+
+    def _prepare(self, model):
+        # Dynamic quantization: weights stored as int8, activations quantized per batch.
+        # Roughly a quarter of the fp32 weight memory and faster matmuls on CPU.
+        return self._torch.ao.quantization.quantize_dynamic(model, {self._torch.nn.Linear}, dtype=self._torch.qint8)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_name: str, num_threads: int):
+        import onnxruntime
+        from transformers import CLIPProcessor
+
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        export_dir = CACHE_DIR / "onnx" / model_name.strip("/").replace("/", "--")
+        if not (export_dir / "image.onnx").exists() or not (export_dir / "text.onnx").exists():
+            self._export(model_name, export_dir)
+        self.logit_scale = float(np.load(export_dir / "logit_scale.npy"))
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        providers = ["CPUExecutionProvider"]
+        self.image_session = onnxruntime.InferenceSession(str(export_dir / "image.onnx"), options, providers=providers)
+        self.text_session = onnxruntime.InferenceSession(str(export_dir / "text.onnx"), options, providers=providers)
+
+    @staticmethod
+    def _export(model_name: str, export_dir: Path):
+        import torch
+        from transformers import CLIPModel
+
+        print(f"📦 Exporting CLIP towers to ONNX in {export_dir} (one-off)...")
+        clip = CLIPModel.from_pretrained(model_name).eval()
+
+        class ImageTower(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.clip = clip
+
+            def forward(self, pixel_values):
+                return _projected(self.clip.get_image_features(pixel_values=pixel_values))
+
+        class TextTower(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.clip = clip
+
+            def forward(self, input_ids, attention_mask):
+                return _projected(self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+        export_dir.mkdir(parents=True, exist_ok=True)
+        size = clip.config.vision_config.image_size
+        # Export to temp names and rename, so a crash mid-export can't leave a half-written model behind.
+        with torch.no_grad():
+            torch.onnx.export(
+                ImageTower(), (torch.zeros(1, 3, size, size),), str(export_dir / "image.onnx.tmp"),
+                input_names=["pixel_values"], output_names=["features"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "features": {0: "batch"}},
+                dynamo=False,
+            )
+            tokens = torch.ones(1, 8, dtype=torch.long)
+            torch.onnx.export(
+                TextTower(), (tokens, tokens), str(export_dir / "text.onnx.tmp"),
+                input_names=["input_ids", "attention_mask"], output_names=["features"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                              "attention_mask": {0: "batch", 1: "sequence"},
+                              "features": {0: "batch"}},
+                dynamo=False,
+            )
+        np.save(export_dir / "logit_scale.npy", np.float32(clip.logit_scale.exp().item()))
+        os.replace(export_dir / "image.onnx.tmp", export_dir / "image.onnx")
+        os.replace(export_dir / "text.onnx.tmp", export_dir / "text.onnx")
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.image_session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.text_session.run(None, {
+            "input_ids": input_ids.astype(np.int64),
+            "attention_mask": attention_mask.astype(np.int64),
+        })[0]
+
+
+class _StubProcessor:
+    """Mimics the parts of CLIPProcessor the pipeline uses, without transformers."""
+
+    side = 8  # Images become side x side RGB, i.e. 192-dimensional features
+
+    def __call__(self, text=None, images=None, return_tensors="np", padding=True):
+        if images is not None:
+            pixels = [
+                np.asarray(image.convert("RGB").resize((self.side, self.side)), dtype=np.float32) / 255.0
+                for image in images
+            ]
+            return {"pixel_values": np.stack(pixels)}
+        input_ids = np.array([[zlib.crc32(t.encode("utf-8"))] for t in text], dtype=np.int64)
+        return {"input_ids": input_ids, "attention_mask": np.ones_like(input_ids)}
+
+
+class StubBackend:
+    """
+    Stands in for CLIP where the model isn't available (e.g. CI or an offline
+    benchmark). Images map to their mean-centred colour thumbnail, so identical
+    and near-identical images still get near-identical vectors; a query maps to
+    a pseudo-random vector seeded by its text.
+    """
+    name = "stub"
+
+    def __init__(self, model_name: str, num_threads: int):
+        self.processor = _StubProcessor()
+        self.logit_scale = 1.0
+        self._dim = 3 * _StubProcessor.side ** 2
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        flat = pixel_values.reshape(len(pixel_values), -1)
+        return (flat - flat.mean(axis=1, keepdims=True) + 1e-6).astype(np.float32)
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return np.stack([
+            np.random.default_rng(int(seed)).standard_normal(self._dim).astype(np.float32) for seed in input_ids[:, 0]
+        ])
+
+
+def load_backend(name: str, model_name: str, num_threads: int):
+    """Instantiates the named backend. Unknown names fall back to fp32 torch."""
+    if name == "stub":
+        return StubBackend(model_name, num_threads)
+    if name == "int8":
+        return QuantizedTorchBackend(model_name, num_threads)
+    if name == "onnx":
+        return OnnxBackend(model_name, num_threads)
+    if name != "torch":
+        print(f"⚠️ WARNING: Unknown CLIP_BACKEND '{name}'. Using 'torch'.")
+    return TorchBackend(model_name, num_threads)
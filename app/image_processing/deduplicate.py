@@ -1,36 +1,96 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.fftpack
 from PIL import Image
-import imagehash
+
+from app.core.config import settings
+from app.image_processing import image_loader
+from app.image_processing.hash_index import HammingIndex
+
+HASH_SIZE = 8
+IMG_SIZE = HASH_SIZE * 4  # imagehash.phash's default highfreq_factor
+
+
+def _load_hash_input(image_path: str, draft: bool) -> np.ndarray | None:
+    """
+    Decodes one image to the 32x32 grayscale array phash works on.
+    With `draft`, the pixels come from the shared image loader (a reduced-scale
+    decode that CLIP and renditions reuse), downscaled to PHASH_DRAFT_SIZE;
+    otherwise the file is decoded at full resolution.
+    """
+    try:
+        if draft:
+            img = image_loader.load(image_path, max_side=settings.PHASH_DRAFT_SIZE)
+            return np.asarray(img.convert("L").resize((IMG_SIZE, IMG_SIZE), Image.Resampling.LANCZOS))
+        with Image.open(image_path) as img:
+            small = img.convert("L").resize((IMG_SIZE, IMG_SIZE), Image.Resampling.LANCZOS)
+            return np.asarray(small)
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not process file {os.path.basename(image_path)}. Error: {e}. Skipping.")
+        return None
+
+
+def hash_arrays(pixels: np.ndarray) -> list[int]:
+    """
+    Computes phash for a stack of 32x32 grayscale images (shape N x 32 x 32) in one go.
+    Uses the same transform as imagehash.phash, so results match it bit for bit.
+    """
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    low = dct[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), -1)
+    bits = low > np.median(low, axis=1, keepdims=True)
+    # Row-major, first bit most significant: the same order as str(imagehash.phash(...)).
+    return [int.from_bytes(row.tobytes(), "big") for row in np.packbits(bits, axis=1)]
+
+
+def phash_batch(image_paths: list[str], draft: bool | None = None) -> list[int | None]:
+    """
+    Returns the 64-bit perceptual hash of each image (None where unreadable).
+    Decoding is spread over PHASH_DECODE_THREADS threads (Pillow releases the GIL
+    while decoding), then the DCT for the whole batch runs as array operations.
+    """
+    draft = settings.PHASH_DRAFT if draft is None else draft
+    if len(image_paths) == 1:
+        decoded = [_load_hash_input(image_paths[0], draft)]
+    else:
+        with ThreadPoolExecutor(max_workers=settings.PHASH_DECODE_THREADS) as pool:
+            decoded = list(pool.map(lambda path: _load_hash_input(path, draft), image_paths))
+
+    ok = [i for i, pixels in enumerate(decoded) if pixels is not None]
+    hashes: list[int | None] = [None] * len(image_paths)
+    if ok:
+        for i, value in zip(ok, hash_arrays(np.stack([decoded[i] for i in ok]))):
+            hashes[i] = value
+    return hashes
+
+
+def compute_phash(image_path: str) -> int | None:
+    """Returns the 64-bit perceptual hash of a single image, or None if it can't be read."""
+    return phash_batch([image_path])[0]
+
 
 def deduplicate_images(image_paths: list[str], job_id: int) -> list[str]:
     """
-    Finds and removes duplicate images using perceptual hashing.
+    Finds and removes duplicate and near-duplicate images using perceptual hashing.
+    Images within DEDUP_MAX_DISTANCE bits of one already kept are treated as copies.
     """
     print(f"[JOB {job_id}] 🔎 Starting deduplication process for {len(image_paths)} images...")
-    
-    seen_hashes = set()
+
+    seen_hashes = HammingIndex(settings.DEDUP_MAX_DISTANCE)
     unique_image_paths = []
 
     if not image_paths:
         return []
 
-    for image_path in image_paths:
-        try:
-            with Image.open(image_path) as img:
-                hash_value = imagehash.phash(img)
-            
-            if hash_value in seen_hashes:
-                continue
-            
-            seen_hashes.add(hash_value)
-            unique_image_paths.append(image_path)
-
-        except Exception as e:
-            print(f"[JOB {job_id}] ⚠️ WARNING: Could not process file {os.path.basename(image_path)}. Error: {e}. Skipping.")
+    for image_path, hash_value in zip(image_paths, phash_batch(image_paths)):
+        if hash_value is None or seen_hashes.has_near(hash_value):
             continue
-    
+
+        seen_hashes.add(hash_value, image_path)
+        unique_image_paths.append(image_path)
+
     num_duplicates = len(image_paths) - len(unique_image_paths)
     print(f"[JOB {job_id}] ✨ Deduplication complete. Removed {num_duplicates} duplicates, {len(unique_image_paths)} unique images remain.")
-    
-    return unique_image_paths
 
+    return unique_image_paths
@@ -0,0 +1,234 @@
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from app.core.config import settings
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
+)
+
+# Status codes that mean "slow down and try again" rather than "this URL is broken".
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that adapts to server push-back.
+    A 429/Retry-After halves the refill rate and pauses every caller until the
+    server's deadline; each success then nudges the rate back towards its ceiling.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_penalty = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, stop: threading.Event | None = None) -> bool:
+        """Blocks until a token is available. Returns False if `stop` was set while waiting."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_for = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            if stop is not None:
+                if stop.wait(wait_for):
+                    return False
+            else:
+                time.sleep(wait_for)
+
+    def penalize(self, retry_after: float | None = None):
+        """Called on a 429: back off multiplicatively and honour the server's Retry-After."""
+        with self._lock:
+            now = time.monotonic()
+            # Requests already in flight when the server pushed back will all see a 429;
+            # count them as a single signal rather than collapsing the rate to the floor.
+            if now - self._last_penalty >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_penalty = now
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def reward(self):
+        """Called on a success: recover the rate additively."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + max(0.1, self.max_rate / 20))
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """Parses a Retry-After header given either as delta-seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    ceiling = min(settings.FETCH_BACKOFF_MAX, settings.FETCH_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def get_file_extension(url: str) -> str:
+    ext = os.path.splitext(urlparse(url).path)[1]
+    return ext if ext else ".jpg"
+
+
+def create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _download_one(session: requests.Session, url: str, dest_dir: Path, bucket: TokenBucket,
+                  stop: threading.Event, job_id: int) -> Path | None:
+    """
+    Downloads a single URL into a temporary file inside `dest_dir` (which must be
+    on the same filesystem as the final path), retrying transient failures.
+    Returns the temp path, or None if the download failed.
+    """
+    for attempt in range(settings.FETCH_MAX_RETRIES + 1):
+        if not bucket.acquire(stop):
+            return None
+        tmp_path = dest_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            with session.get(url, timeout=settings.FETCH_TIMEOUT, stream=True) as response:
+                if response.status_code in RETRYABLE_STATUS:
+                    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                    if response.status_code == 429:
+                        bucket.penalize(retry_after)
+                    if attempt < settings.FETCH_MAX_RETRIES:
+                        stop.wait(retry_after if retry_after is not None else _backoff_delay(attempt))
+                        continue
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if stop.is_set():
+                            raise InterruptedError("download cancelled")
+                        f.write(chunk)
+            bucket.reward()
+            return tmp_path
+        except InterruptedError:
+            tmp_path.unlink(missing_ok=True)
+            return None
+        except requests.RequestException as e:
+            tmp_path.unlink(missing_ok=True)
+            status = e.response.status_code if e.response is not None else None
+            if (status is None or status in RETRYABLE_STATUS) and attempt < settings.FETCH_MAX_RETRIES:
+                stop.wait(_backoff_delay(attempt))
+                continue
+            print(f"[JOB {job_id}][ERROR] Failed to download {url}: {e}")
+            return None
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            print(f"[JOB {job_id}][ERROR] Failed to write {url}: {e}")
+            return None
+    return None
+
+
+def iter_downloads(urls: Iterable[str], dest_dir: Path, limit: int, job_id: int,
+                   concurrency: int | None = None, rate: float | None = None,
+                   dest_for: Callable[[str], Path] | None = None) -> Iterator[tuple[str, str]]:
+    """
+    Downloads `urls` concurrently and yields `(url, file_path)` as each file lands,
+    stopping once `limit` files have been saved. Files are named `image_NNNN<ext>`
+    in `dest_dir` in the order they complete, or saved at `dest_for(url)` if given.
+    Each file is renamed into place only once complete. Closing the generator
+    cancels outstanding work.
+    """
+    concurrency = concurrency or settings.FETCH_CONCURRENCY
+    bucket = TokenBucket(rate or settings.FETCH_RATE_LIMIT)
+    stop = threading.Event()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    url_iter = iter(urls)
+    landed = 0
+
+    session = create_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"fetch-{job_id}")
+    in_flight = {}
+    try:
+        def schedule():
+            # Never keep more requests in flight than we still need files.
+            while len(in_flight) < concurrency and landed + len(in_flight) < limit:
+                url = next(url_iter, None)
+                if url is None:
+                    return
+                temp_dir = dest_dir
+                if dest_for is not None:
+                    temp_dir = dest_for(url).parent
+                    temp_dir.mkdir(parents=True, exist_ok=True)
+                future = executor.submit(_download_one, session, url, temp_dir, bucket, stop, job_id)
+                in_flight[future] = url
+
+        schedule()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                tmp_path = future.result()
+                if tmp_path is None:
+                    continue
+                if landed >= limit:
+                    tmp_path.unlink(missing_ok=True)
+                    continue
+                if dest_for is not None:
+                    filepath = dest_for(url)
+                else:
+                    filepath = dest_dir / f"image_{landed:04d}{get_file_extension(url)}"
+                os.replace(tmp_path, filepath)
+                landed += 1
+                yield url, str(filepath)
+            if landed >= limit:
+                break
+            schedule()
+    finally:
+        stop.set()
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for future in in_flight:
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                future.result().unlink(missing_ok=True)
+        session.close()
+
+
+def download_images(urls: Iterable[str], dest_dir: Path, limit: int, job_id: int, **kwargs) -> list[str]:
+    """Convenience wrapper around `iter_downloads` that returns the saved paths."""
+    return [path for _, path in iter_downloads(urls, dest_dir, limit, job_id, **kwargs)]
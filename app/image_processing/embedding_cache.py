@@ -0,0 +1,99 @@
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+_STALE_TEMP_SECONDS = 3600
+
+
+def content_key(image_path: str) -> str:
+    """Cache key for an image file: the SHA-1 of its bytes, so copies share an entry."""
+    digest = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Stores one float32 vector per key as a small .npy file under `directory`
+    (sharded by key prefix). Writes go to a temp file and are renamed into place,
+    so several worker processes can share the cache without locking. A hit
+    refreshes the file's mtime, which `evict` uses as its recency.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.npy"
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        for key in keys:
+            try:
+                path = self._path(key)
+                found[key] = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                continue
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, vectors: dict[str, np.ndarray]):
+        for key, vector in vectors.items():
+            path = self._path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, vector.astype(np.float32))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ WARNING: Could not write embedding cache entry {key}. Error: {e}")
+
+
+def evict(root: Path, max_bytes: int) -> int:
+    """
+    Deletes the least recently used entries under `root` (every model and
+    backend's cache) until they fit in `max_bytes`, and temp files left behind
+    by interrupted writes. Returns the bytes freed.
+    """
+    if not root.exists():
+        return 0
+    entries = []
+    total = 0
+    freed = 0
+    now = time.time()
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = Path(directory) / name
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp"):
+                if now - stat.st_mtime > _STALE_TEMP_SECONDS:
+                    path.unlink(missing_ok=True)
+                    freed += stat.st_size
+                continue
+            total += stat.st_size
+            entries.append((stat.st_mtime, stat.st_size, path))
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        freed += size
+        deleted += 1
+    if deleted:
+        print(f"🧹 Embedding cache: evicted {deleted} entries, {freed / (1024 * 1024):.1f} MB freed.")
+    return freed
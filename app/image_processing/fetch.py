@@ -1,84 +1,169 @@
-import os
-import mimetypes
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+
 import requests
-import urllib3
-import time # <-- NEW: Import the time library
 
-from pexels_api import API
 from app.core.config import settings
+from app.image_processing.download import get_file_extension, iter_downloads, USER_AGENT
+from app.services import storage_service
+
+PEXELS_PAGE_SIZE = 80  # The largest page the Pexels API will return
+RENDITIONS = ("original", "large2x", "large", "medium")
+
+
+@dataclass(frozen=True)
+class PexelsPhoto:
+    """The parts of a Pexels search result the pipeline cares about."""
+    id: int
+    url: str
+    width: int
+    height: int
+
+
+def rendition_for(job_type) -> str:
+    """Returns the configured Pexels rendition (original/large2x/large/medium) for a JobType."""
+    rendition = getattr(settings, f"PEXELS_RENDITION_{job_type.value.upper()}", "original")
+    return rendition if rendition in RENDITIONS else "original"
+
 
-# (The rest of the file is mostly the same)
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+def plan_search_pages(num_wanted: int, total_results: int | None = None) -> list[int]:
+    """Works out which result pages are needed to collect `num_wanted` photos."""
+    wanted = num_wanted if total_results is None else min(num_wanted, total_results)
+    pages = math.ceil(wanted / PEXELS_PAGE_SIZE)
+    return list(range(1, min(pages, settings.PEXELS_MAX_PAGES) + 1))
 
-USER_AGENT = (
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
-)
 
-def _get_file_extension(url: str) -> str:
-    ext = os.path.splitext(url)[1]
-    return ext if ext else ".jpg"
+def _search_page(session: requests.Session, query: str, page: int) -> dict:
+    response = session.get(
+        f"{settings.PEXELS_API_URL}/search",
+        params={"query": query, "per_page": PEXELS_PAGE_SIZE, "page": page},
+        timeout=15,
+    )
+    response.raise_for_status()
+    return response.json()
 
-def fetch_images(query: str, num_to_fetch: int, job_id: int) -> list[str]:
-    print(f"[JOB {job_id}][INFO] Fetching images from Pexels for query='{query}', targeting {num_to_fetch} downloads...")
+
+def search_photos(query: str, num_wanted: int, job_id: int, rendition: str = "original") -> list[PexelsPhoto]:
+    """
+    Collects up to `num_wanted` unique photos for `query`. Page 1 tells us how many
+    results exist; every other page we need is then fetched concurrently.
+    """
+    session = requests.Session()
+    session.headers.update({"Authorization": settings.PEXELS_API_KEY, "User-Agent": USER_AGENT})
+    try:
+        first = _search_page(session, query, 1)
+        pages = plan_search_pages(num_wanted, first.get("total_results"))[1:]
+        results = [first]
+        if pages:
+            with ThreadPoolExecutor(max_workers=min(len(pages), settings.PEXELS_SEARCH_CONCURRENCY)) as pool:
+                results.extend(pool.map(lambda page: _search_page(session, query, page), pages))
+    finally:
+        session.close()
+
+    photos, seen_ids = [], set()
+    for result in results:
+        for p in result.get("photos", []):
+            # Pages can overlap when new photos are published mid-search.
+            if p["id"] in seen_ids:
+                continue
+            seen_ids.add(p["id"])
+            photos.append(PexelsPhoto(id=p["id"], url=p["src"][rendition], width=p["width"], height=p["height"]))
+    print(f"[JOB {job_id}][INFO] Search fetched {len(results)} page(s) for {num_wanted} wanted images.")
+    return photos[:num_wanted]
+
+
+def download_photos(photos: list[PexelsPhoto], num_to_fetch: int, job_id: int, skip=None, on_download=None):
+    """
+    Yields `(photo, file_path)` for up to `num_to_fetch` photos as each becomes
+    available in the job's folder. Photos already in blob storage (from earlier
+    jobs) are linked in straight away with no network traffic; the rest are
+    downloaded concurrently into storage and linked as they land.
+    `skip(photo)` is consulted lazily, just before a photo would be used, so
+    it can reflect what earlier downloads have taught the caller.
+    `on_download(photo, blob_path)` is called for each photo that actually came over the network.
+    """
+    by_url = {p.url: p for p in photos}
+    dest_dir = storage_service.job_dir(job_id)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+
+    def blob_for(url: str) -> Path:
+        return storage_service.blob_path(by_url[url].id, url, get_file_extension(url))
+
+    num_saved = 0
+    num_reused = 0
+
+    def place(blob: Path) -> str:
+        nonlocal num_saved
+        view = storage_service.link(blob, dest_dir / f"image_{num_saved:04d}{blob.suffix}")
+        num_saved += 1
+        return str(view)
+
+    try:
+        to_download = []
+        for photo in photos:
+            if num_saved >= num_to_fetch:
+                return
+            blob = storage_service.find_blob(blob_for(photo.url))
+            if blob is None:
+                to_download.append(photo)
+                continue
+            if skip is not None and skip(photo):
+                continue
+            try:
+                path = place(blob)
+            except FileNotFoundError:
+                to_download.append(photo)  # Garbage-collected a moment ago
+                continue
+            num_reused += 1
+            yield photo, path
+
+        # Downloads run concurrently behind an adaptive rate limiter (see download.py),
+        # replacing the fixed per-file sleep.
+        urls = (p.url for p in to_download if skip is None or not skip(p))
+        for url, blob in iter_downloads(urls, dest_dir, num_to_fetch - num_saved, job_id, dest_for=blob_for):
+            if on_download is not None:
+                on_download(by_url[url], blob)
+            yield by_url[url], place(Path(blob))
+    finally:
+        print(f"[JOB {job_id}][INFO] Download phase complete. Successfully saved {num_saved} images "
+              f"({num_reused} already in storage).")
+
+
+def find_photos(query: str, num_to_fetch: int, job_id: int, rendition: str = "original") -> list[PexelsPhoto]:
+    """Runs the Pexels search for a job, logging (not raising) configuration and API errors."""
+    print(f"[JOB {job_id}][INFO] Fetching images from Pexels for query='{query}', targeting up to {num_to_fetch} downloads ({rendition})...")
     
     if not settings.PEXELS_API_KEY or "YOUR_DEFAULT_KEY" in settings.PEXELS_API_KEY:
         print(f"[JOB {job_id}][ERROR] PEXELS_API_KEY is not configured.")
         return []
 
     try:
-        api = API(settings.PEXELS_API_KEY)
-        photos_to_get = []
-        page = 1
-        while len(photos_to_get) < num_to_fetch:
-            api.search(query, page=page, results_per_page=80) # Fetch larger pages
-            photos = api.get_entries()
-            if not photos: break
-            photos_to_get.extend(photos)
-            page += 1
-        
-        image_urls = [p.original for p in photos_to_get]
-        print(f"[JOB {job_id}][INFO] Found {len(image_urls)} potential image URLs from Pexels.")
+        photos = search_photos(query, num_to_fetch, job_id, rendition)
+        print(f"[JOB {job_id}][INFO] Found {len(photos)} potential image URLs from Pexels.")
+        return photos
     except Exception as e:
         print(f"[JOB {job_id}][ERROR] Pexels API search failed: {e}")
         return []
 
-    if not image_urls: return []
 
-    dest_dir = Path(f"downloads/job_{job_id}")
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    
-    downloaded_paths = []
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-
-    for url in image_urls:
-        if len(downloaded_paths) >= num_to_fetch:
-            break
-        
-        try:
-            response = session.get(url, timeout=20, stream=True)
-            response.raise_for_status()
-            
-            ext = _get_file_extension(url)
-            filename = f"image_{len(downloaded_paths):04d}{ext}"
-            filepath = dest_dir / filename
-            
-            with open(filepath, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            downloaded_paths.append(str(filepath))
-            
-            # --- THIS IS THE FIX ---
-            # Add a 0.5-second pause to be respectful to the API
-            time.sleep(0.5)
-
-        except Exception as e:
-            print(f"[ERROR] Failed to download {url}: {e}")
-            continue
-            
-    print(f"[JOB {job_id}][INFO] Download phase complete. Successfully saved {len(downloaded_paths)} images.")
-    return downloaded_paths
+def iter_images(query: str, num_to_fetch: int, job_id: int, rendition: str = "original"):
+    """
+    Searches Pexels and yields downloaded file paths as they land, so later stages
+    can start work before the whole batch is on disk. Closing the generator stops
+    any further downloads.
+    """
+    photos = find_photos(query, num_to_fetch, job_id, rendition)
+    if not photos:
+        return
+    downloads = download_photos(photos, num_to_fetch, job_id)
+    try:
+        for _, path in downloads:
+            yield path
+    finally:
+        downloads.close()
+
 
+def fetch_images(query: str, num_to_fetch: int, job_id: int, rendition: str = "original") -> list[str]:
+    return list(iter_images(query, num_to_fetch, job_id, rendition))
@@ -1,83 +1,160 @@
-from PIL import Image
 import os
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
 from app.core.config import settings
+from app.core.paths import CACHE_DIR
+from app.image_processing import image_loader
+from app.image_processing.embedding_cache import EmbeddingCache, content_key
 
 # --- NOTICE: torch and transformers are NO LONGER IMPORTED HERE ---
 
-MODEL_NAME = "openai/clip-vit-base-patch32"
-model = None
+MODEL_NAME = settings.CLIP_MODEL_NAME
+model = None # The inference backend (see clip_backends.py), loaded once per worker
 processor = None
-device = None # Will be set when the model is loaded
+logit_scale = None
+model_load_seconds = None  # How long _load_model took in this process
+_load_lock = threading.Lock()  # Warm-up and the first job may both get here in thread pool mode
+
+# Image embeddings are keyed by file content, so a photo that shows up again for
+# another job (or another query) never goes through the image tower twice.
+# Quantized backends produce slightly different vectors, so each backend gets its own cache.
+EMBEDDING_CACHE_ROOT = CACHE_DIR / "clip"  # Kept under CLIP_CACHE_MAX_MB by retention
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_ROOT / MODEL_NAME.strip("/").replace("/", "--") / settings.CLIP_BACKEND)
 
 def _load_model():
     """
     Loads the AI model and its libraries into memory.
     This function will only be called once, the first time it's needed.
     """
-    global model, processor, device
     if model is not None:
         return
+    with _load_lock:
+        if model is None:
+            _load_model_locked()
+
 
-    print("🤖 Importing AI libraries and loading CLIP model...")
+def _load_model_locked():
+    global model, processor, logit_scale, model_load_seconds
+    print(f"🤖 Importing AI libraries and loading CLIP model ({settings.CLIP_BACKEND} backend)...")
+    started = time.perf_counter()
     try:
         # --- THIS IS THE FIX ---
         # We import the heavy libraries only when this function is first called.
-        import torch
-        from transformers import CLIPProcessor, CLIPModel
+        from app.image_processing.clip_backends import load_backend
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = CLIPModel.from_pretrained(MODEL_NAME).to(device)
-        processor = CLIPProcessor.from_pretrained(MODEL_NAME)
-        print(f"✅ CLIP model loaded successfully on {device}.")
+        # Each worker process gets its share of the cores; letting every process
+        # spawn one thread per core oversubscribes the CPU and slows every batch.
+        num_threads = settings.TORCH_NUM_THREADS or max(1, (os.cpu_count() or 1) // settings.WORKER_PROCESSES)
+
+        model = load_backend(settings.CLIP_BACKEND, MODEL_NAME, num_threads)
+        processor = model.processor
+        logit_scale = model.logit_scale
+        model_load_seconds = time.perf_counter() - started
+        print(f"✅ CLIP model loaded successfully ({model.name}, {num_threads} threads) in {model_load_seconds:.1f}s.")
     except Exception as e:
         print(f"❌ FAILED to load CLIP model. Error: {e}")
         model = "failed"
         processor = "failed"
 
 
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+@lru_cache(maxsize=settings.CLIP_TEXT_CACHE_SIZE)
+def text_embedding(query: str) -> np.ndarray:
+    """Normalized CLIP text embedding for a query. Memoized: a job's query is encoded once."""
+    inputs = processor(text=[query], return_tensors="np", padding=True)
+    return _normalize(model.text_features(inputs["input_ids"], inputs["attention_mask"])[0])
+
+
+def _compute_image_embeddings(image_paths: list[str]) -> np.ndarray:
+    images = [image_loader.load(path) for path in image_paths]
+    inputs = processor(images=images, return_tensors="np")
+    return _normalize(model.image_features(inputs["pixel_values"]))
+
+
+def image_embeddings(image_paths: list[str]) -> np.ndarray:
+    """
+    Normalized CLIP image embeddings (one row per path), running the image tower
+    only for images that aren't in the on-disk cache yet.
+    """
+    if not settings.CLIP_CACHE_ENABLED:
+        return _compute_image_embeddings(image_paths)
+
+    keys = [content_key(path) for path in image_paths]
+    cached = embedding_cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        computed = _compute_image_embeddings([image_paths[i] for i in missing])
+        new_entries = {keys[i]: vector for i, vector in zip(missing, computed)}
+        embedding_cache.put_many(new_entries)
+        cached.update(new_entries)
+    return np.stack([cached[key] for key in keys])
+
+
+def embed_images(image_paths: list[str]) -> np.ndarray | None:
+    """Worker entry point for the inference service: embeddings, or None if CLIP is unavailable."""
+    _load_model()
+    if model == "failed":
+        return None
+    return image_embeddings(image_paths)
+
+
+def encode_query(query: str) -> tuple[np.ndarray, float] | None:
+    """Worker entry point: the query's text embedding and CLIP's logit scale, or None if CLIP is unavailable."""
+    _load_model()
+    if model == "failed":
+        return None
+    return text_embedding(query), logit_scale
+
+
+def score_images(image_paths: list[str], query: str) -> list[float] | None:
+    """
+    Scores one batch of images against the text query with CLIP.
+    The score is CLIP's image-text logit (logit_scale * cosine similarity), the same
+    value the full model forward pass returns as logits_per_image.
+    Returns None if the model could not be loaded, so callers can let images through.
+    """
+    _load_model()
+    if model == "failed":
+        return None
+
+    scores = image_embeddings(image_paths) @ text_embedding(query) * logit_scale
+    return [float(score) for score in scores]
+
+
 def filter_images(image_paths: list[str], query: str, job_id: int) -> list[str]:
     """
     Uses the CLIP model to filter images based on their relevance to a text query.
     """
     # Lazy-load the model and libraries on the first run.
     _load_model()
-    
+
     if model == "failed" or not image_paths:
         return image_paths
 
-    # We need to import torch here again to use torch.no_grad()
-    import torch
-
     print(f"[JOB {job_id}] 🧠 Starting AI filtering for {len(image_paths)} images...")
-    
+
     try:
         # Process in batches to conserve memory
-        BATCH_SIZE = 16
         relevant_paths = []
-        for i in range(0, len(image_paths), BATCH_SIZE):
-            batch_paths = image_paths[i:i + BATCH_SIZE]
-            
-            images = [Image.open(path).convert("RGB") for path in batch_paths]
-            inputs = processor(text=[query], images=images, return_tensors="pt", padding=True).to(device)
-
-            with torch.no_grad():
-                outputs = model(**inputs)
-            
-            logits_per_image = outputs.logits_per_image
-            scores = logits_per_image.squeeze().cpu().numpy()
-            
-            if scores.ndim == 0:
-                scores = [scores.item()]
+        for i in range(0, len(image_paths), settings.CLIP_BATCH_SIZE):
+            batch_paths = image_paths[i:i + settings.CLIP_BATCH_SIZE]
+            scores = score_images(batch_paths, query)
 
             for path, score in zip(batch_paths, scores):
                 if score >= settings.CLIP_FILTER_THRESHOLD:
                     relevant_paths.append(path)
-        
+
         num_removed = len(image_paths) - len(relevant_paths)
         print(f"[JOB {job_id}] ✨ AI filtering complete. Removed {num_removed} images.")
-        
+
         return relevant_paths
 
     except Exception as e:
         print(f"[JOB {job_id}] ❌ ERROR during AI filtering: {e}")
-        return image_paths
\ No newline at end of file
+        return image_paths
@@ -0,0 +1,106 @@
+import threading
+from typing import Iterable
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app.models.job import SessionLocal, PhotoHash
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class HammingIndex:
+    """
+    Finds 64-bit hashes within Hamming distance k of a query (multi-index hashing).
+
+    Each hash is split into k+1 disjoint chunks, and every chunk gets its own exact
+    lookup table. By the pigeonhole principle, two hashes that differ in at most k
+    bits must agree exactly on at least one chunk, so a query only has to verify
+    the few entries sharing one of its chunks instead of scanning everything.
+    """
+
+    def __init__(self, max_distance: int = 4, bits: int = 64):
+        self.max_distance = max_distance
+        num_chunks = max_distance + 1
+        base, extra = divmod(bits, num_chunks)
+        self._chunks = []  # (shift, mask) per chunk, most significant first
+        shift = bits
+        for i in range(num_chunks):
+            width = base + (1 if i < extra else 0)
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        self._tables: list[dict[int, list[int]]] = [{} for _ in self._chunks]
+        self._keys: dict[int, object] = {}
+        # The pipeline adds from the event loop while the download thread queries.
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, value: int, key=None):
+        with self._lock:
+            if value in self._keys:
+                return
+            self._keys[value] = key
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                table.setdefault((value >> shift) & mask, []).append(value)
+
+    def query(self, value: int, max_distance: int | None = None) -> list[tuple[int, int, object]]:
+        """Returns (distance, hash, key) for every indexed hash within `max_distance`, nearest first."""
+        k = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            if k == 0:
+                return [(0, value, self._keys[value])] if value in self._keys else []
+            return self._query(value, k)
+
+    def _query(self, value: int, k: int) -> list[tuple[int, int, object]]:
+        seen = set()
+        matches = []
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for candidate in table.get((value >> shift) & mask, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = (candidate ^ value).bit_count()
+                if distance <= k:
+                    matches.append((distance, candidate, self._keys[candidate]))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def has_near(self, value: int, max_distance: int | None = None) -> bool:
+        return bool(self.query(value, max_distance))
+
+
+# --- Persistence: hashes of every photo we've processed, keyed by Pexels id ---
+
+_SQLITE_MAX_VARIABLES = 900
+
+
+def load_known_hashes(photo_ids: Iterable[int]) -> dict[int, int]:
+    """Returns {photo_id: phash} for the photos that earlier jobs already hashed."""
+    photo_ids = list(photo_ids)
+    known = {}
+    db = SessionLocal()
+    try:
+        for i in range(0, len(photo_ids), _SQLITE_MAX_VARIABLES):
+            chunk = photo_ids[i:i + _SQLITE_MAX_VARIABLES]
+            rows = db.query(PhotoHash.photo_id, PhotoHash.phash).filter(PhotoHash.photo_id.in_(chunk))
+            known.update((photo_id, int(phash, 16)) for photo_id, phash in rows)
+    finally:
+        db.close()
+    return known
+
+
+def save_hashes(entries: Iterable[tuple[int, str, int]]):
+    """Records (photo_id, url, phash) triples; photos that are already known are left alone."""
+    rows = [{"photo_id": photo_id, "url": url, "phash": f"{phash:016x}"} for photo_id, url, phash in entries]
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        for i in range(0, len(rows), _SQLITE_MAX_VARIABLES // 3):
+            db.execute(insert(PhotoHash).values(rows[i:i + _SQLITE_MAX_VARIABLES // 3]).on_conflict_do_nothing())
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,134 @@
+"""
+Shared image decoding for the pipeline stages.
+
+Hashing, CLIP and renditions all need the same pixels at different sizes. Rather
+than each stage opening the original at full resolution, `load` decodes a file
+once, in JPEG draft mode, at the smallest scale that satisfies every consumer:
+the short side at least max(PHASH_DRAFT_SIZE, CLIP's input size) and the width
+at least the largest rendition. Smaller views (`load(path, max_side=...)`) are
+downscaled from that buffer and cached with it.
+
+The cache is per process and bounded by IMAGE_CACHE_MAX_MB of decoded pixels,
+evicting least recently used images, so peak memory stays predictable. With
+worker processes, the pipeline sends every stage of an image to the same worker
+(workers.run_cpu_pinned), so each worker's cache serves all of them; with
+WORKER_POOL_MODE="thread" every stage shares one cache anyway. Images the
+pipeline rejects (duplicates, irrelevant) are dropped with `forget`, which
+leaves the budget to the candidates that still need renditions after the
+stream. A job whose candidates don't fit in IMAGE_CACHE_MAX_MB per worker
+decodes its earliest ones again for renditions.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from app.core.config import settings
+
+CLIP_INPUT_SIZE = 224  # Short side CLIPProcessor resizes to for ViT-B models
+
+
+class _Entry:
+    __slots__ = ("image", "views", "nbytes")
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self.views: dict[int, Image.Image] = {}
+        self.nbytes = _nbytes(image)
+
+
+def _nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+_cache: OrderedDict[tuple, _Entry] = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def _decode_box(width: int, height: int) -> tuple[int, int]:
+    """The smallest size every consumer can work from, never upscaled."""
+    min_side = max(settings.PHASH_DRAFT_SIZE, CLIP_INPUT_SIZE)
+    max_rendition = max(settings.RENDITION_WIDTHS, default=0)
+    scale = min(1.0, max(min_side / min(width, height), max_rendition / width))
+    return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+
+def _decode(image_path: str) -> Image.Image:
+    with Image.open(image_path) as img:
+        img.draft("RGB", _decode_box(*img.size))
+        # convert() keeps img.info (including EXIF), so consumers can still apply the orientation.
+        return img.convert("RGB")
+
+
+def _remember(key: tuple, entry: _Entry):
+    global _cache_bytes
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = entry
+        _cache_bytes += entry.nbytes
+        budget = settings.IMAGE_CACHE_MAX_MB * 1024 * 1024
+        while _cache_bytes > budget and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= evicted.nbytes
+
+
+def load(image_path: str, max_side: int | None = None) -> Image.Image:
+    """
+    Returns the decoded RGB image, downscaled so neither side exceeds `max_side`
+    if given. Callers must not modify the returned image in place.
+    """
+    global hits, misses, _cache_bytes
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            hits += 1
+        else:
+            misses += 1
+    if entry is None:
+        entry = _Entry(_decode(image_path))
+        _remember(key, entry)
+
+    if max_side is None or max(entry.image.size) <= max_side:
+        return entry.image
+    view = entry.views.get(max_side)
+    if view is None:
+        view = entry.image.copy()
+        view.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        with _lock:
+            if key in _cache and max_side not in entry.views:
+                entry.views[max_side] = view
+                entry.nbytes += _nbytes(view)
+                _cache_bytes += _nbytes(view)
+    return view
+
+
+def forget(image_paths: list[str]) -> list[bool]:
+    """Drops images no later stage will need. Returns, per path, whether it was cached."""
+    global _cache_bytes
+    paths = {os.path.abspath(path) for path in image_paths}
+    dropped = set()
+    with _lock:
+        for key in [key for key in _cache if key[0] in paths]:
+            _cache_bytes -= _cache.pop(key).nbytes
+            dropped.add(key[0])
+    return [os.path.abspath(path) in dropped for path in image_paths]
+
+
+def clear():
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+def stats() -> dict:
+    return {"images": len(_cache), "bytes": _cache_bytes, "hits": hits, "misses": misses}
@@ -1,54 +1,564 @@
-from app.models.job import SessionLocal, Job, JobStatus, JobImage
-from app.image_processing import fetch, deduplicate, filter
+import asyncio
+import concurrent.futures
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import insert, update
+
+from app.models.job import SessionLocal, Job, JobStatus, JobImage, ImageRendition
+from app.image_processing import fetch, deduplicate, filter, hash_index, image_loader, rank, renditions
+from app.core.config import settings
+from app.core.paths import download_url
+from app.services import archive_service, metrics, progress, result_cache, retention_service, storage_service, workers
+from app.services.inference_service import inference_service
+
+_DONE = object()  # Sentinel that marks the end of a stage's output
+
+
+class _PipelineStats:
+    def __init__(self, job_metrics: metrics.JobMetrics):
+        self.metrics = job_metrics  # Timing spans and counters, saved on the Job row
+        self.downloaded = 0
+        self.duplicates = 0
+        self.skipped_known = 0
+        self.scored = 0
+        self.from_cache = 0
+        self.relevant = 0  # Candidates that passed the CLIP threshold
+        self.candidates = rank.TopK(0)  # The best of them, sized per job
+        self.accepted: list[rank.Candidate] = []  # Final selection, best first
+
+    def report(self, stage: str):
+        """Publishes the running counts to anyone watching the job."""
+        progress.update(
+            self.metrics.job_id, stage, downloaded=self.downloaded, duplicates=self.duplicates + self.skipped_known,
+            scored=self.scored, relevant=self.relevant, from_cache=self.from_cache,
+        )
+
+
+def _publish_candidates(job_id: int, candidates: list[rank.Candidate]):
+    """Sends newly accepted candidates to the results page, which shows them before the job is done."""
+    progress.add_images(job_id, [
+        {"id": c.photo.id, "url": download_url(c.path),
+         "clip_score": round(c.clip_score, 3) if c.clip_score is not None else None}
+        for c in candidates
+    ])
+
+
+class _DedupState:
+    """Near-duplicate index for this job, plus what earlier jobs taught us about its photos."""
+
+    def __init__(self):
+        self.index = hash_index.HammingIndex(settings.DEDUP_MAX_DISTANCE)
+        self.known: dict[int, int] = {}
+        self.new_hashes: list[tuple[int, str, int]] = []
+        self.exclude: set[int] = set()  # Photos the job already has (e.g. from the result cache)
+
+    def is_known_duplicate(self, photo: fetch.PexelsPhoto) -> bool:
+        if photo.id in self.exclude:
+            return True
+        known = self.known.get(photo.id)
+        return known is not None and self.index.has_near(known)
+
+
+def _put_from_thread(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, item, stop: threading.Event) -> bool:
+    """
+    Puts onto an asyncio queue from a worker thread, blocking while it's full.
+    Gives up (returning False) if the pipeline was stopped and nobody is draining it.
+    """
+    while True:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        try:
+            future.result(timeout=1.0)
+            return True
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            if stop.is_set():
+                return False
+
+
+def _produce_downloads(query: str, num_to_fetch: int, job_id: int, rendition: str, dedup: _DedupState,
+                       stats: _PipelineStats, loop: asyncio.AbstractEventLoop, out: asyncio.Queue,
+                       stop: threading.Event):
+    """
+    Runs in an I/O worker thread: pushes each `(photo, path)` onto `out` as it lands.
+    Blocking on the bounded queue applies backpressure to the downloader, and
+    closing the generator once `stop` is set cancels the remaining downloads.
+    Photos whose stored hash is a near-duplicate of one this job already has are
+    never downloaded at all.
+    """
+    try:
+        # Search past the photos the job already has, which are likely the top results again.
+        started = time.perf_counter()
+        photos = fetch.find_photos(query, num_to_fetch + len(dedup.exclude), job_id, rendition)
+        stats.metrics.record("search", time.perf_counter() - started, len(photos))
+        if not photos:
+            return
+        dedup.known = hash_index.load_known_hashes(p.id for p in photos)
+
+        def skip(photo):
+            if dedup.is_known_duplicate(photo):
+                stats.skipped_known += 1
+                return True
+            return False
+
+        def on_download(photo, blob):
+            stats.metrics.count("network_downloads")
+            stats.metrics.count("bytes_downloaded", os.path.getsize(blob))
+
+        images = fetch.download_photos(photos, num_to_fetch, job_id, skip=skip, on_download=on_download)
+        started = time.perf_counter()
+        blocked = 0.0  # Time spent waiting on a full queue, i.e. on the later stages
+        fetched = 0
+        try:
+            for item in images:
+                fetched += 1
+                put_started = time.perf_counter()
+                if stop.is_set() or not _put_from_thread(loop, out, item, stop):
+                    break
+                blocked += time.perf_counter() - put_started
+        finally:
+            images.close()
+            stats.metrics.record("download", time.perf_counter() - started - blocked, fetched)
+            stats.metrics.record("download_backpressure", blocked)
+    finally:
+        _put_from_thread(loop, out, _DONE, stop)
+
+
+async def _next_batch(inp: asyncio.Queue, max_size: int, max_wait: float) -> tuple[list, bool]:
+    """
+    Waits for one item, then collects more until `max_size` items are ready or
+    `max_wait` seconds have passed. Returns (items, finished) where `finished`
+    means the upstream stage is done.
+    """
+    item = await inp.get()
+    if item is _DONE:
+        return [], True
+    items = [item]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait
+    while len(items) < max_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(inp.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if item is _DONE:
+            return items, True
+        items.append(item)
+    return items, False
+
+
+async def _hash_stage(inp: asyncio.Queue, out: asyncio.Queue, dedup: _DedupState, stats: _PipelineStats,
+                      stop: threading.Event):
+    """
+    Hashes downloads in small batches as they arrive (up to PIPELINE_HASH_WORKERS
+    batches in flight) and forwards only images with no near-duplicate so far.
+    """
+    pending = set()
+
+    async def hash_batch(items: list):
+        to_hash = [(photo, path) for photo, path in items if photo.id not in dedup.known]
+        computed = {}
+        if to_hash:
+            try:
+                with stats.metrics.span("hash", len(to_hash)):
+                    hashes = await workers.run_cpu_pinned(deduplicate.phash_batch, [path for _, path in to_hash])
+            except Exception as e:
+                print(f"⚠️ WARNING: Hashing failed for {len(to_hash)} images. Error: {e}. Skipping.")
+                hashes = [None] * len(to_hash)
+            for (photo, _), hash_value in zip(to_hash, hashes):
+                if hash_value is not None:
+                    computed[photo.id] = hash_value
+                    dedup.new_hashes.append((photo.id, photo.url, hash_value))
+
+        duplicates = []
+        for photo, path in items:
+            hash_value = dedup.known.get(photo.id, computed.get(photo.id))
+            if hash_value is None:
+                continue
+            # The lookup and insert run on the event loop, so they're atomic.
+            if dedup.index.has_near(hash_value):
+                stats.duplicates += 1
+                duplicates.append(path)
+                continue
+            dedup.index.add(hash_value, photo.id)
+            await out.put((photo, path))
+        stats.report("fetching")
+        await _forget_images(duplicates)
+
+    finished = False
+    while not finished:
+        items, finished = await _next_batch(inp, settings.PHASH_BATCH_SIZE, settings.CLIP_BATCH_MAX_WAIT)
+        stats.downloaded += len(items)
+        stats.metrics.observe_queue("downloads", inp.qsize() + len(items))
+        if stop.is_set() or not items:
+            continue  # Drain whatever was already queued without doing more work
+        task = asyncio.create_task(hash_batch(items))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        if len(pending) >= settings.PIPELINE_HASH_WORKERS:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    if pending:
+        await asyncio.gather(*pending)
+    await out.put(_DONE)
+
+
+async def _clip_stage(inp: asyncio.Queue, query: str, target: int, stats: _PipelineStats,
+                      stop: threading.Event, job_id: int):
+    """
+    Groups unique images into chunks (up to CLIP_BATCH_SIZE, or whatever arrived
+    within CLIP_BATCH_MAX_WAIT) and sends them to the shared inference service,
+    which batches them with other jobs' images. Relevant images are measured for
+    quality and pushed into the job's ranking pool. Stops the whole pipeline once
+    `target` relevant candidates have been seen.
+    """
+    try:
+        # On a cold worker this includes loading the model
+        with stats.metrics.span("clip_setup"):
+            encoded = await workers.run_cpu(filter.encode_query, query)
+    except Exception as e:
+        print(f"[JOB {job_id}] ❌ ERROR encoding query for AI filtering: {e}")
+        encoded = None
+    pending = set()
+
+    async def score_chunk(items: list):
+        batch = [path for _, path in items]
+        embeddings = None
+        if encoded is not None:
+            try:
+                with stats.metrics.span("clip", len(batch)):
+                    embeddings = await inference_service.embed(batch)
+            except Exception as e:
+                print(f"[JOB {job_id}] ❌ ERROR during AI filtering: {e}")
+        stats.scored += len(batch)
+        if stop.is_set():
+            return  # Another chunk already filled the job
+        if embeddings is None:
+            # Keep the old behaviour: if CLIP is unavailable, images pass through.
+            relevant = [rank.Candidate(photo, path, None) for photo, path in items]
+        else:
+            text_vector, logit_scale = encoded
+            scores = embeddings @ text_vector * logit_scale
+            relevant = [
+                rank.Candidate(photo, path, float(score), embedding=embedding)
+                for (photo, path), score, embedding in zip(items, scores, embeddings)
+                if score >= settings.CLIP_FILTER_THRESHOLD
+            ]
+        kept = {candidate.path for candidate in relevant}
+        await _forget_images([path for path in batch if path not in kept])
+        await _measure_quality(relevant, stats.metrics)
+        for candidate in relevant:
+            stats.candidates.push(candidate)
+        stats.relevant += len(relevant)
+        _publish_candidates(job_id, relevant)
+        stats.report("fetching")
+        if stats.relevant >= target and not stop.is_set():
+            print(f"[JOB {job_id}] 🏁 Found {stats.relevant} relevant candidates. Stopping early.")
+            stop.set()
+
+    finished = False
+    while not finished:
+        items, finished = await _next_batch(inp, settings.CLIP_BATCH_SIZE, settings.CLIP_BATCH_MAX_WAIT)
+        stats.metrics.observe_queue("unique", inp.qsize() + len(items))
+        if stop.is_set() or not items:
+            continue
+        task = asyncio.create_task(score_chunk(items))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        if len(pending) >= settings.PIPELINE_CLIP_INFLIGHT:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+async def _forget_images(paths: list[str]):
+    """Frees the decoded pixels of rejected images, so the workers' caches keep the candidates for renditions."""
+    if not paths:
+        return
+    try:
+        await workers.run_cpu_pinned(image_loader.forget, paths)
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not drop {len(paths)} rejected images from the image cache. Error: {e}.")
+
+
+async def _measure_quality(candidates: list[rank.Candidate], job_metrics: metrics.JobMetrics):
+    """Fills in each candidate's quality score (resolution and sharpness) on the CPU pool."""
+    if not candidates:
+        return
+    try:
+        with job_metrics.span("quality", len(candidates)):
+            qualities = await workers.run_cpu_pinned(rank.quality_batch, [c.path for c in candidates])
+    except Exception as e:
+        print(f"⚠️ WARNING: Quality scoring failed for {len(candidates)} images. Error: {e}.")
+        return
+    for candidate, quality in zip(candidates, qualities):
+        candidate.quality = quality
+
+
+def _fill_from_cache(job: Job, rendition: str, stats: _PipelineStats, dedup: _DedupState) -> list[rank.Candidate]:
+    """Seeds the job with earlier results for the same query, so only the shortfall is fetched."""
+    cached = result_cache.lookup(job.query, rendition, stats.candidates.size)
+    placed = result_cache.materialize(cached, storage_service.job_dir(job.id))
+    candidates = [rank.Candidate(image.photo, path, image.score) for image, path in placed]
+    dedup.exclude.update(image.photo.id for image, _ in placed)
+    stats.from_cache = len(placed)
+    # Near-duplicates of the cached images shouldn't be fetched again either.
+    for photo_id, hash_value in hash_index.load_known_hashes(dedup.exclude).items():
+        dedup.index.add(hash_value, photo_id)
+    if placed:
+        print(f"[JOB {job.id}] ♻️ Reused {len(placed)} images from earlier jobs for '{job.query}'.")
+    return candidates
+
+
+async def _rank_cached(candidates: list[rank.Candidate], job_metrics: metrics.JobMetrics):
+    """Gives cached images embeddings (from the embedding cache) and quality, so they rank like fresh ones."""
+    if not candidates:
+        return
+    try:
+        embeddings = await inference_service.embed([c.path for c in candidates])
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not embed cached images. Error: {e}.")
+        embeddings = None
+    if embeddings is not None:
+        for candidate, embedding in zip(candidates, embeddings):
+            candidate.embedding = embedding
+    await _measure_quality(candidates, job_metrics)
+
+
+async def _stream_images(job: Job, rendition: str, job_metrics: metrics.JobMetrics) -> _PipelineStats:
+    """Runs fetch → dedup → CLIP as overlapping stages connected by bounded queues."""
+    loop = asyncio.get_running_loop()
+    stats = _PipelineStats(job_metrics)
+    dedup = _DedupState()
+    stop = threading.Event()
+    downloads: asyncio.Queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+    unique: asyncio.Queue = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+
+    # The ranking pool holds a few more than the job needs, so the diversity pass has a choice.
+    stats.candidates = rank.TopK(max(job.image_count, math.ceil(job.image_count * settings.RANK_POOL_FACTOR)))
+    started = time.perf_counter()
+    cached = await workers.run_io(_fill_from_cache, job, rendition, stats, dedup)
+    await _rank_cached(cached, job_metrics)
+    job_metrics.record("cache_fill", time.perf_counter() - started, len(cached))
+    for candidate in cached:
+        stats.candidates.push(candidate)
+    stats.relevant += len(cached)
+    _publish_candidates(job.id, cached)
+
+    shortfall = job.image_count - len(cached)
+    if shortfall <= 0:
+        stats.report("ranking")
+        with job_metrics.span("rank", len(stats.candidates)):
+            stats.accepted = rank.mmr_select(stats.candidates.items(), job.image_count)
+        return stats
+
+    # The search budget is still twice the shortfall, but it's a ceiling now:
+    # downloads stop as soon as enough relevant, unique images are accepted.
+    num_to_fetch = shortfall * 2
+    stats.report("fetching")
+    try:
+        await asyncio.gather(
+            workers.run_io(_produce_downloads, job.query, num_to_fetch, job.id, rendition, dedup, stats,
+                           loop, downloads, stop),
+            _hash_stage(downloads, unique, dedup, stats, stop),
+            _clip_stage(unique, job.query, math.ceil(job.image_count * settings.RANK_CANDIDATE_FACTOR),
+                        stats, stop, job.id),
+        )
+    finally:
+        # On cancellation this releases the producer thread and its downloads.
+        stop.set()
+    # Remember these hashes so later jobs can skip downloading the same photos.
+    with job_metrics.span("hash_save", len(dedup.new_hashes)):
+        await workers.run_io(hash_index.save_hashes, dedup.new_hashes)
+    stats.report("ranking")
+    with job_metrics.span("rank", len(stats.candidates)):
+        stats.accepted = rank.mmr_select(stats.candidates.items(), job.image_count)
+    print(f"[JOB {job.id}] 🏆 Ranked {len(stats.candidates)} of {stats.relevant} relevant candidates; "
+          f"selected {len(stats.accepted)}.")
+    return stats
+
+
+async def _make_renditions(job_id: int, paths: list[str]) -> dict[str, list[dict]]:
+    """Generates thumbnails for the accepted images, spread over the CPU pool in small batches."""
+    batch_size = settings.RENDITION_BATCH_SIZE
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    results = await asyncio.gather(*(workers.run_cpu_pinned(renditions.make_renditions_batch, batch) for batch in batches))
+    by_path = {path: rendered for batch, batch_results in zip(batches, results) for path, rendered in zip(batch, batch_results)}
+    print(f"[JOB {job_id}] 🖼️ Created {sum(len(r) for r in by_path.values())} renditions for {len(paths)} images.")
+    return by_path
+
+
+def _save_images(db, job_id: int, accepted: list[rank.Candidate], renditions_by_path: dict):
+    """
+    Inserts a job's images and their renditions as two multi-row INSERTs,
+    instead of a flush per ORM object. Rows go in best first, so ids follow the ranking.
+    """
+    image_ids = db.scalars(
+        insert(JobImage).returning(JobImage.id, sort_by_parameter_order=True),
+        [
+            {"job_id": job_id, "file_path": candidate.path, "clip_score": candidate.clip_score,
+             "quality": candidate.quality, "score": candidate.score}
+            for candidate in accepted
+        ],
+    ).all()
+    rendition_rows = [
+        {"image_id": image_id, **rendition}
+        for image_id, candidate in zip(image_ids, accepted)
+        for rendition in renditions_by_path.get(candidate.path, [])
+    ]
+    if rendition_rows:
+        db.execute(insert(ImageRendition), rendition_rows)
+
+
+def _load_job(job_id: int) -> Job | None:
+    """Reads the job in a short session; its columns stay readable after the session closes."""
+    db = SessionLocal()
+    try:
+        return db.query(Job).filter(Job.id == job_id).first()
+    finally:
+        db.close()
+
+
+def _set_status(job_id: int, status: JobStatus):
+    db = SessionLocal()
+    try:
+        db.execute(update(Job).where(Job.id == job_id).values(status=status).execution_options(synchronize_session=False))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _save_results(job_id: int, accepted: list[rank.Candidate], renditions_by_path: dict):
+    """Saves the job's images and marks it COMPLETED, in one short transaction."""
+    db = SessionLocal()
+    try:
+        _save_images(db, job_id, accepted, renditions_by_path)
+        db.execute(
+            update(Job).where(Job.id == job_id).values(status=JobStatus.COMPLETED)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _save_metrics(job_id: int, summary: dict):
+    """Stored with its own UPDATE, so it works even when the pipeline's session is mid-failure."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job).where(Job.id == job_id).values(metrics=summary).execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _count_results(job_metrics: metrics.JobMetrics, stats: _PipelineStats):
+    for name in ("downloaded", "duplicates", "skipped_known", "scored", "relevant", "from_cache"):
+        job_metrics.count(f"images_{name}", getattr(stats, name))
+    job_metrics.count("images_accepted", len(stats.accepted))
+
 
 # The pipeline is now an async function to be called by the async scheduler
 async def run_image_pipeline(job_id: int):
     """
     The main background task. It finds a job and runs the full image processing pipeline.
     """
-    db = SessionLocal()
+    job_metrics = metrics.JobMetrics(job_id)
+    outcome = None  # Set once the job is ours, so its metrics get saved however it ends
     try:
-        job = db.query(Job).filter(Job.id == job_id).first()
+        # Database work goes through the I/O pool: under lock contention a query
+        # can wait out the whole busy_timeout, and the event loop must not.
+        job = await workers.run_io(_load_job, job_id)
         # Safety check: ensure the job exists and is in the correct state
         if not job or job.status != JobStatus.PROCESSING:
             print(f"[PIPELINE-WARN] Job #{job_id} not found or not in PROCESSING state. Skipping.")
             return
+        outcome = "crashed"
+        progress.start(job.id, job.image_count)
 
-        # --- 1. Fetch Images ---
-        num_to_fetch = job.image_count * 2
-        downloaded_paths = fetch.fetch_images(job.query, num_to_fetch, job.id)
-        if not downloaded_paths:
+        # --- 1-3. Fetch, Deduplicate and Filter, streamed ---
+        rendition = fetch.rendition_for(job.job_type)
+        stats = await _stream_images(job, rendition, job_metrics)
+        _count_results(job_metrics, stats)
+        print(
+            f"[JOB {job.id}] ✨ Stream complete: {stats.downloaded} downloaded, {stats.duplicates} duplicates, "
+            f"{stats.skipped_known} known duplicates skipped, "
+            f"{stats.scored} scored, {len(stats.accepted)} accepted ({stats.from_cache} from cache)."
+        )
+        if not stats.downloaded and not stats.accepted:
             print(f"[JOB {job.id}] ❌ Fetching failed. Marking job as FAILED.")
-            job.status = JobStatus.FAILED
-            db.commit()
-            return
-        
-        # --- 2. Deduplicate Images ---
-        unique_paths = deduplicate.deduplicate_images(downloaded_paths, job_id=job.id)
-        if not unique_paths:
-            print(f"[JOB {job.id}] ❌ Deduplication resulted in zero images. Marking job as FAILED.")
-            job.status = JobStatus.FAILED
-            db.commit()
+            await workers.run_io(_set_status, job.id, JobStatus.FAILED)
+            outcome = "failed"
+            progress.finish(job.id, JobStatus.FAILED)
+            await workers.run_io(retention_service.prune_job_files, job.id, [])
             return
 
-        # --- 3. Filter Images (AI) ---
-        filtered_paths = filter.filter_images(unique_paths, query=job.query, job_id=job.id)
+        filtered_paths = [candidate.path for candidate in stats.accepted]
         if not filtered_paths:
-            print(f"[JOB {job.id}] ❌ AI Filtering resulted in zero images. Marking job as FAILED.")
-            job.status = JobStatus.FAILED
-            db.commit()
+            print(f"[JOB {job.id}] ❌ Deduplication and AI filtering resulted in zero images. Marking job as FAILED.")
+            await workers.run_io(_set_status, job.id, JobStatus.FAILED)
+            outcome = "failed"
+            progress.finish(job.id, JobStatus.FAILED)
+            await workers.run_io(retention_service.prune_job_files, job.id, [])
             return
 
-        # --- 4. Save Results ---
+        # --- 4. Thumbnails for the results page ---
+        stats.report("renditions")
+        with job_metrics.span("renditions", len(filtered_paths)):
+            renditions_by_path = await _make_renditions(job.id, filtered_paths)
+
+        # --- 5. Build the download archive once, so downloads are plain file reads ---
+        # Before the INSERTs: they hold SQLite's write lock until the commit, and
+        # every other writer (lease heartbeats, new jobs) waits on it meanwhile.
+        try:
+            with job_metrics.span("archive", len(filtered_paths)):
+                await workers.run_io(archive_service.build_archive, job.id, filtered_paths)
+        except OSError as e:
+            print(f"[JOB {job.id}] ⚠️ Could not build the download archive ({e}). It will be built on first download.")
+
+        # --- 6. Save Results and Mark as Complete, in one short transaction ---
         print(f"[JOB {job.id}] 💾 Saving {len(filtered_paths)} final image paths to DB...")
-        for path in filtered_paths:
-            db.add(JobImage(job_id=job.id, file_path=path))
-        
-        # --- 5. Mark as Complete ---
-        job.status = JobStatus.COMPLETED
-        db.commit()
+        stats.report("saving")
+        with job_metrics.span("db_write", len(filtered_paths)):
+            await workers.run_io(_save_results, job.id, stats.accepted, renditions_by_path)
+        outcome = "completed"
+        progress.finish(job.id, JobStatus.COMPLETED, images=len(filtered_paths))
         print(f"🎉 [JOB {job.id}] Pipeline finished successfully. Awaiting email dispatch.")
 
-    finally:
-        db.close()
+        # --- 7. Offer the scored results to later jobs for the same query ---
+        scored = [
+            (candidate.photo, candidate.path, candidate.clip_score) for candidate in stats.candidates.items()
+            if candidate.clip_score is not None
+        ]
+        try:
+            with job_metrics.span("cache_store", len(scored)):
+                await workers.run_io(result_cache.store, job.query, rendition, scored)
+        except Exception as e:
+            print(f"[JOB {job.id}] ⚠️ Could not update the result cache: {e}")
+
+        # --- 8. Drop everything that didn't make the cut ---
+        with job_metrics.span("prune"):
+            await workers.run_io(retention_service.prune_job_files, job.id, filtered_paths)
 
+    except asyncio.CancelledError:
+        outcome = "cancelled" if outcome == "crashed" else outcome
+        raise
+    finally:
+        progress.release(job_id)  # No-op unless the job ended without an outcome
+        if outcome is not None:
+            summary = job_metrics.finish(outcome)
+            try:
+                await workers.run_io(_save_metrics, job_id, summary)
+            except Exception as e:
+                print(f"[JOB {job_id}] ⚠️ Could not save pipeline metrics: {e}")
+            slowest = sorted(summary["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True)[:3]
+            print(f"[JOB {job_id}] ⏱️ {outcome} in {summary['total_seconds']:.1f}s; slowest stages: "
+                  + ", ".join(f"{name} {entry['seconds']:.1f}s" for name, entry in slowest))
@@ -0,0 +1,116 @@
+"""
+Relevance ranking for a job's candidate images.
+
+Each relevant candidate (CLIP score at or above CLIP_FILTER_THRESHOLD) gets a
+base score: its CLIP score, plus RANK_QUALITY_WEIGHT times a 0-1 quality score
+built from resolution and sharpness. Candidates stream into `TopK`, a bounded
+min-heap that only ever holds the best `size` of them. Once the stream ends,
+`mmr_select` picks the final images from that pool with Maximal Marginal
+Relevance, so near-identical shots of the same scene don't crowd out
+everything else.
+"""
+import heapq
+import itertools
+import math
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import settings
+from app.image_processing import image_loader
+from app.image_processing.fetch import PexelsPhoto
+
+_SHARPNESS_SIDE = 512       # Sharpness is measured on a view of this size, so it doesn't depend on resolution
+_SHARPNESS_SATURATION = 1000.0  # Laplacian variance treated as "fully sharp"
+
+
+@dataclass
+class Candidate:
+    photo: PexelsPhoto | None
+    path: str
+    clip_score: float | None           # None when CLIP was unavailable
+    quality: float | None = None       # 0-1, None if it couldn't be measured
+    embedding: np.ndarray | None = None
+
+    @property
+    def score(self) -> float:
+        quality = 0.5 if self.quality is None else self.quality
+        return (self.clip_score or 0.0) + settings.RANK_QUALITY_WEIGHT * quality
+
+
+def image_quality(image_path: str) -> float | None:
+    """Averages a resolution score (megapixels vs RANK_TARGET_MEGAPIXELS) and a sharpness score."""
+    try:
+        with Image.open(image_path) as img:
+            megapixels = img.width * img.height / 1_000_000  # Header only, no decode
+        gray = np.asarray(image_loader.load(image_path, max_side=_SHARPNESS_SIDE).convert("L"), dtype=np.float32)
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not measure quality of {image_path}. Error: {e}.")
+        return None
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:])
+    sharpness = min(1.0, math.log1p(float(laplacian.var())) / math.log1p(_SHARPNESS_SATURATION))
+    resolution = min(1.0, megapixels / settings.RANK_TARGET_MEGAPIXELS)
+    return 0.5 * resolution + 0.5 * sharpness
+
+
+def quality_batch(image_paths: list[str]) -> list[float | None]:
+    """One worker task: the quality scores of several images."""
+    return [image_quality(path) for path in image_paths]
+
+
+class TopK:
+    """Keeps the `size` highest-scoring candidates pushed so far, in O(log size) per push."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: list[tuple[float, int, Candidate]] = []
+        self._order = itertools.count()  # Tie-breaker, so candidates themselves are never compared
+
+    def push(self, candidate: Candidate) -> bool:
+        """Adds a candidate; returns False if it didn't make the cut."""
+        entry = (candidate.score, next(self._order), candidate)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[0] <= self._heap[0][0]:
+            return False
+        heapq.heapreplace(self._heap, entry)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def items(self) -> list[Candidate]:
+        return [candidate for _, _, candidate in self._heap]
+
+
+def mmr_select(candidates: list[Candidate], k: int, mmr_lambda: float | None = None) -> list[Candidate]:
+    """
+    Greedily picks `k` candidates, each maximizing
+        lambda * relevance - (1 - lambda) * (highest cosine similarity to an already picked image)
+    where relevance is the base score rescaled to 0-1 within the pool. Candidates
+    without an embedding are never penalized. Returns them in pick order.
+    """
+    mmr_lambda = settings.RANK_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    if not candidates:
+        return []
+    scores = np.array([c.score for c in candidates])
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones(len(candidates))
+
+    has_embedding = np.array([c.embedding is not None for c in candidates])
+    dim = next((len(c.embedding) for c in candidates if c.embedding is not None), 1)
+    vectors = np.stack([c.embedding if c.embedding is not None else np.zeros(dim) for c in candidates])
+
+    max_similarity = np.zeros(len(candidates))
+    remaining = list(range(len(candidates)))
+    picked = []
+    while remaining and len(picked) < k:
+        values = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * max_similarity[remaining]
+        best = remaining.pop(int(np.argmax(values)))
+        picked.append(candidates[best])
+        if has_embedding[best]:
+            similarity = np.where(has_embedding, vectors @ vectors[best], 0.0)
+            max_similarity = np.maximum(max_similarity, similarity)
+    return picked
@@ -0,0 +1,52 @@
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.image_processing import image_loader
+
+_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+_SAVE_OPTIONS = {"webp": {"method": 4}, "jpeg": {"optimize": True, "progressive": True}}
+
+
+def rendition_path(image_path: str, width: int, fmt: str) -> Path:
+    """Renditions live in a `renditions/` folder next to the original."""
+    original = Path(image_path)
+    return original.parent / "renditions" / f"{original.stem}_{width}w{_EXTENSIONS[fmt]}"
+
+
+def make_renditions(image_path: str) -> list[dict]:
+    """
+    Writes the RENDITION_WIDTHS x RENDITION_FORMATS renditions of one image and
+    returns their metadata. Pixels come from the shared image loader, which
+    decodes wide enough for the largest rendition; smaller widths are resized
+    from the previous one. Widths above the decoded image's are skipped (if all
+    are, a single rendition is made at its own width).
+    """
+    try:
+        current = ImageOps.exif_transpose(image_loader.load(image_path))
+        widths = sorted({w for w in settings.RENDITION_WIDTHS if w <= current.width}, reverse=True)
+        widths = widths or [current.width]
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not create renditions for {os.path.basename(image_path)}. Error: {e}. Skipping.")
+        return []
+
+    results = []
+    for width in widths:
+        if current.width != width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt in settings.RENDITION_FORMATS:
+            if fmt not in _EXTENSIONS:
+                continue
+            path = rendition_path(image_path, width, fmt)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            current.save(path, fmt.upper(), quality=settings.RENDITION_QUALITY, **_SAVE_OPTIONS[fmt])
+            results.append({"width": current.width, "height": current.height, "format": fmt, "file_path": str(path)})
+    return results
+
+
+def make_renditions_batch(image_paths: list[str]) -> list[list[dict]]:
+    """One worker task: the renditions of several images."""
+    return [make_renditions(path) for path in image_paths]
@@ -1,13 +1,25 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from app.routes import images
 from app.core.paths import TEMPLATES_DIR, DOWNLOADS_DIR
 # --- FIX: Import the new job scheduler function ---
-from app.services.job_scheduler import check_for_jobs
+from app.services.job_scheduler import check_for_jobs, release_claims
+from app.services import job_scheduler, metrics, notification_service, progress, result_cache, retention_service, workers
+from app.services.inference_service import inference_service
+from app.image_processing import filter, image_loader
+from app.models.job import SessionLocal, Job
+from sqlalchemy import func
+from app.core.config import settings
 
 app = FastAPI()
+metrics.set_gauge("app_import_seconds", time.perf_counter() - _import_started)
+print(f"INFO:     App imported in {time.perf_counter() - _import_started:.2f}s.")
 
 # Mount static and download directories
 app.mount("/downloads", StaticFiles(directory=DOWNLOADS_DIR), name="downloads")
@@ -18,10 +30,27 @@ scheduler = AsyncIOScheduler()
 @app.on_event("startup")
 def on_startup():
     # The startup logic is now very clean.
+    started = time.perf_counter()
     print("INFO:     Starting background job scheduler...")
-    scheduler.add_job(check_for_jobs, "interval", seconds=30, id="main_job_worker", replace_existing=True)
+    scheduler.add_job(check_for_jobs, "interval", seconds=settings.SCHEDULER_POLL_SECONDS, id="main_job_worker", replace_existing=True)
+    scheduler.add_job(notification_service.dispatch_notifications, "interval", seconds=settings.NOTIFY_POLL_SECONDS, id="notifications", replace_existing=True)
+    scheduler.add_job(retention_service.run_retention, "interval", minutes=settings.RETENTION_INTERVAL_MINUTES, id="retention", replace_existing=True)
     scheduler.start()
-    print("INFO:     Startup complete.")
+    if settings.WORKER_WARMUP:
+        # Off the request path: the app serves while torch and CLIP load in the workers.
+        workers.start_warm_up()
+    metrics.set_gauge("startup_seconds", time.perf_counter() - started)
+    print(f"INFO:     Startup complete in {time.perf_counter() - started:.2f}s.")
+
+@app.on_event("shutdown")
+def on_shutdown():
+    scheduler.shutdown(wait=False)
+    release_claims()
+    workers.shutdown()
+
+@app.on_event("shutdown")
+async def close_notifications():
+    await notification_service.shutdown()
 
 # Include API routes
 app.include_router(images.router, prefix="/api")
@@ -30,5 +59,25 @@ app.include_router(images.router, prefix="/api")
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 @app.get("/", include_in_schema=False)
 async def serve_home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus scrape endpoint: pipeline stage totals plus cache and service stats for this process."""
+    db = SessionLocal()
+    try:
+        job_counts = {status.value: count for status, count in db.query(Job.status, func.count(Job.id)).group_by(Job.status)}
+    finally:
+        db.close()
+    if filter.model_load_seconds is not None:
+        metrics.set_gauge("clip_model_load_seconds", filter.model_load_seconds)
+    metrics.set_gauge("jobs_running", job_scheduler.running_jobs())
+    body = metrics.render_prometheus(job_counts, {
+        "result_cache": result_cache.stats(),
+        "image_cache": image_loader.stats(),
+        "inference": inference_service.stats(),
+        "notifications": notification_service.stats(),
+        "progress": progress.stats(),
+        "retention": retention_service.stats(),
+    })
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
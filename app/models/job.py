@@ -1,14 +1,39 @@
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, Enum, func, ForeignKey, Boolean
+    create_engine, event, Column, Integer, Float, String, DateTime, Enum, JSON, func, ForeignKey, Boolean, Index, inspect, text
 )
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker, Mapped, mapped_column
 import enum
-from app.core.paths import DATABASE_FILE
+from app.core.paths import DATABASE_FILE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB, SQLITE_SYNCHRONOUS, download_url
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_FILE}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """
+    Per-connection pragmas. WAL lets the web server read while the scheduler or
+    a pipeline writes; busy_timeout makes a second writer wait for the lock
+    instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")  # Negative = KiB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def create_sqlite_engine(url: str) -> Engine:
+    """An engine for a SQLite file with the pragmas above applied to every connection."""
+    sqlite_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+    event.listen(sqlite_engine, "connect", _configure_sqlite)
+    return sqlite_engine
+
+engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -27,22 +52,140 @@ class Job(Base):
     job_type: Mapped[JobType] = mapped_column(Enum(JobType))
     status: Mapped[JobStatus] = mapped_column(Enum(JobStatus), default=JobStatus.PENDING, nullable=False)
     email_sent: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    # Notification retries: failed sends are retried with backoff, up to NOTIFY_MAX_ATTEMPTS
+    email_attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    email_next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
+    # Scheduler claim: which worker owns a PROCESSING job, and until when.
+    # Workers heartbeat the lease; an expired lease means the owner died.
+    claimed_by: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    # Per-stage timings and counters from the last pipeline run (see services/metrics.py)
+    metrics: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
     
     # --- FIX: Corrected typo 'back_pop_ulates' to 'back_populates' ---
     images: Mapped[List["JobImage"]] = relationship("JobImage", back_populates="job", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # claim_next_job: oldest PENDING job in a lane
+        Index("ix_jobs_status_type_id", "status", "job_type", "id"),
+        # send_completed_notifications: COMPLETED jobs not yet emailed
+        Index("ix_jobs_status_email_sent", "status", "email_sent"),
+        # Retention: finished jobs, oldest first (lease reclaim uses the status prefix)
+        Index("ix_jobs_status_updated_at", "status", "updated_at"),
+    )
+
 class JobImage(Base):
     __tablename__ = "job_images"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("jobs.id"))
+    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("jobs.id"), index=True)
     file_path: Mapped[str] = mapped_column(String)
+    # Ranking inputs and result (see image_processing/rank.py), kept so re-ranking needs no inference
+    clip_score: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    quality: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    score: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     
     # --- FIX: Corrected typo 'back_pop_ulates' to 'back_populates' ---
     job: Mapped["Job"] = relationship("Job", back_populates="images")
+    renditions: Mapped[List["ImageRendition"]] = relationship(
+        "ImageRendition", back_populates="image", cascade="all, delete-orphan", order_by="ImageRendition.width"
+    )
+
+    @property
+    def url(self) -> Optional[str]:
+        return download_url(self.file_path)
+
+class ImageRendition(Base):
+    """A resized copy of a JobImage (e.g. a 320px WebP thumbnail), stored next to the original."""
+    __tablename__ = "image_renditions"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    image_id: Mapped[int] = mapped_column(Integer, ForeignKey("job_images.id"), index=True)
+    width: Mapped[int] = mapped_column(Integer)
+    height: Mapped[int] = mapped_column(Integer)
+    format: Mapped[str] = mapped_column(String)  # "webp" or "jpeg"
+    file_path: Mapped[str] = mapped_column(String)
+
+    image: Mapped["JobImage"] = relationship("JobImage", back_populates="renditions")
+
+    @property
+    def url(self) -> Optional[str]:
+        return download_url(self.file_path)
+
+class PhotoHash(Base):
+    """Perceptual hash of a Pexels photo, kept across jobs for near-duplicate lookups."""
+    __tablename__ = "photo_hashes"
+    photo_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    url: Mapped[str] = mapped_column(String, index=True)
+    phash: Mapped[str] = mapped_column(String(16))  # 64-bit phash as hex
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+class QueryCacheEntry(Base):
+    """Ranked, filtered results of earlier jobs for one normalized query and rendition."""
+    __tablename__ = "query_cache"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    query_key: Mapped[str] = mapped_column(String, index=True)
+    rendition: Mapped[str] = mapped_column(String)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    hits: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    images: Mapped[List["QueryCacheImage"]] = relationship(
+        "QueryCacheImage", back_populates="entry", cascade="all, delete-orphan", order_by="QueryCacheImage.score.desc()"
+    )
+
+class QueryCacheImage(Base):
+    __tablename__ = "query_cache_images"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entry_id: Mapped[int] = mapped_column(Integer, ForeignKey("query_cache.id"), index=True)
+    photo_id: Mapped[int] = mapped_column(Integer)
+    url: Mapped[str] = mapped_column(String)
+    width: Mapped[int] = mapped_column(Integer)
+    height: Mapped[int] = mapped_column(Integer)
+    score: Mapped[float] = mapped_column(Float)
+    file_path: Mapped[str] = mapped_column(String, index=True)  # The cache's own hard link, under CACHE_DIR
+    size_bytes: Mapped[int] = mapped_column(Integer)
+
+    entry: Mapped["QueryCacheEntry"] = relationship("QueryCacheEntry", back_populates="images")
+
+def _add_missing_columns():
+    """
+    create_all() never alters existing tables, so an older jobs.db would lack
+    columns added since. Add them in place (SQLite only supports ADD COLUMN).
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" NOT NULL DEFAULT {column.type.literal_processor(engine.dialect)(column.default.arg)}"
+                print(f"Migrating: adding column {table.name}.{column.name}")
+                conn.execute(text(ddl))
+
+def _add_missing_indexes():
+    """create_all() only creates indexes along with new tables; add any an older jobs.db is missing."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                print(f"Migrating: adding index {index.name} on {table.name}")
+                index.create(bind=conn, checkfirst=True)
 
 def create_db_and_tables():
-    """Creates all database tables defined in this model."""
-    # We no longer need checkfirst=True because this will only run once.
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    """Creates all database tables defined in this model, and migrates older ones."""
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _add_missing_indexes()
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA optimize"))  # Refreshes planner statistics for the new indexes
\ No newline at end of file
@@ -1,16 +1,18 @@
-from typing import List
+from typing import List, Literal, Optional
 from fastapi import APIRouter, Depends, Request, HTTPException, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, EmailStr, Field, computed_field
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter, computed_field
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
+import asyncio
 import os
-import io
-import zipfile
 
-from app.models.job import Job, JobType, JobStatus, JobImage, SessionLocal
-from app.image_processing.pipeline import run_image_pipeline
+from app.models.job import Job, JobType, JobStatus, JobImage, ImageRendition, SessionLocal
+from app.core.config import settings
+from app.services import archive_service, job_scheduler, progress, workers
+from app.services.zip_stream import ZipStream
 from app.core.paths import TEMPLATES_DIR
 
 router = APIRouter()
@@ -29,32 +31,90 @@ class JobCreationResponse(BaseModel):
     message: str
     job_id: int
 
+class RenditionResponse(BaseModel):
+    """A resized copy of an image, for display."""
+    width: int
+    height: int
+    format: str
+    url: Optional[str]
+
+    class Config:
+        from_attributes = True
+
+def _thumbnail_order(rendition) -> tuple:
+    """Smallest first, WebP before JPEG at the same width."""
+    return rendition.width, rendition.format != "webp"
+
 class JobImageResponse(BaseModel):
     """Data model for a single image record in the database."""
     id: int
     file_path: str
+    url: Optional[str]
+    score: Optional[float] = None
+    clip_score: Optional[float] = None
+    renditions: List[RenditionResponse] = []
     
     @computed_field
     @property
     def filename(self) -> str:
         return os.path.basename(self.file_path)
 
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        """The smallest rendition, preferring WebP; the original if there are none."""
+        for rendition in sorted(self.renditions, key=_thumbnail_order):
+            return rendition.url
+        return self.url
+
     class Config:
         from_attributes = True
 
-class JobResponse(BaseModel):
-    """Data model for a single job, including its final images."""
+class JobSummaryResponse(BaseModel):
+    """A job without its images, for list views."""
     id: int
     query: str
-    email: EmailStr
     image_count: int
     job_type: JobType
     status: JobStatus
     created_at: datetime
-    images: List[JobImageResponse] = []
+
     class Config:
         from_attributes = True
 
+class JobResponse(JobSummaryResponse):
+    """Data model for a single job, including its final images."""
+    email: EmailStr
+    images: List[JobImageResponse] = []
+    metrics: Optional[dict] = None  # Stage timings and counters, once the pipeline has run
+
+# Loads a job's images and their renditions in one query each, instead of one per job and per image.
+# selectinload batches 500 ids per IN, so the renditions take one more query per 500 images.
+_WITH_IMAGES = selectinload(Job.images).selectinload(JobImage.renditions)
+
+# Validates a page of jobs in one pass and serializes it straight to JSON.
+_JOB_PAGES = {"full": TypeAdapter(List[JobResponse]), "summary": TypeAdapter(List[JobSummaryResponse])}
+
+def _attach_thumbnails(db: Session, jobs: list[Job]):
+    """
+    For list pages: loads each image's thumbnail for the whole page in one query
+    and sets it as the image's only rendition, instead of loading (and sending)
+    every rendition of every image. /jobs/{job_id} still has them all.
+    """
+    images = {image.id: image for job in jobs for image in job.images}
+    thumbnails: dict[int, ImageRendition] = {}
+    if images:
+        renditions = (
+            db.query(ImageRendition).join(JobImage, ImageRendition.image_id == JobImage.id)
+            .filter(JobImage.job_id.in_([job.id for job in jobs]))
+        )
+        for rendition in renditions:
+            best = thumbnails.get(rendition.image_id)
+            if best is None or _thumbnail_order(rendition) < _thumbnail_order(best):
+                thumbnails[rendition.image_id] = rendition
+    for image_id, image in images.items():
+        set_committed_value(image, "renditions", [thumbnails[image_id]] if image_id in thumbnails else [])
+
 # --- Database Dependency ---
 
 def get_db():
@@ -89,7 +149,9 @@ async def handle_image_request(
         db.add(new_job)
         db.commit()
         db.refresh(new_job)
-        
+        # Start it now if a slot is free, rather than at the next scheduler poll.
+        job_scheduler.wake_up()
+
         return {
             "message": "Job Accepted",
             "job_id": new_job.id
@@ -98,42 +160,148 @@ async def handle_image_request(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create job: {str(e)}")
 
-@router.get("/jobs", response_model=List[JobResponse])
-async def get_all_jobs(db: Session = Depends(get_db), limit: int = Query(20, ge=1, le=100)):
-    """Returns a list of recent jobs from the database."""
-    return db.query(Job).order_by(Job.id.desc()).limit(limit).all()
+@router.get("/jobs", response_model=List[JobResponse] | List[JobSummaryResponse])
+async def get_all_jobs(
+    request: Request,
+    db: Session = Depends(get_db),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[int] = Query(None, ge=1, description="Return jobs older than this id (the previous page's X-Next-Cursor)"),
+    fields: Literal["full", "summary"] = Query("full", description="'summary' omits email and images"),
+):
+    """
+    Returns recent jobs, newest first, one page at a time. Pages are keyed on
+    the job id, so each costs the same however deep it is. When there are more,
+    the next page's cursor is in the X-Next-Cursor header (and a Link header).
+    With `fields=full` each image carries only its thumbnail rendition.
+    """
+    query = db.query(Job).order_by(Job.id.desc())
+    if cursor is not None:
+        query = query.filter(Job.id < cursor)
+    if fields == "full":
+        # A page is at most 101 job ids, so the images take one query (selectinload batches 500 per IN).
+        query = query.options(selectinload(Job.images))
+    jobs = query.limit(limit + 1).all()  # One extra row tells us whether there's a next page
+    if fields == "full":
+        _attach_thumbnails(db, jobs)  # One more query: three in all, whatever the page size
+
+    headers = {}
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        next_cursor = str(jobs[-1].id)
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    # Returning a Response skips FastAPI's second validation pass over response_model.
+    page = _JOB_PAGES[fields]
+    return Response(page.dump_json(page.validate_python(jobs, from_attributes=True)), media_type="application/json", headers=headers)
 
 @router.get("/jobs/{job_id}", response_model=JobResponse)
 async def get_job_by_id(job_id: int, db: Session = Depends(get_db)):
     """Fetches a single job by ID, including its final images."""
-    job = db.query(Job).filter(Job.id == job_id).first()
+    job = db.query(Job).options(_WITH_IMAGES).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
+@router.get("/jobs/{job_id}/events", name="stream_job_events")
+async def stream_job_events(job_id: int):
+    """
+    Streams a job's progress as Server-Sent Events, instead of polling /jobs/{job_id}:
+    `progress` (status, stage and running counts), `images` (candidates as they're
+    accepted, for a results page that fills in as it goes) and a final `done`.
+    Watchers share one source per job, so their number barely touches the database.
+    """
+    # A short session of its own: a dependency's session would stay open for the whole stream.
+    status = await workers.run_io(progress.job_status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async with progress.watch(job_id, status) as queue:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), settings.PROGRESS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield progress.format_event(event, data)
+                if event == "done":
+                    return
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # No proxy buffering of the stream
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 @router.get("/results/{job_id}", name="get_job_results")
 async def get_job_results(request: Request, job_id: int, db: Session = Depends(get_db)):
     """Fetches a job and its images and renders the results HTML page."""
-    job = db.query(Job).filter(Job.id == job_id).first()
+    job = db.query(Job).options(_WITH_IMAGES).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return templates.TemplateResponse("results.html", {"request": request, "job": job})
+    return templates.TemplateResponse(request, "results.html", {"job": job})
+
+def _parse_range(range_header: str, length: int) -> tuple[int, int] | None:
+    """Parses a single-range `bytes=` header. Returns None for anything we don't serve partially."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else length - 1
+        else:
+            start, end = max(0, length - int(last)), length - 1  # Suffix range: the last N bytes
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.", headers={"Content-Range": f"bytes */{length}"})
+    return start, min(end, length - 1)
+
+def _stream_archive(archive: ZipStream, request: Request, headers: dict) -> StreamingResponse:
+    """Streams an archive built on the fly, honouring a single byte range when its size is known."""
+    headers["ETag"] = archive.etag
+    length = archive.content_length
+    if length is None:
+        # Some member is deflated, so the size isn't known up front: plain chunked transfer.
+        return StreamingResponse(archive.iter_bytes(), media_type="application/x-zip-compressed", headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == archive.etag):
+        byte_range = _parse_range(range_header, length)
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(archive.iter_bytes(), media_type="application/x-zip-compressed", headers=headers)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return StreamingResponse(
+        archive.iter_bytes(start, end), status_code=206, media_type="application/x-zip-compressed", headers=headers
+    )
 
 @router.get("/download/{job_id}", name="download_zip")
-async def download_job_images_as_zip(job_id: int, db: Session = Depends(get_db)):
-    """Finds a job, zips its final images, and streams the download."""
+async def download_job_images_as_zip(job_id: int, request: Request, db: Session = Depends(get_db)):
+    """Serves the job's pre-built ZIP, rebuilding it first if it was evicted from the archive cache."""
     job = db.query(Job).filter(Job.id == job_id).first()
     if not job or not job.images:
         raise HTTPException(status_code=404, detail="No completed job or images found to download.")
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for image in job.images:
-            if os.path.exists(image.file_path):
-                zf.write(image.file_path, os.path.basename(image.file_path))
-
-    zip_buffer.seek(0)
-    
+    files = [image.file_path for image in job.images]
     headers = {'Content-Disposition': f'attachment; filename="job_{job_id}_{job.query}.zip"'}
-    return StreamingResponse(zip_buffer, media_type="application/x-zip-compressed", headers=headers)
+    try:
+        path = await workers.run_io(archive_service.get_archive, job.id, files)
+        stat = path.stat()
+    except OSError as e:
+        # Also covers an archive evicted between get_archive() and the stat().
+        print(f"[JOB {job.id}] ⚠️ Could not build the download archive on disk ({e}). Streaming it instead.")
+        archive = ZipStream([(file, os.path.basename(file)) for file in files])
+        if not archive.entries:
+            raise HTTPException(status_code=404, detail="No completed job or images found to download.")
+        return _stream_archive(archive, request, headers)
 
+    headers["ETag"] = archive_service.archive_etag(stat)
+    if request.headers.get("if-none-match") in (headers["ETag"], "*"):
+        return Response(status_code=304, headers={"ETag": headers["ETag"]})
+    # FileResponse handles Range/If-Range and uses the server's zero-copy sendfile path when available.
+    return FileResponse(path, media_type="application/x-zip-compressed", headers=headers, stat_result=stat)
@@ -0,0 +1,105 @@
+"""
+Pre-built job archives.
+
+A job's ZIP is written once, at completion, to DOWNLOADS_DIR/job_{id}/job_{id}.zip,
+and served as a plain file from then on. The archives together are kept under
+ARCHIVE_CACHE_MAX_MB by evicting the least recently downloaded ones; an evicted
+archive is rebuilt the next time someone asks for it.
+
+Recency is tracked in the file's atime, set explicitly on every hit, so the
+mtime (and the ETag derived from it) only changes when the archive is rebuilt.
+An archive used in the last IN_USE_SECONDS is never evicted, so one that was
+just handed to a request is still there when the response opens it.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.paths import DOWNLOADS_DIR
+from app.services import storage_service
+from app.services.zip_stream import ZipStream
+
+IN_USE_SECONDS = 60
+# A fixed set of locks shared by job id, so there's no per-job entry to clean up.
+_build_locks = [threading.Lock() for _ in range(32)]
+_evict_lock = threading.Lock()
+
+
+def archive_path(job_id: int) -> Path:
+    return storage_service.job_dir(job_id) / f"job_{job_id}.zip"
+
+
+def _lock_for(job_id: int) -> threading.Lock:
+    return _build_locks[job_id % len(_build_locks)]
+
+
+def _touch(path: Path):
+    """Marks an archive as recently used without changing its mtime."""
+    stat = path.stat()
+    os.utime(path, (time.time(), stat.st_mtime))
+
+
+def build_archive(job_id: int, files: list[str]) -> Path:
+    """Writes the job's archive under a temp name and renames it into place. Returns its path."""
+    path = archive_path(job_id)
+    # A unique temp name: another process (or the pipeline and a download) may build the same archive at once.
+    temp_path = storage_service.temp_path(path)
+    started = time.perf_counter()
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in ZipStream([(file, os.path.basename(file)) for file in files]).iter_bytes():
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    size_mb = path.stat().st_size / (1024 * 1024)
+    print(f"[JOB {job_id}] 🗜️ Built download archive ({size_mb:.1f} MB) in {time.perf_counter() - started:.2f}s.")
+    enforce_budget(keep=path)
+    return path
+
+
+def get_archive(job_id: int, files: list[str]) -> Path:
+    """Returns the job's archive, rebuilding it first if it was evicted."""
+    path = archive_path(job_id)
+    with _lock_for(job_id):
+        if path.exists():
+            _touch(path)
+            return path
+        return build_archive(job_id, files)
+
+
+def enforce_budget(keep: Path | None = None) -> int:
+    """
+    Deletes least recently used archives until the total fits ARCHIVE_CACHE_MAX_MB,
+    sparing those in use. Returns bytes freed.
+    """
+    budget = settings.ARCHIVE_CACHE_MAX_MB * 1024 * 1024
+    in_use_since = time.time() - IN_USE_SECONDS
+    with _evict_lock:
+        archives = []
+        for path in DOWNLOADS_DIR.glob("job_*/job_*.zip"):
+            try:
+                archives.append((path.stat().st_atime, path.stat().st_size, path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in archives)
+        freed = 0
+        for used_at, size, path in sorted(archives, key=lambda a: a[0]):
+            if total <= budget or used_at >= in_use_since:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            freed += size
+        if freed:
+            print(f"🧹 Evicted {freed / (1024 * 1024):.1f} MB of download archives (budget {settings.ARCHIVE_CACHE_MAX_MB} MB).")
+        return freed
+
+
+def archive_etag(stat: os.stat_result) -> str:
+    """Strong validator for an archive; changes only when the archive is rebuilt."""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{int(stat.st_mtime * 1000):x}"'
@@ -1,40 +1,125 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+"""
+Sends the "your images are ready" emails.
+
+Connections are pooled: up to NOTIFY_CONCURRENCY SMTP sessions (TLS handshake
+and login included) stay open between sends and are reused, instead of one
+connection per email. Sessions idle for longer than NOTIFY_SMTP_IDLE_SECONDS
+are closed before the server drops them. The template is compiled once.
+"""
+import asyncio
+import time
+from email.message import EmailMessage
+
+import aiosmtplib
 from jinja2 import Environment, FileSystemLoader
+
 from app.core.config import settings
-# --- FIX: Import the new centralized path ---
 from app.core.paths import TEMPLATES_DIR
 
-# This part remains the same
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.MAIL_USERNAME,
-    MAIL_PASSWORD=settings.MAIL_PASSWORD,
-    MAIL_FROM=settings.MAIL_FROM,
-    MAIL_PORT=settings.MAIL_PORT,
-    MAIL_SERVER=settings.MAIL_SERVER,
-    MAIL_STARTTLS=settings.MAIL_STARTTLS,
-    MAIL_SSL_TLS=settings.MAIL_SSL_TLS,
-    USE_CREDENTIALS=settings.USE_CREDENTIALS,
-    VALIDATE_CERTS=settings.VALIDATE_CERTS,
-    MAIL_DEBUG=True,
-)
-
-# --- FIX: Use the new, unambiguous path from our config file ---
-env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+# auto_reload=False: compile the template once, never re-stat it per email.
+env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), auto_reload=False)
+_template = None
 
-async def send_email_notification(recipient_email: str, query: str, results_url: str):
-    """Renders the email template manually and sends the email."""
-    # We moved the try/except block to the scheduler for better logic control.
-    template = env.get_template("email_template.html")
-    html_content = template.render(query=query, results_url=results_url)
-
-    message = MessageSchema(
-        subject=f"Your Image Set for '{query}' is Ready!",
-        recipients=[recipient_email],
-        body=html_content,
-        subtype="html"
-    )
-
-    fm = FastMail(conf)
-    print(f"📧 Preparing to send email for query '{query}' to {recipient_email}...")
-    await fm.send_message(message)
 
+def render_notification(query: str, results_url: str) -> str:
+    global _template
+    if _template is None:
+        _template = env.get_template("email_template.html")
+    return _template.render(query=query, results_url=results_url)
+
+
+def build_message(recipient_email: str, query: str, results_url: str) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = f"Your Image Set for '{query}' is Ready!"
+    message["From"] = settings.MAIL_FROM
+    message["To"] = recipient_email
+    message.set_content(render_notification(query, results_url), subtype="html")
+    return message
+
+
+class SmtpPool:
+    """A bounded pool of logged-in SMTP sessions. `size` is also the cap on concurrent sends."""
+
+    def __init__(self, size: int):
+        self._slots = asyncio.Semaphore(size)
+        self._idle: list[tuple[float, aiosmtplib.SMTP]] = []  # (returned at, session), most recent last
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.MAIL_SERVER,
+            port=settings.MAIL_PORT,
+            use_tls=settings.MAIL_SSL_TLS,
+            start_tls=settings.MAIL_STARTTLS,
+            validate_certs=settings.VALIDATE_CERTS,
+            timeout=settings.NOTIFY_SMTP_TIMEOUT,
+        )
+        await smtp.connect()
+        if settings.USE_CREDENTIALS:
+            await smtp.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)
+        return smtp
+
+    def _take_idle(self) -> aiosmtplib.SMTP | None:
+        cutoff = time.monotonic() - settings.NOTIFY_SMTP_IDLE_SECONDS
+        while self._idle:
+            returned_at, smtp = self._idle.pop()
+            if returned_at >= cutoff and smtp.is_connected:
+                return smtp
+            smtp.close()  # Stale: the server has likely timed it out already
+        return None
+
+    async def send(self, message: EmailMessage):
+        """Sends over a pooled session, reconnecting once if the pooled one turns out to be dead."""
+        async with self._slots:
+            smtp = self._take_idle()
+            reused = smtp is not None
+            try:
+                if smtp is None:
+                    smtp = await self._connect()
+                try:
+                    await smtp.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    if not reused:
+                        raise
+                    smtp.close()
+                    smtp = await self._connect()
+                    await smtp.send_message(message)
+            except (aiosmtplib.SMTPDataError, aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused):
+                # The server refused this message, but the session is fine: keep it.
+                self._idle.append((time.monotonic(), smtp))
+                raise
+            except BaseException:
+                if smtp is not None:
+                    smtp.close()
+                raise
+            self._idle.append((time.monotonic(), smtp))
+
+    async def close(self):
+        while self._idle:
+            _, smtp = self._idle.pop()
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+
+_pool: SmtpPool | None = None
+
+
+def get_pool() -> SmtpPool:
+    global _pool
+    if _pool is None:
+        _pool = SmtpPool(settings.NOTIFY_CONCURRENCY)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def send_email_notification(recipient_email: str, query: str, results_url: str):
+    """Renders the notification and sends it over a pooled SMTP connection."""
+    print(f"📧 Sending email for query '{query}' to {recipient_email}...")
+    await get_pool().send(build_message(recipient_email, query, results_url))
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.image_processing import filter
+from app.services import workers
+
+
+class InferenceService:
+    """
+    Dynamic batching for CLIP image embeddings across every job in this process.
+
+    Jobs submit small chunks of images; a single dispatcher merges whatever is
+    queued into batches of up to INFERENCE_MAX_BATCH_SIZE, waiting at most
+    INFERENCE_MAX_WAIT for a batch to fill, and keeps one batch in flight per
+    CPU worker so the pool never sits idle while requests are queued.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        # Counters, exposed through stats()
+        self.batches = 0
+        self.images = 0
+        self.busy_seconds = 0.0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.max_batch_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._queue = asyncio.Queue()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def embed(self, image_paths: list[str]) -> np.ndarray | None:
+        """Returns normalized CLIP embeddings for `image_paths`, or None if CLIP is unavailable."""
+        if not image_paths:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for path in image_paths:
+            future = loop.create_future()
+            self._queue.put_nowait((path, future))
+            futures.append(future)
+        vectors = await asyncio.gather(*futures)
+        if any(vector is None for vector in vectors):
+            return None
+        return np.stack(vectors)
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + settings.INFERENCE_MAX_WAIT
+        while len(batch) < settings.INFERENCE_MAX_BATCH_SIZE:
+            # Take everything already queued without waiting...
+            while not self._queue.empty() and len(batch) < settings.INFERENCE_MAX_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+            timeout = deadline - time.monotonic()
+            if len(batch) >= settings.INFERENCE_MAX_BATCH_SIZE or timeout <= 0:
+                break
+            # ...then give other jobs a brief chance to top the batch up.
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self):
+        while True:
+            while len(self._in_flight) >= settings.WORKER_PROCESSES:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+            batch = await self._next_batch()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch: list):
+        paths = [path for path, _ in batch]
+        started = time.perf_counter()
+        try:
+            vectors = await workers.run_cpu_pinned(filter.embed_images, paths)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        self.batches += 1
+        self.images += len(batch)
+        self.busy_seconds += elapsed
+        self.last_batch_size = len(batch)
+        self.last_batch_seconds = elapsed
+        self.max_batch_seconds = max(self.max_batch_seconds, elapsed)
+
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(None if vectors is None else vectors[i])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_in_flight": len(self._in_flight),
+            "avg_batch_size": self.images / self.batches if self.batches else 0.0,
+            "avg_batch_seconds": self.busy_seconds / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_seconds": self.last_batch_seconds,
+            "max_batch_seconds": self.max_batch_seconds,
+            "images_per_busy_second": self.images / self.busy_seconds if self.busy_seconds else 0.0,
+        }
+
+
+inference_service = InferenceService()
@@ -1,61 +1,217 @@
-from app.models.job import SessionLocal, Job, JobStatus
-from app.services import email_service
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update, or_
+
+from app.models.job import SessionLocal, Job, JobStatus, JobType
+from app.services import notification_service, profiling, progress, workers
 from app.image_processing.pipeline import run_image_pipeline
 from app.core.config import settings
 
+
+# Running pipeline tasks in this process, mapped to their lane (JobType).
+_running: dict[asyncio.Task, JobType] = {}
+_dispatch_lock: asyncio.Lock | None = None
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def worker_id() -> str:
+    """
+    Identifies this process in Job.claimed_by, so leases can only be renewed by their owner.
+    Read on every call: gunicorn workers are forked from a master that imported this module.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _lease_deadline() -> datetime:
+    return _utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+
 async def check_for_jobs():
     """
     The main worker function that runs on a schedule.
-    It processes one pending job and sends notifications for all completed jobs.
+    It fills free job slots; notifications are sent by notification_service on their own schedule.
     """
     print("⏰ Worker checking for jobs...")
-    await process_one_pending_job()
-    await send_completed_notifications()
+    await workers.run_io(reclaim_expired_leases)
+    await dispatch_jobs()
 
-async def process_one_pending_job():
-    """Finds the oldest pending job and runs the image pipeline on it."""
+
+def wake_up():
+    """Asks the dispatcher to look for work now instead of at the next poll (call from the event loop)."""
+    asyncio.get_running_loop().create_task(dispatch_jobs())
+
+
+def running_jobs() -> int:
+    """Pipelines running in this process right now."""
+    return len(_running)
+
+
+def claim_next_job(lane: JobType) -> int | None:
+    """
+    Atomically claims the oldest PENDING job in a lane. The conditional UPDATE only
+    succeeds for one worker, so several processes can poll the same database safely.
+    """
     db = SessionLocal()
     try:
-        # Find the oldest job that is still pending
-        job_to_process = db.query(Job).filter(Job.status == JobStatus.PENDING).order_by(Job.id).first()
-        
-        if job_to_process:
-            print(f"Found pending job #{job_to_process.id}. Starting pipeline...")
-            # Mark job as PROCESSING so another worker doesn't pick it up
-            job_to_process.status = JobStatus.PROCESSING
+        candidates = (
+            db.query(Job.id)
+            .filter(Job.status == JobStatus.PENDING, Job.job_type == lane)
+            .order_by(Job.id)
+            .limit(settings.SCHEDULER_SLOTS)
+            .all()
+        )
+        for (job_id,) in candidates:
+            result = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == JobStatus.PENDING)
+                .values(status=JobStatus.PROCESSING, claimed_by=worker_id(), lease_expires_at=_lease_deadline())
+                .execution_options(synchronize_session=False)
+            )
             db.commit()
-            # Run the main pipeline
-            await run_image_pipeline(job_to_process.id)
+            if result.rowcount == 1:
+                return job_id
+            # Another worker won the race for this one; try the next candidate.
+        return None
     finally:
         db.close()
 
-async def send_completed_notifications():
-    """Finds completed jobs that haven't received an email and sends notifications."""
+
+def renew_lease(job_id: int) -> bool:
+    """Extends this worker's lease on a job. Returns False if the lease was lost."""
     db = SessionLocal()
     try:
-        jobs_to_notify = db.query(Job).filter(
-            Job.status == JobStatus.COMPLETED,
-            Job.email_sent == False
-        ).all()
+        result = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.PROCESSING, Job.claimed_by == worker_id())
+            .values(lease_expires_at=_lease_deadline())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+
+def reclaim_expired_leases():
+    """Returns PROCESSING jobs whose owner stopped heartbeating to the PENDING queue."""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(Job)
+            .where(
+                Job.status == JobStatus.PROCESSING,
+                or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < _utcnow()),
+            )
+            .values(status=JobStatus.PENDING, claimed_by=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if result.rowcount:
+            print(f"♻️ Reclaimed {result.rowcount} job(s) with expired leases.")
+    finally:
+        db.close()
 
-        if not jobs_to_notify:
-            return
 
-        for job in jobs_to_notify:
-            print(f"Found completed job #{job.id}. Preparing to send email notification.")
-            results_url = f"{settings.BASE_URL}/api/results/{job.id}"
-            try:
-                await email_service.send_email_notification(
-                    recipient_email=job.email,
-                    query=job.query,
-                    results_url=results_url
-                )
-                # If successful, mark the email as sent to prevent re-sending
-                job.email_sent = True
-                db.commit()
-                print(f"✅ Email for job #{job.id} sent successfully.")
-            except Exception as e:
-                print(f"❌ FAILED to send email for job #{job.id}. Error: {e}")
+def release_claims():
+    """Hands this worker's in-progress jobs back to the queue (used on shutdown)."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job)
+            .where(Job.status == JobStatus.PROCESSING, Job.claimed_by == worker_id())
+            .values(status=JobStatus.PENDING, claimed_by=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
     finally:
         db.close()
 
+
+def _mark_failed(job_id: int):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.claimed_by == worker_id())
+            .values(status=JobStatus.FAILED)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _heartbeat(job_id: int, pipeline_task: asyncio.Task):
+    interval = settings.JOB_LEASE_SECONDS / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            renewed = await workers.run_io(renew_lease, job_id)
+        except Exception as e:
+            # E.g. "database is locked": the lease is still ours, so try again next interval.
+            print(f"[JOB {job_id}] ⚠️ Could not renew the lease: {e}. Retrying.")
+            continue
+        if not renewed:
+            print(f"[JOB {job_id}] ⚠️ Lease lost to another worker. Abandoning pipeline.")
+            pipeline_task.cancel()
+            return
+
+
+async def _run_claimed_job(job_id: int):
+    """Runs the pipeline for a claimed job while keeping its lease alive."""
+    pipeline_task = asyncio.current_task()
+    heartbeat = asyncio.create_task(_heartbeat(job_id, pipeline_task))
+    try:
+        with profiling.profile_job(job_id):
+            await run_image_pipeline(job_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Without this the job would be reclaimed and crash again, forever.
+        print(f"[JOB {job_id}] ❌ Pipeline crashed: {e}. Marking job as FAILED.")
+        await workers.run_io(_mark_failed, job_id)
+        progress.finish(job_id, JobStatus.FAILED)
+    finally:
+        heartbeat.cancel()
+
+
+def _on_job_done(task: asyncio.Task):
+    _running.pop(task, None)
+    # A slot just opened up; fill it without waiting for the next poll.
+    # The job may also have completed, so email its owner without waiting either.
+    if not task.get_loop().is_closed():
+        task.get_loop().create_task(dispatch_jobs())
+        notification_service.wake_up()
+
+
+async def dispatch_jobs():
+    """
+    Fills free job slots. PAID jobs are always claimed first, and
+    SCHEDULER_PAID_RESERVED_SLOTS slots are never given to FREE jobs, so
+    a FREE backlog can't hold up paying customers.
+    """
+    global _dispatch_lock
+    if _dispatch_lock is None:
+        _dispatch_lock = asyncio.Lock()
+
+    async with _dispatch_lock:
+        free_lane_limit = settings.SCHEDULER_SLOTS - settings.SCHEDULER_PAID_RESERVED_SLOTS
+        while len(_running) < settings.SCHEDULER_SLOTS:
+            lane = JobType.PAID
+            job_id = await workers.run_io(claim_next_job, JobType.PAID)
+            if job_id is None and sum(1 for l in _running.values() if l == JobType.FREE) < free_lane_limit:
+                lane = JobType.FREE
+                job_id = await workers.run_io(claim_next_job, JobType.FREE)
+            if job_id is None:
+                return
+
+            print(f"Claimed {lane.value} job #{job_id}. Starting pipeline ({len(_running) + 1}/{settings.SCHEDULER_SLOTS} slots)...")
+            task = asyncio.create_task(_run_claimed_job(job_id))
+            _running[task] = lane
+            task.add_done_callback(_on_job_done)
@@ -0,0 +1,162 @@
+"""
+Pipeline instrumentation.
+
+Each job gets a `JobMetrics`. It records timing spans per stage (seconds, items
+handled, calls), counters (images, bytes) and peak queue depths, and is saved as
+JSON on `Job.metrics` when the job ends. Stages overlap in the streaming
+pipeline and some run several batches at once, so a stage's seconds is the sum
+of its spans. It can add up to more than the job's wall time.
+
+Finished jobs also add their numbers to process-wide totals. `render_prometheus`
+exposes those totals at /metrics, in the Prometheus text format, together with
+the caches' and services' own stats(). Work done inside the CPU worker
+processes (e.g. the image loader's cache) is only visible in those processes,
+so those numbers only appear here in thread pool mode.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_stage_totals: dict[str, dict[str, float]] = defaultdict(lambda: {"seconds": 0.0, "items": 0, "calls": 0})
+_counter_totals: dict[str, int] = defaultdict(int)
+_jobs_finished: dict[str, int] = defaultdict(int)
+_job_seconds = {"sum": 0.0, "count": 0}
+_queue_peaks: dict[str, int] = defaultdict(int)
+_gauges: dict[str, float] = {}
+
+
+class JobMetrics:
+    """Spans and counters for one job. Safe to update from the event loop and worker threads."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: dict[str, dict[str, float]] = {}
+        self.counters: dict[str, int] = defaultdict(int)
+        self.queue_peaks: dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def span(self, stage: str, items: int = 0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started, items)
+
+    def record(self, stage: str, seconds: float, items: int = 0):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "items": 0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["items"] += items
+            entry["calls"] += 1
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe_queue(self, name: str, depth: int):
+        if depth > self.queue_peaks[name]:
+            self.queue_peaks[name] = depth
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "seconds": round(entry["seconds"], 4),
+                    "items": entry["items"],
+                    "calls": entry["calls"],
+                    "items_per_sec": round(entry["items"] / entry["seconds"], 2) if entry["seconds"] and entry["items"] else None,
+                }
+                for name, entry in self.stages.items()
+            }
+            return {
+                "total_seconds": round(time.perf_counter() - self._started, 4),
+                "stages": stages,
+                "counters": dict(self.counters),
+                "queue_peaks": dict(self.queue_peaks),
+            }
+
+    def finish(self, status: str) -> dict:
+        """Adds this job to the process-wide totals and returns what to store on the Job row."""
+        summary = self.to_dict()
+        with _lock:
+            for name, entry in self.stages.items():
+                totals = _stage_totals[name]
+                totals["seconds"] += entry["seconds"]
+                totals["items"] += entry["items"]
+                totals["calls"] += entry["calls"]
+            for name, value in self.counters.items():
+                _counter_totals[name] += value
+            for name, depth in self.queue_peaks.items():
+                _queue_peaks[name] = max(_queue_peaks[name], depth)
+            _jobs_finished[status] += 1
+            _job_seconds["sum"] += summary["total_seconds"]
+            _job_seconds["count"] += 1
+        return summary
+
+
+def set_gauge(name: str, value: float):
+    """Process-level values that aren't tied to a job, e.g. the CLIP model's load time."""
+    with _lock:
+        _gauges[name] = value
+
+
+# --- Prometheus exposition ---
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _emit(lines: list[str], name: str, kind: str, help_text: str, samples: list[tuple[dict, float]]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {float(value)}" if label_text else f"{name} {float(value)}")
+
+
+def _emit_stats(lines: list[str], prefix: str, help_text: str, stats: dict):
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            _emit(lines, f"{prefix}_{key}", "gauge", f"{help_text}: {key.replace('_', ' ')}.", [({}, value)])
+
+
+def render_prometheus(job_counts: dict[str, int], extra: dict[str, dict] | None = None) -> str:
+    """
+    The /metrics page. `job_counts` is jobs per status (from the database);
+    `extra` maps a metric prefix to a component's stats() dict.
+    """
+    with _lock:
+        stages = {name: dict(entry) for name, entry in _stage_totals.items()}
+        counters = dict(_counter_totals)
+        finished = dict(_jobs_finished)
+        job_seconds = dict(_job_seconds)
+        queue_peaks = dict(_queue_peaks)
+        gauges = dict(_gauges)
+
+    lines: list[str] = []
+    _emit(lines, "pixelforge_jobs", "gauge", "Jobs in the database, by status.",
+          [({"status": status}, count) for status, count in sorted(job_counts.items())])
+    _emit(lines, "pixelforge_jobs_finished_total", "counter", "Pipelines finished by this process, by outcome.",
+          [({"status": status}, count) for status, count in sorted(finished.items())])
+    _emit(lines, "pixelforge_job_duration_seconds", "summary", "Wall time of finished pipelines.", [])
+    lines.append(f"pixelforge_job_duration_seconds_sum {job_seconds['sum']}")
+    lines.append(f"pixelforge_job_duration_seconds_count {job_seconds['count']}")
+    _emit(lines, "pixelforge_stage_seconds_total", "counter", "Time spent per pipeline stage (summed over spans).",
+          [({"stage": name}, entry["seconds"]) for name, entry in sorted(stages.items())])
+    _emit(lines, "pixelforge_stage_items_total", "counter", "Items handled per pipeline stage.",
+          [({"stage": name}, entry["items"]) for name, entry in sorted(stages.items())])
+    _emit(lines, "pixelforge_stage_calls_total", "counter", "Spans (batches) per pipeline stage.",
+          [({"stage": name}, entry["calls"]) for name, entry in sorted(stages.items())])
+    _emit(lines, "pixelforge_pipeline_events_total", "counter", "Pipeline counters summed over finished jobs.",
+          [({"event": name}, value) for name, value in sorted(counters.items())])
+    _emit(lines, "pixelforge_queue_depth_peak", "gauge", "Highest depth seen on each pipeline queue.",
+          [({"queue": name}, depth) for name, depth in sorted(queue_peaks.items())])
+    for name, value in sorted(gauges.items()):
+        _emit(lines, f"pixelforge_{name}", "gauge", name.replace("_", " ").capitalize() + ".", [({}, value)])
+    for prefix, stats in (extra or {}).items():
+        _emit_stats(lines, f"pixelforge_{prefix}", prefix.replace("_", " ").capitalize(), stats)
+    return "\n".join(lines) + "\n"
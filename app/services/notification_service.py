@@ -0,0 +1,176 @@
+"""
+Notification dispatcher: emails the owners of completed jobs.
+
+Runs on its own schedule (NOTIFY_POLL_SECONDS) rather than inside the job
+scheduler's tick, so a slow SMTP server never delays job processing. Each
+batch of up to NOTIFY_BATCH_SIZE jobs is claimed in one transaction, sent
+concurrently over the pooled SMTP connections in email_service, and its
+outcomes are committed in one more transaction.
+
+A claim hides a job from other workers for NOTIFY_CLAIM_SECONDS, the same
+conditional-UPDATE pattern the job scheduler uses, so several app processes
+never email the same job twice. A failed send is retried with exponential
+backoff, up to NOTIFY_MAX_ATTEMPTS times. A permanent rejection (a 5xx reply,
+or every recipient refused with one) is given up on straight away.
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import aiosmtplib
+from sqlalchemy import update, or_
+
+from app.core.config import settings
+from app.models.job import SessionLocal, Job, JobStatus
+from app.services import email_service, workers
+
+_counters = {"sent": 0, "failed": 0, "gave_up": 0}
+_dispatch_lock: asyncio.Lock | None = None
+
+
+@dataclass
+class _Notification:
+    job_id: int
+    email: str
+    query: str
+    attempts: int
+    gave_up: bool = False  # Permanently rejected: no more attempts
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _backoff_seconds(attempts: int) -> float:
+    return min(settings.NOTIFY_BACKOFF_MAX, settings.NOTIFY_BACKOFF_BASE * 2 ** (attempts - 1))
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Whether the SMTP server rejected the message for good (5xx), so a retry can't help."""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(refused.code >= 500 for refused in error.recipients)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500
+
+
+def _is_due(now: datetime):
+    return or_(Job.email_next_attempt_at.is_(None), Job.email_next_attempt_at <= now)
+
+
+def claim_batch(limit: int) -> list[_Notification]:
+    """Claims up to `limit` completed jobs that are due a notification, in one transaction."""
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        candidates = (
+            db.query(Job.id, Job.email, Job.query, Job.email_attempts)
+            .filter(
+                Job.status == JobStatus.COMPLETED,
+                Job.email_sent == False,
+                Job.email_attempts < settings.NOTIFY_MAX_ATTEMPTS,
+                _is_due(now),
+            )
+            .order_by(Job.id)
+            .limit(limit)
+            .all()
+        )
+        claimed = []
+        for job_id, email, query, attempts in candidates:
+            result = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.email_sent == False, _is_due(now))
+                .values(email_next_attempt_at=now + timedelta(seconds=settings.NOTIFY_CLAIM_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(_Notification(job_id, email, query, attempts))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def record_results(sent: list[int], failed: list[_Notification]):
+    """Commits a batch's outcomes: sent jobs are done, failed ones are rescheduled with backoff or given up on."""
+    now = _utcnow()
+    db = SessionLocal()
+    try:
+        if sent:
+            db.execute(
+                update(Job)
+                .where(Job.id.in_(sent))
+                .values(email_sent=True, email_next_attempt_at=None)
+                .execution_options(synchronize_session=False)
+            )
+        for notification in failed:
+            if notification.gave_up:
+                values = {"email_attempts": settings.NOTIFY_MAX_ATTEMPTS, "email_next_attempt_at": None}
+            else:
+                attempts = notification.attempts + 1
+                values = {"email_attempts": attempts, "email_next_attempt_at": now + timedelta(seconds=_backoff_seconds(attempts))}
+            db.execute(
+                update(Job)
+                .where(Job.id == notification.job_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _send(notification: _Notification) -> bool:
+    results_url = f"{settings.BASE_URL}/api/results/{notification.job_id}"
+    try:
+        await email_service.send_email_notification(notification.email, notification.query, results_url)
+    except Exception as e:
+        attempts = notification.attempts + 1
+        if _is_permanent(e):
+            notification.gave_up = True
+            _counters["gave_up"] += 1
+            print(f"❌ FAILED to send email for job #{notification.job_id} ({e}). Permanently rejected; giving up.")
+        elif attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+            _counters["gave_up"] += 1
+            print(f"❌ FAILED to send email for job #{notification.job_id} ({e}). Giving up after {attempts} attempts.")
+        else:
+            print(
+                f"❌ FAILED to send email for job #{notification.job_id} ({e}). "
+                f"Retrying in {_backoff_seconds(attempts):.0f}s (attempt {attempts}/{settings.NOTIFY_MAX_ATTEMPTS})."
+            )
+        _counters["failed"] += 1
+        return False
+    _counters["sent"] += 1
+    print(f"✅ Email for job #{notification.job_id} sent successfully.")
+    return True
+
+
+async def dispatch_notifications():
+    """Scheduler entry point: sends every due notification, one batch at a time."""
+    global _dispatch_lock
+    if _dispatch_lock is None:
+        _dispatch_lock = asyncio.Lock()
+
+    async with _dispatch_lock:
+        while True:
+            batch = await workers.run_io(claim_batch, settings.NOTIFY_BATCH_SIZE)
+            if not batch:
+                return
+            print(f"📬 Sending {len(batch)} job notification(s)...")
+            outcomes = await asyncio.gather(*(_send(notification) for notification in batch))
+            sent = [n.job_id for n, ok in zip(batch, outcomes) if ok]
+            failed = [n for n, ok in zip(batch, outcomes) if not ok]
+            await workers.run_io(record_results, sent, failed)
+            if len(batch) < settings.NOTIFY_BATCH_SIZE:
+                return
+
+
+def wake_up():
+    """Sends notifications now instead of at the next poll (call from the event loop)."""
+    asyncio.get_running_loop().create_task(dispatch_notifications())
+
+
+async def shutdown():
+    await email_service.close_pool()
+
+
+def stats() -> dict:
+    return dict(_counters)
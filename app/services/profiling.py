@@ -0,0 +1,85 @@
+"""
+Opt-in profiling of individual jobs.
+
+While a job listed in PROFILE_JOB_IDS runs, two profiles are collected and
+written to PROFILES_DIR when it ends:
+
+- job_{id}.prof: cProfile stats for the event loop thread (load them with
+  pstats or snakeviz).
+- job_{id}.folded: stacks of every thread in this process, sampled every
+  PROFILE_SAMPLE_INTERVAL seconds, in the collapsed format that py-spy's
+  `--format raw` writes. Feed it to flamegraph.pl or speedscope.
+
+The event loop runs every job, so other jobs running at the same time show up
+too. CPU work in the worker processes only shows up as time spent waiting on
+the pool. For that, run py-spy against a worker pid, or use thread pool mode.
+Only one job is profiled at a time.
+"""
+import cProfile
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from app.core.config import settings
+from app.core.paths import PROFILES_DIR
+
+_active = threading.Lock()
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name="job-profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextmanager
+def profile_job(job_id: int):
+    """Profiles the enclosed block if `job_id` is in PROFILE_JOB_IDS (and no other job is being profiled)."""
+    if job_id not in settings.PROFILE_JOB_IDS or not _active.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    sampler = _StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+    started = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        try:
+            PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(PROFILES_DIR / f"job_{job_id}.prof")
+            with open(PROFILES_DIR / f"job_{job_id}.folded", "w") as f:
+                for stack, count in sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"[JOB {job_id}] 🔬 Profiled {time.perf_counter() - started:.1f}s "
+                  f"({sum(sampler.stacks.values())} stack samples) to {PROFILES_DIR}.")
+        except OSError as e:
+            print(f"[JOB {job_id}] ⚠️ Could not write profile: {e}")
+        finally:
+            _active.release()
@@ -0,0 +1,187 @@
+"""
+Live job progress, pushed to watchers instead of polled.
+
+Pipelines running in this process publish as they go: the current stage and
+running counts (`progress`), candidate images as CLIP accepts them (`images`),
+and the outcome (`done`). Each watcher has its own bounded queue; one that
+falls behind loses its oldest events, never the latest. Someone who starts
+watching mid-job is first sent the latest counts and the images so far.
+
+A job can run in another process (another gunicorn worker claimed it). Nothing
+is published here for such a job, so one poller per job reads its status every
+PROGRESS_POLL_SECONDS and publishes changes. That is one query per interval
+however many clients watch the job. The poller does nothing while the job
+runs locally.
+
+Everything here runs on the event loop, so there's no locking.
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+from app.models.job import SessionLocal, Job, JobStatus
+from app.services import workers
+
+_TERMINAL = (JobStatus.COMPLETED, JobStatus.FAILED)
+_stats = {"published": 0, "dropped": 0, "status_polls": 0}
+
+
+class _Channel:
+    def __init__(self):
+        self.watchers: set[asyncio.Queue] = set()
+        self.state: dict = {}  # Latest progress, replayed to new watchers
+        self.images: list[dict] = []  # Candidates so far, replayed to new watchers
+        self.done: dict | None = None
+        self.local = False  # The pipeline runs in this process and publishes itself
+        self.poller: asyncio.Task | None = None
+
+
+_channels: dict[int, _Channel] = {}
+
+
+def _publish(channel: _Channel, event: str, data: dict):
+    for queue in channel.watchers:
+        if queue.full():
+            queue.get_nowait()
+            _stats["dropped"] += 1
+        queue.put_nowait((event, data))
+    _stats["published"] += 1
+
+
+def _drop_if_idle(job_id: int, channel: _Channel):
+    if not channel.watchers and not channel.local and _channels.get(job_id) is channel:
+        del _channels[job_id]
+        if channel.poller is not None:
+            channel.poller.cancel()
+
+
+def _ensure_poller(job_id: int, channel: _Channel, status: JobStatus):
+    """Starts following the job through the database if someone is waiting for it and nothing else is."""
+    if channel.watchers and channel.done is None and (channel.poller is None or channel.poller.done()):
+        channel.poller = asyncio.get_running_loop().create_task(_poll(job_id, channel, status))
+
+
+# --- Publishing (the pipeline) ---
+
+def start(job_id: int, target: int):
+    """The job's pipeline has started in this process."""
+    channel = _channels.setdefault(job_id, _Channel())
+    channel.local = True
+    channel.done = None
+    channel.images = []
+    channel.state = {"status": JobStatus.PROCESSING.value, "stage": "starting", "target": target}
+    _publish(channel, "progress", dict(channel.state))
+
+
+def update(job_id: int, stage: str, **counts: int):
+    """Publishes the current stage and running counts."""
+    channel = _channels.get(job_id)
+    if channel is None:
+        return
+    channel.state.update(counts, stage=stage)
+    _publish(channel, "progress", dict(channel.state))
+
+
+def add_images(job_id: int, images: list[dict]):
+    """Publishes candidate images (`id`, `url`, `clip_score`) as they're accepted."""
+    channel = _channels.get(job_id)
+    if channel is None or not images:
+        return
+    channel.images.extend(images)
+    _publish(channel, "images", {"images": images})
+
+
+def finish(job_id: int, status: JobStatus, **details):
+    """Publishes the job's outcome and closes its channel once nobody is watching."""
+    channel = _channels.get(job_id)
+    if channel is None:
+        return
+    channel.done = {"status": status.value, "results_url": f"/api/results/{job_id}", **details}
+    channel.state["status"] = status.value
+    _publish(channel, "done", channel.done)
+    channel.local = False
+    _drop_if_idle(job_id, channel)
+
+
+def release(job_id: int):
+    """The pipeline stopped without an outcome (crashed or was cancelled): follow the job through the database again."""
+    channel = _channels.get(job_id)
+    if channel is None:
+        return
+    channel.local = False
+    _drop_if_idle(job_id, channel)
+    # Another worker may pick the job up; its watchers need a poller to see that.
+    _ensure_poller(job_id, channel, JobStatus.PROCESSING)
+
+
+# --- Watching (the SSE endpoint) ---
+
+def job_status(job_id: int) -> JobStatus | None:
+    db = SessionLocal()
+    try:
+        return db.query(Job.status).filter(Job.id == job_id).scalar()
+    finally:
+        db.close()
+
+
+async def _poll(job_id: int, channel: _Channel, status: JobStatus):
+    """Follows a job through the database while it isn't running here, on behalf of all its watchers."""
+    while channel.watchers and channel.done is None:
+        await asyncio.sleep(settings.PROGRESS_POLL_SECONDS)
+        if channel.local or channel.done is not None:
+            continue
+        current = await workers.run_io(job_status, job_id)
+        _stats["status_polls"] += 1
+        if current is None:
+            # Deleted (e.g. by retention) while someone was watching.
+            channel.done = {"status": "missing", "results_url": None}
+            _publish(channel, "done", channel.done)
+        elif current in _TERMINAL:
+            channel.done = {"status": current.value, "results_url": f"/api/results/{job_id}"}
+            channel.state["status"] = current.value
+            _publish(channel, "done", channel.done)
+        elif current != status:
+            channel.state.update(status=current.value, stage=None)
+            _publish(channel, "progress", dict(channel.state))
+        status = current
+
+
+@asynccontextmanager
+async def watch(job_id: int, status: JobStatus):
+    """
+    Subscribes to a job and yields a queue of (event, data) pairs, starting with
+    what has happened so far. `status` is the job's status as just read from the database.
+    """
+    channel = _channels.setdefault(job_id, _Channel())
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.PROGRESS_QUEUE_SIZE, 3))
+    if not channel.local and channel.done is None:
+        if status in _TERMINAL:
+            channel.done = {"status": status.value, "results_url": f"/api/results/{job_id}"}
+        channel.state.setdefault("status", status.value)
+    if channel.state:
+        queue.put_nowait(("progress", dict(channel.state)))
+    if channel.images:
+        queue.put_nowait(("images", {"images": list(channel.images)}))
+    if channel.done is not None:
+        queue.put_nowait(("done", channel.done))
+    channel.watchers.add(queue)
+    _ensure_poller(job_id, channel, status)
+    try:
+        yield queue
+    finally:
+        channel.watchers.discard(queue)
+        _drop_if_idle(job_id, channel)
+
+
+def format_event(event: str, data: dict) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "channels": len(_channels),
+        "watchers": sum(len(channel.watchers) for channel in _channels.values()),
+    }
@@ -0,0 +1,231 @@
+"""
+Query-level result cache.
+
+When a job completes, its accepted images (Pexels id, CLIP score, file) are
+recorded under the normalized query and rendition. A later job for the same
+query is filled from that ranked set first, and the pipeline only fetches the
+shortfall.
+
+Files are shared through hard links, so the filesystem's link count is the
+reference count. The cache keeps its own link for each image under
+CACHE_DIR/results, so cached files outlive the job that downloaded them, and a
+job served from the cache gets its own links in its download folder. Evicting
+an entry removes only the cache's link, and only once no other cached query
+still refers to the same file. A job's images are never touched.
+
+Entries expire after RESULT_CACHE_TTL_HOURS. The total size of cached files is
+kept under RESULT_CACHE_MAX_MB by evicting the least recently used entries.
+"""
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.paths import CACHE_DIR
+from app.image_processing.fetch import PexelsPhoto
+from app.models.job import SessionLocal, QueryCacheEntry, QueryCacheImage
+from app.services import storage_service
+
+RESULTS_DIR = CACHE_DIR / "results"
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "images_served": 0, "evicted_entries": 0, "evicted_bytes": 0}
+
+
+@dataclass(frozen=True)
+class CachedImage:
+    photo: PexelsPhoto
+    file_path: str
+    score: float
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def normalize_query(query: str) -> str:
+    """"Red  Cars!" and "red cars" share results: case, punctuation and spacing are ignored."""
+    return " ".join(re.findall(r"\w+", query.casefold()))
+
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def lookup(query: str, rendition: str, limit: int) -> list[CachedImage]:
+    """Returns up to `limit` cached images for the query, best score first."""
+    if not settings.RESULT_CACHE_ENABLED:
+        return []
+    cutoff = _utcnow() - timedelta(hours=settings.RESULT_CACHE_TTL_HOURS)
+    db = SessionLocal()
+    try:
+        entry = (
+            db.query(QueryCacheEntry)
+            .filter(QueryCacheEntry.query_key == normalize_query(query),
+                    QueryCacheEntry.rendition == rendition,
+                    QueryCacheEntry.created_at >= cutoff)
+            .first()
+        )
+        images = []
+        if entry is not None:
+            # The threshold may have been raised since these were scored.
+            images = [
+                image for image in entry.images
+                if image.score >= settings.CLIP_FILTER_THRESHOLD and os.path.exists(image.file_path)
+            ][:limit]
+        if not images:
+            _count("misses")
+            return []
+        entry.hits += 1
+        entry.last_used_at = _utcnow()
+        db.commit()
+        _count("hits")
+        _count("images_served", len(images))
+        return [
+            CachedImage(PexelsPhoto(i.photo_id, i.url, i.width, i.height), i.file_path, i.score) for i in images
+        ]
+    finally:
+        db.close()
+
+
+def materialize(images: list[CachedImage], dest_dir: Path) -> list[tuple[CachedImage, str]]:
+    """Links cached images into a job's folder. Returns (image, path in the job folder) pairs."""
+    placed = []
+    for image in images:
+        dest = dest_dir / f"cached_{image.photo.id}{Path(image.file_path).suffix}"
+        try:
+            storage_service.link(image.file_path, dest)
+        except OSError as e:
+            print(f"⚠️ WARNING: Could not reuse cached image {image.photo.id}. Error: {e}. Skipping.")
+            continue
+        placed.append((image, str(dest)))
+    return placed
+
+
+def store(query: str, rendition: str, results: list[tuple[PexelsPhoto, str, float]]):
+    """Adds a job's scored, accepted images to the cache entry for its query."""
+    if not settings.RESULT_CACHE_ENABLED or not results:
+        return
+    db = SessionLocal()
+    try:
+        key = normalize_query(query)
+        entry = (
+            db.query(QueryCacheEntry)
+            .filter(QueryCacheEntry.query_key == key, QueryCacheEntry.rendition == rendition)
+            .first()
+        )
+        now = _utcnow()
+        dropped = set()  # Files whose rows go; the cache's links are removed unless still used
+        if entry is None:
+            entry = QueryCacheEntry(query_key=key, rendition=rendition, hits=0, created_at=now)
+            db.add(entry)
+        elif entry.created_at < now - timedelta(hours=settings.RESULT_CACHE_TTL_HOURS):
+            # Expired: start over with fresh results. Otherwise created_at stays put,
+            # or a popular query, served from the cache and stored again, would never expire.
+            dropped = {image.file_path for image in entry.images}
+            entry.images.clear()
+            entry.created_at = now
+        entry.last_used_at = now
+
+        cached_ids = {image.photo_id for image in entry.images}
+        for photo, path, score in results:
+            if photo.id in cached_ids or not os.path.exists(path):
+                continue
+            dest = RESULTS_DIR / rendition / f"{photo.id}{Path(path).suffix}"
+            if not dest.exists():
+                storage_service.link(path, dest)
+            entry.images.append(QueryCacheImage(
+                photo_id=photo.id, url=photo.url, width=photo.width, height=photo.height,
+                score=float(score), file_path=str(dest), size_bytes=dest.stat().st_size,
+            ))
+            cached_ids.add(photo.id)
+
+        # Keep only the best RESULT_CACHE_MAX_IMAGES for the query.
+        ranked = sorted(entry.images, key=lambda image: image.score, reverse=True)
+        for image in ranked[settings.RESULT_CACHE_MAX_IMAGES:]:
+            entry.images.remove(image)
+            dropped.add(image.file_path)
+        db.commit()
+        _unlink_unreferenced(db, dropped)
+    finally:
+        db.close()
+    evict()
+
+
+def _unlink_unreferenced(db, paths: set[str]) -> int:
+    """Removes the cache's links for files no cached query refers to any more. Returns bytes freed."""
+    if not paths:
+        return 0
+    still_used = {
+        path for (path,) in
+        db.query(QueryCacheImage.file_path).filter(QueryCacheImage.file_path.in_(list(paths))).distinct()
+    }
+    freed = 0
+    for path in paths - still_used:
+        try:
+            freed += os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def evict() -> int:
+    """Drops expired entries, then least recently used ones until under RESULT_CACHE_MAX_MB. Returns bytes freed."""
+    db = SessionLocal()
+    try:
+        cutoff = _utcnow() - timedelta(hours=settings.RESULT_CACHE_TTL_HOURS)
+        victims = db.query(QueryCacheEntry).filter(QueryCacheEntry.created_at < cutoff).all()
+
+        budget = settings.RESULT_CACHE_MAX_MB * 1024 * 1024
+        # Shared files are counted once, since they only take disk space once:
+        # the total is the size of the distinct files that surviving entries refer to.
+        victim_ids = {entry.id for entry in victims}
+        entry_files: dict[int, set[str]] = {}
+        sizes: dict[str, int] = {}
+        for entry_id, path, size in db.query(QueryCacheImage.entry_id, QueryCacheImage.file_path, QueryCacheImage.size_bytes):
+            entry_files.setdefault(entry_id, set()).add(path)
+            sizes[path] = size
+        refs: dict[str, int] = {}
+        for entry_id, paths in entry_files.items():
+            if entry_id not in victim_ids:
+                for path in paths:
+                    refs[path] = refs.get(path, 0) + 1
+        total = sum(sizes[path] for path in refs)
+        if total > budget:
+            for entry in db.query(QueryCacheEntry).order_by(QueryCacheEntry.last_used_at):
+                if total <= budget:
+                    break
+                if entry.id in victim_ids:
+                    continue
+                victims.append(entry)
+                for path in entry_files.get(entry.id, ()):
+                    refs[path] -= 1
+                    if not refs[path]:
+                        total -= sizes[path]
+        if not victims:
+            return 0
+
+        paths = {image.file_path for entry in victims for image in entry.images}
+        for entry in victims:
+            db.delete(entry)
+        db.commit()
+        freed = _unlink_unreferenced(db, paths)
+        _count("evicted_entries", len(victims))
+        _count("evicted_bytes", freed)
+        print(f"🧹 Result cache: evicted {len(victims)} queries, freed {freed / (1024 * 1024):.1f} MB.")
+        return freed
+    finally:
+        db.close()
+
+
+def stats() -> dict:
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["misses"]
+    counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+    return counters
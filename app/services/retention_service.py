@@ -0,0 +1,181 @@
+"""
+Retention: keeps the data disk from growing without bound.
+
+- When a job finishes, `prune_job_files` removes everything in its folder that
+  didn't make the final selection: images rejected by dedup, CLIP or ranking;
+  and, for failed jobs, everything.
+- `run_retention` runs periodically on the scheduler. It expires finished jobs
+  once they're older than their JobType's retention period, deleting their
+  folder and DB rows. It then removes folders with no job row left, and lets
+  the blob store, result cache, archive cache and embedding cache enforce
+  their budgets.
+
+Work is done in small batches (RETENTION_BATCH_SIZE jobs per run, one short
+transaction per job), so a run never holds a long SQLite write lock or causes
+an I/O spike; anything left over is picked up by the next run.
+"""
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.paths import DOWNLOADS_DIR
+from app.image_processing import embedding_cache, filter
+from app.models.job import SessionLocal, Job, JobType, JobStatus
+from app.services import archive_service, result_cache, storage_service, workers
+
+_totals = {"runs": 0, "jobs_expired": 0, "orphan_dirs_removed": 0, "bytes_reclaimed": 0}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _retention_days(job: Job) -> float:
+    if job.status == JobStatus.FAILED:
+        return settings.RETENTION_FAILED_DAYS
+    if job.job_type == JobType.PAID:
+        return settings.RETENTION_PAID_DAYS
+    return settings.RETENTION_FREE_DAYS
+
+
+def _unlink(path: Path) -> int:
+    """Removes one directory entry; returns the bytes that actually freed (0 while other links remain)."""
+    try:
+        stat = path.stat()
+        path.unlink()
+    except FileNotFoundError:
+        return 0
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+def _remove_tree(directory: Path) -> int:
+    freed = 0
+    if not directory.exists():
+        return 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            freed += _unlink(Path(root) / name)
+    shutil.rmtree(directory, ignore_errors=True)
+    return freed
+
+
+def prune_job_files(job_id: int, keep: list[str]) -> int:
+    """
+    Deletes the files in a job's folder that aren't in `keep`, apart from its
+    renditions and download archive. Returns the bytes freed; files that are
+    still linked from blob storage or another job only lose this job's link.
+    """
+    directory = storage_service.job_dir(job_id)
+    if not directory.exists():
+        return 0
+    keep_names = {Path(path).name for path in keep}
+    archive_name = archive_service.archive_path(job_id).name
+    freed = 0
+    removed = 0
+    for entry in directory.iterdir():
+        if entry.is_dir() or entry.name in keep_names or entry.name == archive_name:
+            continue
+        freed += _unlink(entry)
+        removed += 1
+    if not keep:
+        freed += _remove_tree(directory)
+    if removed:
+        print(f"[JOB {job_id}] 🧹 Removed {removed} rejected files ({freed / (1024 * 1024):.1f} MB freed).")
+    return freed
+
+
+def _expire_jobs(limit: int) -> tuple[int, int]:
+    """Deletes up to `limit` expired jobs, oldest first. Returns (jobs deleted, bytes freed)."""
+    now = _utcnow()
+    oldest_cutoff = now - timedelta(days=min(
+        settings.RETENTION_FREE_DAYS, settings.RETENTION_PAID_DAYS, settings.RETENTION_FAILED_DAYS
+    ))
+    db = SessionLocal()
+    expired = 0
+    freed = 0
+    try:
+        candidates = (
+            db.query(Job)
+            .filter(Job.status.in_([JobStatus.COMPLETED, JobStatus.FAILED]), Job.updated_at < oldest_cutoff)
+            .order_by(Job.updated_at)
+            .limit(limit * 4)  # Some may be within a longer retention period
+            .all()
+        )
+        for job in candidates:
+            if expired >= limit:
+                break
+            if job.updated_at >= now - timedelta(days=_retention_days(job)):
+                continue
+            # Files first: if we crash in between, the orphan sweep removes the folder later.
+            freed += _remove_tree(storage_service.job_dir(job.id))
+            db.delete(job)  # Cascades to its images and their renditions
+            db.commit()
+            expired += 1
+    finally:
+        db.close()
+    return expired, freed
+
+
+def _remove_orphan_dirs(limit: int) -> tuple[int, int]:
+    """Deletes job folders whose job row no longer exists (e.g. after a crash mid-expiry)."""
+    if not DOWNLOADS_DIR.exists():
+        return 0, 0
+    folders = {}
+    for entry in DOWNLOADS_DIR.iterdir():
+        prefix, _, job_id = entry.name.partition("_")
+        if entry.is_dir() and prefix == "job" and job_id.isdigit():
+            folders[int(job_id)] = entry
+    if not folders:
+        return 0, 0
+    # Checked 900 ids per query (under SQLite's bound-parameter limit), until the whole folder is swept.
+    job_ids = sorted(folders)
+    orphans = []
+    db = SessionLocal()
+    try:
+        for start in range(0, len(job_ids), 900):
+            chunk = job_ids[start:start + 900]
+            existing = {job_id for (job_id,) in db.query(Job.id).filter(Job.id.in_(chunk))}
+            orphans.extend(folders[job_id] for job_id in chunk if job_id not in existing)
+            if len(orphans) >= limit:
+                break
+    finally:
+        db.close()
+    orphans = orphans[:limit]
+    freed = sum(_remove_tree(folder) for folder in orphans)
+    return len(orphans), freed
+
+
+def _run_retention_sync() -> dict:
+    expired, freed_jobs = _expire_jobs(settings.RETENTION_BATCH_SIZE)
+    orphans, freed_orphans = _remove_orphan_dirs(settings.RETENTION_BATCH_SIZE)
+    freed_cache = result_cache.evict()
+    freed_archives = archive_service.enforce_budget()
+    freed_embeddings = embedding_cache.evict(filter.EMBEDDING_CACHE_ROOT, settings.CLIP_CACHE_MAX_MB * 1024 * 1024)
+    # Last, so blobs released by the steps above can go in this same run.
+    freed_blobs = storage_service.collect_garbage()
+    return {
+        "jobs_expired": expired,
+        "orphan_dirs_removed": orphans,
+        "bytes_reclaimed": freed_jobs + freed_orphans + freed_cache + freed_archives + freed_embeddings + freed_blobs,
+    }
+
+
+async def run_retention() -> dict:
+    """Scheduler entry point: one incremental retention pass, off the event loop."""
+    report = await workers.run_io(_run_retention_sync)
+    _totals["runs"] += 1
+    for key in ("jobs_expired", "orphan_dirs_removed", "bytes_reclaimed"):
+        _totals[key] += report[key]
+    if report["jobs_expired"] or report["orphan_dirs_removed"] or report["bytes_reclaimed"]:
+        print(
+            f"🧹 Retention: expired {report['jobs_expired']} jobs, removed {report['orphan_dirs_removed']} "
+            f"orphaned folders, reclaimed {report['bytes_reclaimed'] / (1024 * 1024):.1f} MB "
+            f"({_totals['bytes_reclaimed'] / (1024 * 1024):.1f} MB since startup)."
+        )
+    return report
+
+
+def stats() -> dict:
+    return dict(_totals)
@@ -0,0 +1,135 @@
+"""
+Blob storage for downloaded photos.
+
+Every photo file is stored once under BLOBS_DIR, keyed by its Pexels id and
+the rendition URL it came from. A job's folder (DOWNLOADS_DIR/job_{id}) only
+holds hard links to those blobs. A photo that shows up in many jobs therefore
+takes disk space once and is downloaded once.
+
+Because job folders and the result cache hold hard links, a blob's link count
+says whether anything still uses it: a link count of 1 means only the store
+itself does. `collect_garbage` deletes such unreferenced blobs, least recently
+used first, once the store grows past STORAGE_MAX_MB. Blobs that a job still
+links to are never deleted.
+"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.paths import BLOBS_DIR, DOWNLOADS_DIR
+
+_STALE_TEMP_SECONDS = 3600
+
+
+def job_dir(job_id: int) -> Path:
+    """A job's folder of hard links, served under /downloads."""
+    return DOWNLOADS_DIR / f"job_{job_id}"
+
+
+def blob_path(photo_id: int, url: str, ext: str) -> Path:
+    """Where the file for one photo rendition lives. Different renditions of a photo are different blobs."""
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    return BLOBS_DIR / f"{photo_id % 256:02x}" / f"{photo_id}-{url_hash}{ext}"
+
+
+def find_blob(path: Path) -> Path | None:
+    """Returns the blob if it's stored, marking it as recently used."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def temp_path(dest: Path) -> Path:
+    """A temp name next to `dest`, on the same filesystem, so os.replace() onto `dest` is atomic."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    return dest.parent / f".{uuid.uuid4().hex}.part"
+
+
+def link(source: Path | str, dest: Path) -> Path:
+    """
+    Makes `dest` a hard link to `source` (a copy if they're on different
+    filesystems). Readers never see a partial file: the link is made under a
+    temp name and renamed into place.
+    """
+    temp = temp_path(dest)
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copy2(source, temp)
+    try:
+        os.replace(temp, dest)
+    except OSError:
+        temp.unlink(missing_ok=True)
+        raise
+    return dest
+
+
+def usage() -> dict:
+    """Blob count and bytes, split by whether anything still links to them."""
+    stats = {"blobs": 0, "bytes": 0, "unreferenced_blobs": 0, "unreferenced_bytes": 0}
+    for path, stat in _iter_blobs():
+        stats["blobs"] += 1
+        stats["bytes"] += stat.st_size
+        if stat.st_nlink <= 1:
+            stats["unreferenced_blobs"] += 1
+            stats["unreferenced_bytes"] += stat.st_size
+    return stats
+
+
+def _iter_blobs():
+    if not BLOBS_DIR.exists():
+        return
+    for shard in BLOBS_DIR.iterdir():
+        if not shard.is_dir():
+            continue
+        for path in shard.iterdir():
+            try:
+                yield path, path.stat()
+            except FileNotFoundError:
+                continue
+
+
+def collect_garbage(max_bytes: int | None = None) -> int:
+    """
+    Deletes unreferenced blobs, least recently used first, until the store fits
+    in `max_bytes` (default STORAGE_MAX_MB). Also clears temp files left behind
+    by interrupted writes. Returns the bytes freed.
+    """
+    max_bytes = settings.STORAGE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    total = 0
+    freed = 0
+    unreferenced = []
+    now = time.time()
+    for path, stat in _iter_blobs():
+        if path.name.endswith(".part"):
+            if now - stat.st_mtime > _STALE_TEMP_SECONDS:
+                path.unlink(missing_ok=True)
+                freed += stat.st_size
+            continue
+        total += stat.st_size
+        if stat.st_nlink <= 1:
+            unreferenced.append((stat.st_mtime, stat.st_size, path))
+
+    deleted = 0
+    for _, size, path in sorted(unreferenced):
+        if total <= max_bytes:
+            break
+        try:
+            # Re-check: a job may have linked it since the scan.
+            if path.stat().st_nlink > 1:
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        total -= size
+        freed += size
+        deleted += 1
+    if deleted:
+        print(f"🧹 Blob storage: deleted {deleted} unreferenced blobs, freed {freed / (1024 * 1024):.1f} MB.")
+    return freed
@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import numpy as np
+
+from app.core.config import settings
+from app.services import metrics
+
+# Pipeline work runs here instead of on the event loop that also serves FastAPI requests.
+# CPU-bound stages (phash, CLIP, quality, renditions) go to the CPU lanes; long
+# blocking I/O (the download producer) goes to `_io_pool`.
+#
+# In process mode each lane is a pool of exactly one worker process, so work can
+# be sent to a particular worker: run_cpu_pinned() always sends the same image to
+# the same worker, and that worker's image_loader cache decodes it once for every
+# stage. In thread mode there is a single lane, whose threads share one cache.
+_cpu_lanes: list[Executor] | None = None
+_lane_load: list[int] = []  # Tasks in flight per lane
+_io_pool: Executor | None = None
+_warmup_task: asyncio.Task | None = None
+
+
+def _init_cpu_worker():
+    """Runs once in each worker process so the first batch doesn't pay for model loading."""
+    if settings.WORKER_PRELOAD_CLIP:
+        from app.image_processing import filter
+        filter._load_model()
+
+
+def _new_lane() -> Executor:
+    context = multiprocessing.get_context(settings.WORKER_START_METHOD)
+    return ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_cpu_worker)
+
+
+def get_cpu_lanes() -> list[Executor]:
+    global _cpu_lanes, _lane_load
+    if _cpu_lanes is None:
+        if settings.WORKER_POOL_MODE == "thread":
+            _cpu_lanes = [ThreadPoolExecutor(max_workers=settings.WORKER_PROCESSES, thread_name_prefix="pipeline-cpu")]
+        else:
+            _cpu_lanes = [_new_lane() for _ in range(settings.WORKER_PROCESSES)]
+        _lane_load = [0] * len(_cpu_lanes)
+        print(f"INFO:     Started {settings.WORKER_POOL_MODE} pool with {settings.WORKER_PROCESSES} worker(s).")
+    return _cpu_lanes
+
+
+def get_io_pool() -> Executor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=settings.WORKER_IO_THREADS, thread_name_prefix="pipeline-io")
+    return _io_pool
+
+
+async def _run_on_lane(lane: int, fn, *args, **kwargs):
+    lanes = get_cpu_lanes()
+    executor = lanes[lane]
+    loop = asyncio.get_running_loop()
+    _lane_load[lane] += 1
+    try:
+        return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        # The worker died (e.g. OOM-killed mid-inference). Replace it so the next
+        # call gets a fresh one, and let this call fail.
+        print(f"❌ Pipeline worker {lane} is broken. Restarting it.")
+        if _cpu_lanes is lanes and lanes[lane] is executor:
+            lanes[lane] = _new_lane()
+        raise
+    finally:
+        if _cpu_lanes is lanes:
+            _lane_load[lane] -= 1
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Runs a picklable, module-level function on the least busy CPU worker without blocking the event loop."""
+    get_cpu_lanes()
+    lane = min(range(len(_lane_load)), key=_lane_load.__getitem__)
+    return await _run_on_lane(lane, fn, *args, **kwargs)
+
+
+def lane_for(path: str) -> int:
+    """The CPU worker that handles an image, stable across stages and calls."""
+    return zlib.crc32(os.path.abspath(path).encode("utf-8")) % len(get_cpu_lanes())
+
+
+async def run_cpu_pinned(fn, paths: list[str], *args):
+    """
+    Runs `fn(paths, *args)`, which returns one result per path (a list or array),
+    with each path on its own pinned worker, so every stage finds the image already
+    decoded there. Returns the results in the order of `paths`; None if any worker's
+    `fn` returned None (CLIP unavailable).
+    """
+    lanes = get_cpu_lanes()
+    if len(lanes) == 1 or not paths:
+        return await _run_on_lane(0, fn, paths, *args)
+    groups: dict[int, list[int]] = {}
+    for i, path in enumerate(paths):
+        groups.setdefault(lane_for(path), []).append(i)
+    parts = await asyncio.gather(*(
+        _run_on_lane(lane, fn, [paths[i] for i in indices], *args) for lane, indices in groups.items()
+    ))
+    if any(part is None for part in parts):
+        return None
+    results = [None] * len(paths)
+    for indices, part in zip(groups.values(), parts):
+        for i, result in zip(indices, part):
+            results[i] = result
+    return np.stack(results) if isinstance(parts[0], np.ndarray) else results
+
+
+async def run_io(fn, *args, **kwargs):
+    """Runs a blocking I/O-bound function in the I/O thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), partial(fn, *args, **kwargs))
+
+
+def _warm_worker() -> float | None:
+    """Runs in a CPU worker: makes sure CLIP is loaded there and says how long that took."""
+    from app.image_processing import filter
+    filter._load_model()
+    return filter.model_load_seconds
+
+
+async def warm_up():
+    """Starts the CPU workers and loads CLIP in each, so the first job doesn't wait for imports and model loading."""
+    started = time.perf_counter()
+    try:
+        # Threads share one model, so the single thread lane needs one load.
+        results = await asyncio.gather(*(_run_on_lane(lane, _warm_worker) for lane in range(len(get_cpu_lanes()))))
+    except Exception as e:
+        print(f"⚠️ Worker warm-up failed: {e}")
+        return
+    elapsed = time.perf_counter() - started
+    load_times = [seconds for seconds in results if seconds is not None]
+    metrics.set_gauge("worker_warmup_seconds", elapsed)
+    if load_times:
+        metrics.set_gauge("clip_model_load_seconds", max(load_times))
+    print(f"INFO:     Warmed up the {settings.WORKER_POOL_MODE} pool in {elapsed:.1f}s "
+          f"(CLIP load {max(load_times, default=0):.1f}s).")
+
+
+def start_warm_up():
+    """Schedules warm_up() on the running event loop without waiting for it."""
+    global _warmup_task
+    _warmup_task = asyncio.get_running_loop().create_task(warm_up())
+
+
+def preload_for_fork() -> bool:
+    """
+    Imports torch and loads CLIP in this process before it forks (gunicorn's
+    master with preload_app). Forked children then share the imported libraries
+    and the weights copy-on-write instead of each paying for their own. Only
+    children that run CLIP in-process benefit: gunicorn workers in thread pool
+    mode, or CPU workers started with WORKER_START_METHOD=fork. Nothing may run
+    inference here; torch's thread pool does not survive a fork.
+    """
+    if settings.WORKER_POOL_MODE == "process" and settings.WORKER_START_METHOD != "fork":
+        print("INFO:     Not preloading CLIP: spawned CPU workers would not inherit it.")
+        return False
+    from app.image_processing import filter
+    filter._load_model()
+    return filter.model != "failed"
+
+
+def shutdown():
+    global _cpu_lanes, _io_pool, _warmup_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _warmup_task = None
+    if _cpu_lanes is not None:
+        for lane in _cpu_lanes:
+            lane.shutdown(wait=False, cancel_futures=True)
+        _cpu_lanes = None
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=False, cancel_futures=True)
+        _io_pool = None
@@ -0,0 +1,229 @@
+"""
+A streaming ZIP writer: emits each member's header and data as it reads the
+file, so memory stays flat whatever the archive size.
+
+Already-compressed formats (JPEG, PNG, WebP, ...) are STORED rather than
+deflated; trying to deflate them just burns CPU. Sizes are known from the
+filesystem up front and CRCs go into trailing data descriptors, so when every
+member is stored the archive's exact byte layout is known before any byte is
+sent. That gives us Content-Length and HTTP Range (resumable downloads).
+ZIP64 records are used automatically for members, offsets or entry counts
+beyond the classic format's limits.
+"""
+import hashlib
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Iterator
+
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif", ".heic",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".mp4", ".mov", ".mp3",
+}
+
+_CHUNK_SIZE = 64 * 1024
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+# Deflate can slightly expand incompressible data, so switch to ZIP64 with some headroom.
+_DEFLATE_ZIP64_THRESHOLD = 0xF0000000
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_METHOD_STORED = 0
+_METHOD_DEFLATED = 8
+
+
+def _dos_datetime(timestamp: float) -> tuple[int, int]:
+    t = time.localtime(max(timestamp, 315532800))  # The DOS epoch is 1980-01-01
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+@dataclass
+class _Entry:
+    path: str
+    name: bytes
+    size: int
+    mtime: float
+    method: int
+    zip64: bool
+    offset: int = 0
+    crc: int = 0
+    compressed_size: int = 0
+
+    @property
+    def local_header_length(self) -> int:
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    @property
+    def descriptor_length(self) -> int:
+        return 24 if self.zip64 else 16
+
+
+class ZipStream:
+    """
+    Builds a ZIP archive of `files` (pairs of (path, name in archive)) on the fly.
+    Files that don't exist are skipped; duplicate names get a numeric suffix.
+    """
+
+    def __init__(self, files: list[tuple[str, str]]):
+        self.entries: list[_Entry] = []
+        used_names = set()
+        for path, arcname in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            arcname = self._unique_name(arcname, used_names)
+            stored = os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+            self.entries.append(_Entry(
+                path=path,
+                name=arcname.encode("utf-8"),
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                method=_METHOD_STORED if stored else _METHOD_DEFLATED,
+                zip64=stat.st_size >= (_ZIP32_LIMIT if stored else _DEFLATE_ZIP64_THRESHOLD),
+            ))
+
+    @staticmethod
+    def _unique_name(name: str, used: set) -> str:
+        candidate, (stem, ext), n = name, os.path.splitext(name), 1
+        while candidate in used:
+            candidate = f"{stem}_{n}{ext}"
+            n += 1
+        used.add(candidate)
+        return candidate
+
+    @property
+    def content_length(self) -> int | None:
+        """Exact archive size, or None if some member is deflated (size unknown until compressed)."""
+        if any(entry.method != _METHOD_STORED for entry in self.entries):
+            return None
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            entry.compressed_size = entry.size
+            offset += entry.local_header_length + entry.size + entry.descriptor_length
+        central_directory = b"".join(self._central_header(entry) for entry in self.entries)
+        return offset + len(central_directory) + len(self._end_records(offset, len(central_directory)))
+
+    @property
+    def etag(self) -> str:
+        """Changes whenever any member's name, size or mtime changes."""
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(b"%s\0%d\0%d\0%d\n" % (entry.name, entry.size, int(entry.mtime), entry.method))
+        return f'"{digest.hexdigest()}"'
+
+    # --- Record builders ---
+
+    def _local_header(self, entry: _Entry) -> bytes:
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if entry.zip64 else b""
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 45 if entry.zip64 else 20, _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+            entry.method, dos_time, dos_date, 0,
+            _ZIP32_LIMIT if entry.zip64 else 0, _ZIP32_LIMIT if entry.zip64 else 0,
+            len(entry.name), len(extra),
+        ) + entry.name + extra
+
+    def _descriptor(self, entry: _Entry) -> bytes:
+        if entry.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, entry.crc, entry.compressed_size, entry.size)
+        return struct.pack("<IIII", 0x08074B50, entry.crc, entry.compressed_size, entry.size)
+
+    def _central_header(self, entry: _Entry) -> bytes:
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        extra_fields = []
+        size, compressed_size, offset = entry.size, entry.compressed_size, entry.offset
+        if size >= _ZIP32_LIMIT:
+            extra_fields.append(size)
+            size = _ZIP32_LIMIT
+        if compressed_size >= _ZIP32_LIMIT:
+            extra_fields.append(compressed_size)
+            compressed_size = _ZIP32_LIMIT
+        if offset >= _ZIP32_LIMIT:
+            extra_fields.append(offset)
+            offset = _ZIP32_LIMIT
+        extra = struct.pack(f"<HH{len(extra_fields)}Q", 0x0001, 8 * len(extra_fields), *extra_fields) if extra_fields else b""
+        version = 45 if (entry.zip64 or extra_fields) else 20
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+            entry.method, dos_time, dos_date, entry.crc, compressed_size, size,
+            len(entry.name), len(extra), 0, 0, 0, 0o100644 << 16, offset,
+        ) + entry.name + extra
+
+    def _end_records(self, cd_offset: int, cd_size: int) -> bytes:
+        count = len(self.entries)
+        records = b""
+        if count >= _ZIP16_LIMIT or cd_offset >= _ZIP32_LIMIT or cd_size >= _ZIP32_LIMIT:
+            zip64_end_offset = cd_offset + cd_size
+            records += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, (3 << 8) | 45, 45, 0, 0, count, count, cd_size, cd_offset)
+            records += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+            count, cd_offset, cd_size = min(count, _ZIP16_LIMIT), min(cd_offset, _ZIP32_LIMIT), min(cd_size, _ZIP32_LIMIT)
+        return records + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+    # --- Streaming ---
+
+    def _iter_member(self, entry: _Entry) -> Iterator[bytes]:
+        crc = 0
+        written = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if entry.method == _METHOD_DEFLATED else None
+        with open(entry.path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                written += len(chunk)
+                if chunk:
+                    yield chunk
+        if compressor is not None:
+            tail = compressor.flush()
+            written += len(tail)
+            if tail:
+                yield tail
+        entry.crc = crc
+        entry.compressed_size = written
+
+    def _iter_all(self, skip_until: int) -> Iterator[tuple[int, bytes]]:
+        """Yields (offset, chunk) for the whole archive; file data wholly before `skip_until` is only CRC'd."""
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = self._local_header(entry)
+            yield offset, header
+            offset += len(header)
+            if entry.method == _METHOD_STORED and offset + entry.size <= skip_until:
+                # The client already has these bytes; we only need the CRC for the trailer.
+                crc = 0
+                with open(entry.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(_CHUNK_SIZE * 16), b""):
+                        crc = zlib.crc32(chunk, crc)
+                entry.crc, entry.compressed_size = crc, entry.size
+                offset += entry.size
+            else:
+                for chunk in self._iter_member(entry):
+                    yield offset, chunk
+                    offset += len(chunk)
+            descriptor = self._descriptor(entry)
+            yield offset, descriptor
+            offset += len(descriptor)
+
+        central_directory = b"".join(self._central_header(entry) for entry in self.entries)
+        yield offset, central_directory
+        yield offset + len(central_directory), self._end_records(offset, len(central_directory))
+
+    def iter_bytes(self, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+        """Yields the archive bytes in [start, end] (inclusive, like an HTTP Range)."""
+        for offset, chunk in self._iter_all(skip_until=start):
+            chunk_end = offset + len(chunk)
+            if chunk_end <= start:
+                continue
+            if end is not None and offset > end:
+                return
+            lo = max(0, start - offset)
+            hi = len(chunk) if end is None else min(len(chunk), end + 1 - offset)
+            yield chunk[lo:hi] if (lo or hi != len(chunk)) else chunk
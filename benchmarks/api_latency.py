@@ -0,0 +1,99 @@
+"""
+Measures API latency while an image job is running.
+
+Start the app first (e.g. `uvicorn app.main:app`), then run:
+
+    python -m benchmarks.api_latency --base-url http://127.0.0.1:8000 --query "sunset" --count 50
+
+The script submits a job, hammers the read-only endpoints (/api/jobs and
+/api/results/{id}) from several client threads until the job finishes (or
+--duration elapses), and reports p50/p95/p99 latency split by whether the job
+was PROCESSING at the time. With the pipeline on the web loop, the
+"processing" percentiles are in the seconds; with the worker pools they
+should match the idle ones.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+import requests
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _summarize(samples: list[float]) -> dict:
+    return {
+        "requests": len(samples),
+        "p50_ms": round(_percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(_percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(_percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2) if samples else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--query", default="sunset")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--email", default="bench@example.com")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=600.0, help="Give up after this many seconds")
+    args = parser.parse_args()
+
+    response = requests.post(
+        f"{args.base_url}/api/request-images",
+        json={"query": args.query, "email": args.email, "count": args.count},
+        timeout=10,
+    )
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    print(f"Submitted job #{job_id}")
+
+    state = {"status": "pending"}
+    samples = {"idle": [], "processing": []}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def client(worker: int):
+        session = requests.Session()
+        paths = ["/api/jobs", f"/api/results/{job_id}"]
+        i = worker
+        while not stop.is_set():
+            started = time.perf_counter()
+            session.get(args.base_url + paths[i % len(paths)], timeout=60)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples["processing" if state["status"] == "processing" else "idle"].append(elapsed)
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(args.clients)]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        status = requests.get(f"{args.base_url}/api/jobs/{job_id}", timeout=60).json()["status"]
+        state["status"] = status
+        if status in ("completed", "failed"):
+            break
+        time.sleep(1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    report = {"job_id": job_id, "final_status": state["status"]}
+    report.update({phase: _summarize(values) for phase, values in samples.items()})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
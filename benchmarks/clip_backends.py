@@ -0,0 +1,158 @@
+"""
+Compares the CLIP backends (torch fp32, int8, onnx) on speed, memory and accuracy.
+
+    python -m benchmarks.clip_backends --images-dir ./some/photos --queries sunset office "a dog"
+    python -m benchmarks.clip_backends --check --tolerance 0.02   # exit 1 if a backend drifts
+
+Each backend runs in its own subprocess so peak RSS is measured in isolation.
+Accuracy is judged against torch fp32, per query, on what the pipeline's ranking
+depends on:
+
+- topk_disagreement: the fraction of torch's --top-k images missing from the
+  backend's top k (worst query).
+- min_rank_correlation: the Spearman correlation of the two rankings (worst query).
+- max_cosine_diff: the largest difference in image-text cosine similarity. Logits
+  are this times logit_scale (about 100).
+
+--check fails a backend whose topk_disagreement exceeds --tolerance or whose
+max_cosine_diff exceeds --max-cosine-diff. Without --images-dir a synthetic
+corpus is generated, which is fine for speed and memory but says little about
+real-world accuracy.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+def run_worker(backend: str, paths: list[str], queries: list[str], batch_size: int):
+    """Runs inside the subprocess: loads one backend, scores everything, reports JSON on stdout."""
+    os.environ["CLIP_BACKEND"] = backend
+    os.environ["CLIP_CACHE_ENABLED"] = "false"
+    from app.image_processing import filter
+
+    baseline_rss = _rss_mb()
+    started = time.perf_counter()
+    filter._load_model()
+    load_seconds = time.perf_counter() - started
+    if filter.model == "failed":
+        print(json.dumps({"backend": backend, "error": "failed to load"}))
+        return
+
+    filter.image_embeddings(paths[:batch_size])  # warm-up
+    started = time.perf_counter()
+    embeddings = [filter.image_embeddings(paths[i:i + batch_size]) for i in range(0, len(paths), batch_size)]
+    image_seconds = time.perf_counter() - started
+
+    import numpy as np
+    embeddings = np.concatenate(embeddings)
+    cosines = {query: (embeddings @ filter.text_embedding(query)).tolist() for query in queries}
+    print(json.dumps({
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "images_per_sec": round(len(paths) / image_seconds, 2),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "model_rss_mb": round(_rss_mb() - baseline_rss, 1),
+        "logit_scale": round(float(filter.logit_scale), 4),
+        "cosines": cosines,
+    }))
+
+
+def _synthetic_corpus(directory: Path, count: int) -> list[str]:
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        path = directory / f"synthetic_{i:03d}.jpg"
+        Image.fromarray((rng.random((480, 640, 3)) * 255).astype("uint8")).save(path, quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--images-dir", type=Path)
+    parser.add_argument("--images", type=int, default=64, help="Synthetic images when --images-dir is not given")
+    parser.add_argument("--queries", nargs="+", default=["sunset", "office", "a dog"])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=10, help="Ranking depth compared against torch")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Max fraction of torch's top k a backend may miss")
+    parser.add_argument("--max-cosine-diff", type=float, default=0.02, help="Max image-text cosine difference from torch")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if a backend exceeds either tolerance")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--paths-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, json.loads(Path(args.paths_file).read_text()), args.queries, args.batch_size)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images_dir:
+            paths = sorted(str(p) for p in args.images_dir.iterdir() if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"})
+        else:
+            paths = _synthetic_corpus(Path(tmp), args.images)
+        paths_file = Path(tmp) / "paths.json"
+        paths_file.write_text(json.dumps(paths))
+
+        results = {}
+        for backend in args.backends:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.clip_backends", "--worker", backend, "--paths-file", str(paths_file),
+                 "--batch-size", str(args.batch_size), "--queries", *args.queries],
+                capture_output=True, text=True, check=False,
+            )
+            lines = [line for line in output.stdout.splitlines() if line.startswith('{"backend"')]
+            if not lines:
+                results[backend] = {"error": output.stderr[-2000:]}
+                continue
+            results[backend] = json.loads(lines[-1])
+
+    import numpy as np
+
+    def ranks(values: np.ndarray) -> np.ndarray:
+        return np.argsort(np.argsort(values)).astype(np.float64)
+
+    reference = results.get("torch", {}).get("cosines")
+    top_k = max(1, min(args.top_k, len(paths)))
+    failed = False
+    report = []
+    for backend, result in results.items():
+        entry = {key: value for key, value in result.items() if key != "cosines"}
+        if reference and "cosines" in result:
+            disagreement, correlation, max_diff = 0.0, 1.0, 0.0
+            for query, ref_cosines in reference.items():
+                ref, got = np.array(ref_cosines), np.array(result["cosines"][query])
+                ref_top, got_top = set(np.argsort(-ref)[:top_k]), set(np.argsort(-got)[:top_k])
+                disagreement = max(disagreement, 1 - len(ref_top & got_top) / top_k)
+                if len(ref) > 1:
+                    correlation = min(correlation, float(np.corrcoef(ranks(ref), ranks(got))[0, 1]))
+                max_diff = max(max_diff, float(np.abs(ref - got).max()))
+            entry["topk_disagreement"] = round(disagreement, 4)
+            entry["min_rank_correlation"] = round(correlation, 4)
+            entry["max_cosine_diff"] = round(max_diff, 5)
+            entry["within_tolerance"] = disagreement <= args.tolerance and max_diff <= args.max_cosine_diff
+            failed |= not entry["within_tolerance"]
+        report.append(entry)
+
+    print(json.dumps({"top_k": top_k, "images": len(paths), "results": report}, indent=2))
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures CLIP image-embedding throughput on CPU at different batch sizes and
+torch thread counts, to tune INFERENCE_MAX_BATCH_SIZE and TORCH_NUM_THREADS.
+
+    python -m benchmarks.clip_batching --batch-sizes 1 4 8 16 32 64 --threads 1 2 4
+
+Runs the image tower directly (the embedding cache is bypassed) on synthetic
+images, after one warm-up batch per configuration, and prints images/sec and
+per-batch latency as JSON. Pass --model to use a local checkpoint.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--threads", type=int, nargs="+", default=[os.cpu_count() or 1])
+    parser.add_argument("--images", type=int, default=128, help="Images embedded per configuration")
+    parser.add_argument("--model", default=None, help="Overrides CLIP_MODEL_NAME")
+    args = parser.parse_args()
+
+    if args.model:
+        os.environ["CLIP_MODEL_NAME"] = args.model
+    os.environ["CLIP_CACHE_ENABLED"] = "false"
+
+    import numpy as np
+    import torch
+    from PIL import Image
+    from app.image_processing import filter
+
+    filter._load_model()
+    if filter.model == "failed":
+        raise SystemExit("CLIP model could not be loaded.")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        rng = np.random.default_rng(0)
+        paths = []
+        for i in range(max(args.batch_sizes)):
+            path = Path(tmp) / f"bench_{i}.jpg"
+            Image.fromarray((rng.random((480, 640, 3)) * 255).astype("uint8")).save(path, quality=90)
+            paths.append(str(path))
+
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                batch = paths[:batch_size]
+                filter.image_embeddings(batch)  # warm-up
+                rounds = max(1, args.images // batch_size)
+                latencies = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    filter.image_embeddings(batch)
+                    latencies.append(time.perf_counter() - started)
+                total = sum(latencies)
+                results.append({
+                    "threads": threads,
+                    "batch_size": batch_size,
+                    "images_per_sec": round(rounds * batch_size / total, 2),
+                    "batch_latency_ms_mean": round(total / rounds * 1000, 1),
+                    "batch_latency_ms_max": round(max(latencies) * 1000, 1),
+                })
+                print(json.dumps(results[-1]))
+
+    print(json.dumps({"model": filter.MODEL_NAME, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+"""
+Offline end-to-end benchmark: runs whole jobs against a local stand-in for Pexels.
+
+    python -m benchmarks.e2e --jobs 4 --images 30 --corpus 400 --dup-rate 0.1 --near-dup-rate 0.1 \\
+        --latency 0.02 --bandwidth-kbps 8000 --throttle-rate 0.02 --clip stub --output e2e.json
+
+No network access or model download is needed:
+
+- A local HTTP server plays both the Pexels search API (PEXELS_API_URL points
+  at it) and the image CDN. Every request waits --latency seconds. Image bodies
+  are sent at --bandwidth-kbps per connection, and a --throttle-rate fraction of
+  image requests get a 429 with Retry-After.
+- The photos are a synthetic corpus. A --dup-rate fraction are byte-identical
+  copies of another photo, and a --near-dup-rate fraction are re-encoded copies
+  with a slight crop and brightness change. Every query returns its own
+  shuffle of the corpus.
+- --clip stub uses the model-free "stub" CLIP backend. --clip model uses the
+  configured CLIP_MODEL_NAME, which must already be available locally.
+
+--mode pipeline calls run_image_pipeline directly, --concurrency jobs at a time.
+--mode api goes through the app instead. It posts to /api/request-images and
+lets the scheduler pick the jobs up. It then polls /api/jobs/{id} and fetches
+each job's results page and ZIP.
+
+The report (JSON, on stdout and in --output) has per-job wall-clock times, and
+per-stage seconds, items and items/s summed from each job's Job.metrics. It
+also has the duplicates detected against the duplicates planted, the server's
+request counts, and the peak RSS of this process and its worker processes.
+--baseline takes an earlier report and adds the ratio of each headline number,
+so runs from two commits can be compared. Any setting can be overridden
+through the environment as usual (e.g. FETCH_RATE_LIMIT=50 WORKER_POOL_MODE=thread).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+_REPO_ROOT = Path(__file__).resolve().parent.parent
+_CHUNK_SIZE = 16 * 1024
+
+
+# --- Synthetic corpus ---
+
+class Corpus:
+    """Photo ids mapped to JPEG bytes, with a known share of exact and near duplicates."""
+
+    def __init__(self, size: int, dup_rate: float, near_dup_rate: float, width: int, height: int, seed: int):
+        self.width, self.height = width, height
+        rng = random.Random(seed)
+        self.ids = list(range(1000, 1000 + size))
+        self.kinds: dict[int, tuple[str, int | None]] = {}
+        self.images: dict[int, bytes] = {}
+        bases: list[int] = []
+        sources: dict[int, Image.Image] = {}
+        for photo_id in self.ids:
+            roll = rng.random()
+            if bases and roll < dup_rate:
+                source = rng.choice(bases)
+                self.kinds[photo_id] = ("duplicate", source)
+                self.images[photo_id] = self.images[source]
+            elif bases and roll < dup_rate + near_dup_rate:
+                source = rng.choice(bases)
+                self.kinds[photo_id] = ("near_duplicate", source)
+                self.images[photo_id] = self._encode(self._perturb(sources[source], rng), quality=80)
+            else:
+                image = self._render(photo_id)
+                sources[photo_id] = image
+                bases.append(photo_id)
+                self.kinds[photo_id] = ("unique", None)
+                self.images[photo_id] = self._encode(image, quality=90)
+
+    def _render(self, photo_id: int) -> Image.Image:
+        """A smooth random colour field with a few shapes and some grain, distinct per id."""
+        rng = np.random.default_rng(photo_id)
+        low = (rng.random((6, 9, 3)) * 255).astype(np.uint8)
+        image = Image.fromarray(low).resize((self.width, self.height), Image.Resampling.BICUBIC)
+        draw = ImageDraw.Draw(image)
+        for _ in range(4):
+            x, y = rng.integers(0, self.width), rng.integers(0, self.height)
+            r = int(rng.integers(self.height // 12, self.height // 4))
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+        grain = rng.integers(-12, 13, (self.height, self.width, 3), dtype=np.int16)
+        return Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + grain, 0, 255).astype(np.uint8))
+
+    def _perturb(self, image: Image.Image, rng: random.Random) -> Image.Image:
+        dx, dy = int(self.width * rng.uniform(0, 0.02)), int(self.height * rng.uniform(0, 0.02))
+        cropped = image.crop((dx, dy, self.width - dx, self.height - dy)).resize((self.width, self.height))
+        return ImageEnhance.Brightness(cropped).enhance(rng.uniform(0.95, 1.05))
+
+    @staticmethod
+    def _encode(image: Image.Image, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def results_for(self, query: str) -> list[int]:
+        ids = list(self.ids)
+        random.Random(zlib.crc32(query.encode("utf-8"))).shuffle(ids)
+        return ids
+
+    def describe(self) -> dict:
+        kinds = [kind for kind, _ in self.kinds.values()]
+        return {
+            "photos": len(self.ids),
+            "unique": kinds.count("unique"),
+            "duplicates": kinds.count("duplicate"),
+            "near_duplicates": kinds.count("near_duplicate"),
+            "mean_bytes": round(statistics.fmean(len(b) for b in self.images.values())),
+        }
+
+
+# --- Pexels + CDN stand-in ---
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, corpus: Corpus, latency: float, bandwidth_kbps: float, throttle_rate: float,
+                 retry_after: int, seed: int):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.bandwidth = bandwidth_kbps * 1024 / 8 if bandwidth_kbps > 0 else None  # Bytes per second
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {
+            "search_requests": 0, "image_requests": 0, "throttled": 0, "bytes_sent": 0,
+            "served_unique": 0, "served_duplicate": 0, "served_near_duplicate": 0,
+        }
+
+    def handle_error(self, request, client_address):
+        # The pipeline drops connections it no longer needs (e.g. once a job has enough images).
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real CDN
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        server: StubServer = self.server
+        if server.bandwidth is None:
+            self.wfile.write(body)
+        else:
+            for offset in range(0, len(body), _CHUNK_SIZE):
+                chunk = body[offset:offset + _CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / server.bandwidth)
+        server.count("bytes_sent", len(body))
+
+    def do_GET(self):
+        server: StubServer = self.server
+        url = urlparse(self.path)
+        time.sleep(server.latency)
+        if url.path == "/v1/search":
+            server.count("search_requests")
+            params = parse_qs(url.query)
+            query = params.get("query", [""])[0]
+            per_page = int(params.get("per_page", ["80"])[0])
+            page = int(params.get("page", ["1"])[0])
+            ids = server.corpus.results_for(query)
+            photos = [
+                {
+                    "id": photo_id, "width": server.corpus.width, "height": server.corpus.height,
+                    "src": {r: f"{server.base_url}/cdn/{photo_id}-{r}.jpeg" for r in ("original", "large2x", "large", "medium")},
+                }
+                for photo_id in ids[(page - 1) * per_page:page * per_page]
+            ]
+            body = json.dumps({"page": page, "per_page": per_page, "total_results": len(ids), "photos": photos})
+            return self._send(200, body.encode("utf-8"), "application/json")
+        if url.path.startswith("/cdn/"):
+            server.count("image_requests")
+            with server.lock:
+                throttled = server.rng.random() < server.throttle_rate
+            if throttled:
+                server.count("throttled")
+                return self._send(429, b"slow down", "text/plain", {"Retry-After": str(server.retry_after)})
+            photo_id = int(url.path.rsplit("/", 1)[1].split("-", 1)[0])
+            body = server.corpus.images.get(photo_id)
+            if body is None:
+                return self._send(404, b"not found", "text/plain")
+            server.count(f"served_{server.corpus.kinds[photo_id][0]}")
+            return self._send(200, body, "image/jpeg")
+        self._send(404, b"not found", "text/plain")
+
+
+# --- Resource sampling ---
+
+class RssSampler(threading.Thread):
+    """Tracks the peak resident set size of this process and, separately, of its worker processes combined."""
+
+    def __init__(self, interval: float = 0.1):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.interval = interval
+        self.peak_self = 0
+        self.peak_children = 0
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _rss(pid: int | str) -> int:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_self = max(self.peak_self, self._rss("self"))
+            children = sum(self._rss(child.pid) for child in multiprocessing.active_children())
+            self.peak_children = max(self.peak_children, children)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        # Where /proc isn't available, fall back to the kernel's own high-water marks.
+        scale = 1 if sys.platform == "darwin" else 1024
+        peak_self = self.peak_self or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        peak_children = self.peak_children or resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        return {"peak_rss_mb": round(peak_self / 2**20, 1), "peak_rss_workers_mb": round(peak_children / 2**20, 1)}
+
+
+# --- Drivers ---
+
+def _percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+async def _run_pipeline_mode(queries: list[str], args) -> dict[int, float]:
+    from app.image_processing.pipeline import run_image_pipeline
+    from app.models.job import SessionLocal, Job, JobStatus, JobType
+
+    with SessionLocal() as db:
+        jobs = [
+            Job(query=query, email="bench@example.com", image_count=args.images,
+                job_type=JobType.FREE if args.images <= 50 else JobType.PAID, status=JobStatus.PROCESSING)
+            for query in queries
+        ]
+        db.add_all(jobs)
+        db.commit()
+        job_ids = [job.id for job in jobs]
+
+    slots = asyncio.Semaphore(args.concurrency)
+    walls: dict[int, float] = {}
+
+    async def run(job_id: int):
+        async with slots:
+            started = time.perf_counter()
+            await run_image_pipeline(job_id)
+            walls[job_id] = time.perf_counter() - started
+
+    await asyncio.gather(*(run(job_id) for job_id in job_ids))
+    return walls
+
+
+def _run_api_mode(queries: list[str], args) -> tuple[dict[int, float], dict]:
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    walls: dict[int, float] = {}
+    timings = {"results_page_ms": [], "download_ms": [], "download_bytes": 0, "list_jobs_ms": None}
+    with TestClient(app) as client:
+        submitted = {}
+        for query in queries:
+            response = client.post("/api/request-images", json={"query": query, "email": "bench@example.com", "count": args.images})
+            response.raise_for_status()
+            submitted[response.json()["job_id"]] = time.perf_counter()
+
+        deadline = time.perf_counter() + args.timeout
+        while len(walls) < len(submitted) and time.perf_counter() < deadline:
+            for job_id, started in submitted.items():
+                if job_id in walls:
+                    continue
+                status = client.get(f"/api/jobs/{job_id}").json()["status"]
+                if status in ("completed", "failed"):
+                    walls[job_id] = time.perf_counter() - started
+            time.sleep(0.1)
+
+        for job_id in walls:
+            started = time.perf_counter()
+            client.get(f"/api/results/{job_id}")
+            timings["results_page_ms"].append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            response = client.get(f"/api/download/{job_id}")
+            timings["download_ms"].append((time.perf_counter() - started) * 1000)
+            if response.status_code == 200:
+                timings["download_bytes"] += len(response.content)
+        started = time.perf_counter()
+        client.get("/api/jobs", params={"limit": 100})
+        timings["list_jobs_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    for key in ("results_page_ms", "download_ms"):
+        samples = timings[key]
+        timings[key] = {"p50": round(_percentile(samples, 50), 2), "max": round(max(samples), 2)} if samples else None
+    return walls, timings
+
+
+def _collect(job_walls: dict[int, float]) -> tuple[list[dict], dict]:
+    from app.models.job import SessionLocal, Job
+
+    jobs, stages = [], {}
+    with SessionLocal() as db:
+        for job in db.query(Job).filter(Job.id.in_(list(job_walls))).order_by(Job.id):
+            summary = job.metrics or {}
+            counters = summary.get("counters", {})
+            jobs.append({
+                "id": job.id,
+                "query": job.query,
+                "status": job.status.value,
+                "wall_seconds": round(job_walls[job.id], 3),
+                "pipeline_seconds": summary.get("total_seconds"),
+                "images": len(job.images),
+                **counters,
+            })
+            for name, entry in summary.get("stages", {}).items():
+                total = stages.setdefault(name, {"seconds": 0.0, "items": 0, "calls": 0})
+                total["seconds"] += entry["seconds"]
+                total["items"] += entry["items"]
+                total["calls"] += entry["calls"]
+    for total in stages.values():
+        total["seconds"] = round(total["seconds"], 4)
+        total["items_per_sec"] = round(total["items"] / total["seconds"], 2) if total["seconds"] and total["items"] else None
+    return jobs, stages
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """The app and its worker processes log with print(); keep stdout for the report."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(report: dict, baseline: dict) -> dict:
+    """Ratios (this run / baseline) of the headline numbers; below 1 is faster for times, above 1 for rates."""
+    def ratio(new, old):
+        return round(new / old, 3) if isinstance(new, (int, float)) and isinstance(old, (int, float)) and old else None
+
+    summary = {key: ratio(value, baseline.get("summary", {}).get(key)) for key, value in report["summary"].items()}
+    stages = {
+        name: ratio(entry["items_per_sec"], baseline.get("stages", {}).get(name, {}).get("items_per_sec"))
+        for name, entry in report["stages"].items()
+    }
+    return {"baseline_commit": baseline.get("meta", {}).get("commit"), "summary": summary, "stage_items_per_sec": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("pipeline", "api"), default="pipeline")
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--images", type=int, default=30, help="Images requested per job")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs run at once (pipeline mode)")
+    parser.add_argument("--query", default="benchmark scene")
+    parser.add_argument("--repeat-queries", action="store_true", help="Use the same query for every job (exercises the result cache)")
+    parser.add_argument("--corpus", type=int, default=400, help="Photos in the synthetic corpus")
+    parser.add_argument("--dup-rate", type=float, default=0.1)
+    parser.add_argument("--near-dup-rate", type=float, default=0.1)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=853)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every stub request")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="Per-connection image bandwidth; 0 = unlimited")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of image requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--clip", choices=("stub", "model"), default="stub")
+    parser.add_argument("--clip-threshold", type=float, default=None, help="CLIP_FILTER_THRESHOLD (stub default: accept all)")
+    parser.add_argument("--timeout", type=float, default=600, help="Give up waiting for jobs after this many seconds (api mode)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--baseline", help="An earlier report to compare against")
+    parser.add_argument("--keep-data", action="store_true", help="Don't delete the temporary data directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    corpus = Corpus(args.corpus, args.dup_rate, args.near_dup_rate, args.width, args.height, args.seed)
+    corpus_seconds = time.perf_counter() - started
+    server = StubServer(corpus, args.latency, args.bandwidth_kbps, args.throttle_rate, args.retry_after, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Settings are read at import time, so the environment must be ready before the app is imported.
+    data_root = tempfile.mkdtemp(prefix="pixelforge-bench-")
+    os.makedirs(os.path.join(data_root, "downloads"))
+    threshold = args.clip_threshold if args.clip_threshold is not None else (-1e9 if args.clip == "stub" else None)
+    env = {
+        "RENDER_DISK_PATH": data_root,
+        "PEXELS_API_URL": f"{server.base_url}/v1",
+        "PEXELS_API_KEY": "benchmark",
+        "NOTIFY_MAX_ATTEMPTS": "0",  # Never try to send email
+    }
+    if args.clip == "stub":
+        env["CLIP_BACKEND"] = "stub"
+    if threshold is not None:
+        env["CLIP_FILTER_THRESHOLD"] = str(threshold)
+    for key in ("MAIL_USERNAME", "MAIL_PASSWORD"):
+        env.setdefault(key, os.environ.get(key, "benchmark"))
+    env.setdefault("MAIL_FROM", os.environ.get("MAIL_FROM", "bench@example.com"))
+    os.environ.update(env)
+
+    with _stdout_to_stderr():
+        from app.models.job import create_db_and_tables
+        from app.services import workers
+
+        create_db_and_tables()
+        queries = [args.query if args.repeat_queries else f"{args.query} {n}" for n in range(args.jobs)]
+        sampler = RssSampler()
+        sampler.start()
+        started = time.perf_counter()
+        api_timings = None
+        try:
+            if args.mode == "pipeline":
+                walls = asyncio.run(_run_pipeline_mode(queries, args))
+            else:
+                walls, api_timings = _run_api_mode(queries, args)
+        finally:
+            elapsed = time.perf_counter() - started
+            memory = sampler.stop()
+            workers.shutdown()
+            server.shutdown()
+        jobs, stages = _collect(walls)
+
+    accepted = sum(job["images"] for job in jobs)
+    job_walls = [job["wall_seconds"] for job in jobs]
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "corpus": {**corpus.describe(), "generate_seconds": round(corpus_seconds, 2)},
+        "server": dict(server.counters),
+        "summary": {
+            "jobs": len(jobs),
+            "jobs_completed": sum(1 for job in jobs if job["status"] == "completed"),
+            "wall_seconds": round(elapsed, 3),
+            "job_wall_p50_seconds": _percentile(job_walls, 50),
+            "job_wall_max_seconds": max(job_walls) if job_walls else None,
+            "images_accepted": accepted,
+            "images_per_sec": round(accepted / elapsed, 2) if elapsed else None,
+            "bytes_downloaded": sum(job.get("bytes_downloaded", 0) for job in jobs),
+            "duplicates_detected": sum(job.get("images_duplicates", 0) + job.get("images_skipped_known", 0) for job in jobs),
+            **memory,
+        },
+        "stages": stages,
+        "jobs": jobs,
+    }
+    if api_timings is not None:
+        report["api"] = api_timings
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = _compare(report, json.load(f))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    if args.keep_data:
+        print(f"Data kept in {data_root}", file=sys.stderr)
+    else:
+        shutil.rmtree(data_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
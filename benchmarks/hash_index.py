@@ -0,0 +1,77 @@
+"""
+Benchmarks the near-duplicate hash index against a linear scan.
+
+    python -m benchmarks.hash_index --sizes 10000 100000 1000000 --distance 4
+
+For each index size it inserts random 64-bit hashes, then times queries for
+planted near-duplicates (1..distance bits flipped) and for random misses, and
+checks recall against a brute-force scan on a sample of queries.
+"""
+import argparse
+import json
+import random
+import time
+
+from app.image_processing.hash_index import HammingIndex
+
+
+def _flip_bits(value: int, count: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def run(size: int, distance: int, queries: int, scan_sample: int, rng: random.Random) -> dict:
+    hashes = [rng.getrandbits(64) for _ in range(size)]
+    index = HammingIndex(distance)
+
+    started = time.perf_counter()
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+    insert_seconds = time.perf_counter() - started
+
+    near = [_flip_bits(rng.choice(hashes), rng.randint(1, distance), rng) for _ in range(queries)]
+    misses = [rng.getrandbits(64) for _ in range(queries)]
+
+    started = time.perf_counter()
+    found = sum(1 for value in near if index.has_near(value))
+    near_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    false_hits = sum(1 for value in misses if index.has_near(value))
+    miss_seconds = time.perf_counter() - started
+
+    sample = near[:scan_sample]
+    started = time.perf_counter()
+    scan_found = sum(1 for value in sample if any((value ^ h).bit_count() <= distance for h in hashes))
+    scan_seconds = time.perf_counter() - started
+
+    return {
+        "size": size,
+        "distance": distance,
+        "inserts_per_sec": round(size / insert_seconds),
+        "near_query_us": round(near_seconds / queries * 1e6, 2),
+        "miss_query_us": round(miss_seconds / queries * 1e6, 2),
+        "linear_scan_query_us": round(scan_seconds / len(sample) * 1e6, 2) if sample else None,
+        "recall": found / queries,
+        "scan_recall": scan_found / len(sample) if sample else None,
+        "random_hits": false_hits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--distance", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--scan-sample", type=int, default=20, help="Queries to brute-force for comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [run(size, args.distance, args.queries, args.scan_sample, rng) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
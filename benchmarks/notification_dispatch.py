@@ -0,0 +1,116 @@
+"""
+Runs the notification dispatcher against a local aiosmtpd server (`pip install aiosmtpd`).
+
+    python -m benchmarks.notification_dispatch --jobs 200 --latency 0.05 --fail-rate 0.1
+
+Seeds a throwaway database with completed jobs, starts an SMTP stand-in that
+takes --latency seconds per message and answers a --fail-rate fraction of
+messages with a temporary 451 error, then calls dispatch_notifications until
+every job is notified. Backoff is disabled so retries happen on the next pass.
+Reports emails/s, SMTP connections opened, and retries.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+
+class _Handler:
+    def __init__(self, latency: float, fail_rate: float, seed: int):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self.delivered = 0
+        self.rejected = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.fail_rate:
+            self.rejected += 1
+            return "451 Temporary failure, try again"
+        self.delivered += 1
+        return "250 Message accepted"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the server takes per message")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of messages answered with 451")
+    parser.add_argument("--concurrency", type=int, default=4, help="NOTIFY_CONCURRENCY")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from aiosmtpd.controller import Controller
+
+    data_root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(data_root, "downloads"), exist_ok=True)
+    os.environ.update(
+        RENDER_DISK_PATH=data_root, MAIL_SERVER="127.0.0.1", MAIL_PORT=str(args.port),
+        MAIL_STARTTLS="false", MAIL_SSL_TLS="false", USE_CREDENTIALS="false",
+        MAIL_USERNAME=os.environ.get("MAIL_USERNAME", "bench"), MAIL_PASSWORD=os.environ.get("MAIL_PASSWORD", "bench"),
+        MAIL_FROM=os.environ.get("MAIL_FROM", "bench@example.com"),
+        NOTIFY_CONCURRENCY=str(args.concurrency), NOTIFY_BACKOFF_BASE="0", NOTIFY_MAX_ATTEMPTS="100",
+    )
+    from sqlalchemy import insert
+    from app.models.job import SessionLocal, Job, JobStatus, JobType, create_db_and_tables
+    from app.services import notification_service
+
+    create_db_and_tables()
+    with SessionLocal() as db:
+        db.execute(insert(Job), [
+            {"query": f"query {n}", "email": f"user{n}@example.com", "image_count": 10,
+             "job_type": JobType.FREE, "status": JobStatus.COMPLETED, "email_sent": False}
+            for n in range(args.jobs)
+        ])
+        db.commit()
+
+    handler = _Handler(args.latency, args.fail_rate, args.seed)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+
+    async def run() -> tuple[float, int]:
+        started = time.perf_counter()
+        passes = 0
+        with SessionLocal() as db:
+            while db.query(Job).filter(Job.email_sent == False).count():
+                await notification_service.dispatch_notifications()
+                passes += 1
+                db.expire_all()
+        elapsed = time.perf_counter() - started
+        await notification_service.shutdown()
+        return elapsed, passes
+
+    try:
+        elapsed, passes = asyncio.run(run())
+    finally:
+        controller.stop()
+
+    stats = notification_service.stats()
+    print(json.dumps({
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "server_latency_s": args.latency,
+        "fail_rate": args.fail_rate,
+        "seconds": round(elapsed, 3),
+        "emails_per_sec": round(args.jobs / elapsed, 1),
+        "passes": passes,
+        "smtp_connections": handler.connections,
+        "delivered": handler.delivered,
+        "retries": stats["failed"],
+        "serial_estimate_s": round(args.jobs * args.latency, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures perceptual-hash throughput (images/sec) and checks it against imagehash.
+
+    python -m benchmarks.phash_throughput --images 200 --width 4000 --height 3000
+
+Generates a corpus of synthetic JPEGs, then hashes it three ways:
+  * imagehash.phash, one image at a time (the old deduplicate_images path)
+  * deduplicate.phash_batch with full-resolution decoding
+  * deduplicate.phash_batch with JPEG draft (reduced-scale) decoding
+The full-resolution batch hashes must equal imagehash's bit for bit; for draft
+mode the report gives the Hamming distance distribution against imagehash.
+"""
+import argparse
+import json
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+from app.image_processing.deduplicate import phash_batch
+
+
+def make_corpus(directory: Path, count: int, width: int, height: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        # Smooth gradients plus noise look more like photos than pure noise does.
+        y, x = np.mgrid[0:height:8, 0:width:8]
+        base = np.stack([(x * rng.uniform(0.01, 0.1) + y * rng.uniform(0.01, 0.1) + c * 60) % 256 for c in range(3)], -1)
+        small = Image.fromarray((base + rng.normal(0, 12, base.shape)).clip(0, 255).astype("uint8"))
+        path = directory / f"bench_{i:04d}.jpg"
+        small.resize((width, height), Image.Resampling.BILINEAR).save(path, quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(Path(tmp), args.images, args.width, args.height, args.seed)
+
+        def reference():
+            hashes = []
+            for path in paths:
+                with Image.open(path) as img:
+                    hashes.append(int(str(imagehash.phash(img)), 16))
+            return hashes
+
+        def batched(draft: bool):
+            hashes = []
+            for i in range(0, len(paths), args.batch_size):
+                hashes.extend(phash_batch(paths[i:i + args.batch_size], draft=draft))
+            return hashes
+
+        expected, reference_seconds = _timed(reference)
+        full, full_seconds = _timed(lambda: batched(False))
+        draft, draft_seconds = _timed(lambda: batched(True))
+
+    draft_distances = Counter((a ^ b).bit_count() for a, b in zip(expected, draft))
+    report = {
+        "images": args.images,
+        "resolution": f"{args.width}x{args.height}",
+        "imagehash_per_sec": round(args.images / reference_seconds, 1),
+        "batch_full_decode_per_sec": round(args.images / full_seconds, 1),
+        "batch_draft_per_sec": round(args.images / draft_seconds, 1),
+        "full_decode_bit_exact": full == expected,
+        "draft_hamming_distances": dict(sorted(draft_distances.items())),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
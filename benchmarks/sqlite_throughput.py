@@ -0,0 +1,182 @@
+"""
+Benchmarks the SQLite layer: concurrent job insert rate and scheduler poll latency.
+
+    python -m benchmarks.sqlite_throughput --history 20000 --jobs 1000 --writers 4
+
+Runs the same workload twice, each on a fresh database file in a temp dir:
+
+- "default": a plain engine (rollback journal, synchronous=FULL), without the
+  scheduler/job_images indexes, inserting images one ORM object at a time.
+- "tuned": `create_sqlite_engine` (WAL, synchronous=NORMAL, busy_timeout), with
+  the indexes, inserting images in bulk like the pipeline does.
+
+Each database is seeded with --history finished jobs. Then --writers threads
+insert --jobs new jobs (each with --images-per-job image rows, one transaction
+per job). Meanwhile a poller thread runs the scheduler's claim and notification
+queries in a loop. The script reports jobs/s, poll latency percentiles, and
+"database is locked" errors.
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.models.job import Base, Job, JobImage, JobStatus, JobType, create_sqlite_engine
+
+_NEW_INDEXES = ("ix_jobs_status_type_id", "ix_jobs_status_email_sent", "ix_jobs_status_updated_at", "ix_job_images_job_id")
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _make_engine(path: Path, tuned: bool):
+    url = f"sqlite:///{path}"
+    engine = create_sqlite_engine(url) if tuned else create_engine(url, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    if not tuned:
+        with engine.begin() as conn:
+            for name in _NEW_INDEXES:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    return engine
+
+
+def _seed(Session, history: int, images_per_job: int):
+    with Session() as db:
+        job_ids = db.scalars(
+            insert(Job).returning(Job.id, sort_by_parameter_order=True),
+            [
+                {"query": f"seed {n}", "email": "bench@example.com", "image_count": images_per_job,
+                 "job_type": JobType.FREE if n % 3 else JobType.PAID,
+                 "status": JobStatus.COMPLETED if n % 10 else JobStatus.FAILED, "email_sent": True}
+                for n in range(history)
+            ],
+        ).all()
+        db.execute(insert(JobImage), [
+            {"job_id": job_id, "file_path": f"/tmp/job_{job_id}/image_{i:04d}.jpg", "score": 1.0}
+            for job_id in job_ids for i in range(images_per_job)
+        ])
+        db.commit()
+
+
+def _insert_job(Session, n: int, images_per_job: int, bulk: bool):
+    with Session() as db:
+        job = Job(query=f"bench {n}", email="bench@example.com", image_count=images_per_job,
+                  job_type=JobType.FREE if n % 3 else JobType.PAID, status=JobStatus.PENDING)
+        db.add(job)
+        db.flush()
+        rows = [
+            {"job_id": job.id, "file_path": f"/tmp/job_{job.id}/image_{i:04d}.jpg", "score": float(i)}
+            for i in range(images_per_job)
+        ]
+        if bulk:
+            db.execute(insert(JobImage), rows)
+        else:
+            for row in rows:
+                db.add(JobImage(**row))
+                db.flush()
+        db.commit()
+
+
+def _poll(Session):
+    """The scheduler's read side: claim candidates in both lanes, then jobs awaiting email."""
+    with Session() as db:
+        for lane in (JobType.PAID, JobType.FREE):
+            db.execute(
+                select(Job.id).where(Job.status == JobStatus.PENDING, Job.job_type == lane).order_by(Job.id).limit(2)
+            ).all()
+        db.execute(select(Job.id).where(Job.status == JobStatus.COMPLETED, Job.email_sent == False)).all()
+
+
+def run(name: str, tuned: bool, args, directory: Path) -> dict:
+    engine = _make_engine(directory / f"{name}.db", tuned)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    _seed(Session, args.history, args.images_per_job)
+
+    counter = iter(range(args.jobs))
+    counter_lock = threading.Lock()
+    errors = {"locked": 0}
+    done = threading.Event()
+    poll_samples = []
+
+    def writer():
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            try:
+                _insert_job(Session, n, args.images_per_job, bulk=tuned)
+            except OperationalError:
+                with counter_lock:
+                    errors["locked"] += 1
+
+    def poller():
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                _poll(Session)
+            except OperationalError:
+                with counter_lock:
+                    errors["locked"] += 1
+                continue
+            poll_samples.append(time.perf_counter() - started)
+            time.sleep(args.poll_interval)
+
+    poll_thread = threading.Thread(target=poller, daemon=True)
+    poll_thread.start()
+    writers = [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.perf_counter()
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    poll_thread.join()
+    engine.dispose()
+
+    return {
+        "config": name,
+        "jobs": args.jobs,
+        "writers": args.writers,
+        "images_per_job": args.images_per_job,
+        "seconds": round(elapsed, 3),
+        "jobs_per_sec": round(args.jobs / elapsed, 1),
+        "image_rows_per_sec": round(args.jobs * args.images_per_job / elapsed),
+        "polls": len(poll_samples),
+        "poll_p50_ms": round(_percentile(poll_samples, 50) * 1000, 3),
+        "poll_p95_ms": round(_percentile(poll_samples, 95) * 1000, 3),
+        "poll_p99_ms": round(_percentile(poll_samples, 99) * 1000, 3),
+        "poll_mean_ms": round(statistics.fmean(poll_samples) * 1000, 3) if poll_samples else None,
+        "locked_errors": errors["locked"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, default=20000, help="Finished jobs to seed the database with")
+    parser.add_argument("--jobs", type=int, default=1000, help="Jobs inserted during the measured phase")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--images-per-job", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=0.005, help="Seconds between scheduler polls")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run("default", False, args, Path(tmp)), run("tuned", True, args, Path(tmp))]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Production server settings:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it. With PRELOAD_CLIP_BEFORE_FORK, the master also imports torch
+and loads CLIP before forking. Workers that run CLIP in their own process then
+share those pages copy-on-write: WORKER_POOL_MODE=thread, or process mode with
+WORKER_START_METHOD=fork. Each of them skips the import and the model load.
+
+That shared path is the default here: with preload_app on, CPU workers are
+forked (WORKER_START_METHOD defaults to "fork" instead of "spawn"), so CLIP is
+loaded once in the master and the startup warm-up only forks the CPU workers.
+
+Setting WORKER_START_METHOD=spawn (or GUNICORN_PRELOAD=false) gives every CPU
+worker of every gunicorn worker its own copy of torch and CLIP:
+WEB_CONCURRENCY x WORKER_PROCESSES of them. With more than one gunicorn worker,
+the startup warm-up is then turned off, so each copy is only loaded when a
+worker first runs a job.
+
+The torch backend loads safetensors checkpoints memory-mapped, so the weights
+sit in the page cache once per machine whichever way the workers start. The
+shared import is what saves the most memory per worker.
+"""
+import os
+import time
+
+from dotenv import dotenv_values
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() != "false"
+
+# These defaults must be in place before the settings are read. Values set in
+# the environment or in .env (where Settings also looks) win.
+_configured = {**dotenv_values(".env"), **os.environ}
+
+
+def _default(name: str, value: str) -> str:
+    if name not in _configured:
+        os.environ[name] = _configured[name] = value
+    return _configured[name]
+
+
+if preload_app:
+    _default("WORKER_START_METHOD", "fork")
+if (workers > 1 and _configured.get("WORKER_POOL_MODE", "process") == "process"
+        and _configured.get("WORKER_START_METHOD", "spawn") != "fork"):
+    # Warming up would load a private CLIP in every CPU worker of every gunicorn
+    # worker, including those that never run a job.
+    _default("WORKER_WARMUP", "false")
+
+from app.core.config import settings  # noqa: E402
+
+
+def when_ready(server):
+    if not settings.WORKER_WARMUP:
+        server.log.info("Worker warm-up is off: spawned CPU workers load CLIP on their first job.")
+    if not (preload_app and settings.PRELOAD_CLIP_BEFORE_FORK):
+        return
+    from app.services import workers as pipeline_workers
+
+    started = time.perf_counter()
+    if pipeline_workers.preload_for_fork():
+        server.log.info(f"Preloaded CLIP in the master in {time.perf_counter() - started:.1f}s; workers will share it.")
+
+
+def post_fork(server, worker):
+    # SQLite connections opened in the master must not be shared with the children.
+    from app.models.job import engine
+    engine.dispose(close=False)